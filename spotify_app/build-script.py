@@ -47,6 +47,13 @@ def build_exe():
             # Добавляем все ресурсы uiautomator2
             f'--add-data={uiautomator2_path}{os.pathsep}uiautomator2',
             '--hidden-import=uiautomator2',
+            # Рабочие потоки импортируются лениво (ui/main_window.py: WORKER_CLASSES)
+            '--hidden-import=core.spotify_worker',
+            '--hidden-import=core.apple_music_worker',
+            '--hidden-import=core.mix_worker',
+            '--hidden-import=core.proxy_worker',
+            '--hidden-import=core.sharded_worker',
+            '--hidden-import=telebot',
             # Добавляем дополнительные импорты
             '--hidden-import=PIL',
             '--hidden-import=pillow',
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import uiautomator2 as u2
+
+from utils.logging_config import run_in_executor
+from utils.metrics import watch_executor
+from .event_log import record_event, STEP_LIFECYCLE
+
+logger = logging.getLogger(__name__)
+
+# Пакеты приложений, с которыми работает автоматизация
+SPOTIFY_PACKAGE = 'com.spotify.music'
+APPLE_MUSIC_PACKAGE = 'com.apple.android.music'
+SURFBOARD_PACKAGE = 'com.getsurfboard'
+
+# Маркеры, которые печатает сценарий в stdout
+READY_MARKER = 'LIFECYCLE_READY'
+TIMEOUT_MARKER = 'LIFECYCLE_TIMEOUT'
+DONE_MARKER = 'LIFECYCLE_DONE'
+
+WAIT_PIDOF = 'pidof'
+WAIT_RESUMED = 'resumed'
+WAIT_NONE = 'none'
+
+
+def shell_output(device: u2.Device, command: str, timeout: float = 10) -> str:
+    """Вывод adb shell команды (разные версии uiautomator2 возвращают ShellResponse или кортеж)"""
+    response = device.shell(command, timeout=timeout)
+    output = getattr(response, 'output', None)
+    if output is None:
+        output = response[0] if isinstance(response, (tuple, list)) else str(response)
+    return output
+
+
+@dataclass
+class LifecycleScript:
+    """Сценарий жизненного цикла приложений, выполняемый одной adb shell сессией"""
+    stop_packages: List[str] = field(default_factory=list)
+    launch_package: Optional[str] = None
+    launch_activity: Optional[str] = None  # None - запуск через monkey (LAUNCHER intent)
+    wait_mode: str = WAIT_PIDOF  # pidof / resumed / none
+    wait_timeout: float = 15.0
+    poll_interval: float = 0.5
+    settle_delay: float = 0.0  # Пауза между force-stop и запуском
+    no_animation: bool = False  # am start --activity-no-animation вместо monkey
+    return_package: Optional[str] = None  # После ожидания сразу вернуть это приложение на передний план
+
+    def _launch_command(self, package: str, activity: Optional[str] = None) -> str:
+        if activity:
+            flags = " --activity-no-animation" if self.no_animation else ""
+            return f"am start{flags} -n {package}/{activity} >/dev/null 2>&1"
+        if self.no_animation:
+            return (f"am start --activity-no-animation -a android.intent.action.MAIN "
+                    f"-c android.intent.category.LAUNCHER {package} >/dev/null 2>&1")
+        return f"monkey -p {package} -c android.intent.category.LAUNCHER 1 >/dev/null 2>&1"
+
+    def render(self) -> str:
+        """Собирает shell-сценарий в одну строку"""
+        commands = [f"am force-stop {package}" for package in self.stop_packages]
+
+        if self.settle_delay > 0:
+            commands.append(f"sleep {self.settle_delay:g}")
+
+        if self.launch_package:
+            commands.append(self._launch_command(self.launch_package, self.launch_activity))
+
+            if self.wait_mode != WAIT_NONE:
+                ticks = max(1, int(self.wait_timeout / self.poll_interval))
+                if self.wait_mode == WAIT_RESUMED:
+                    check = (f"dumpsys activity activities | "
+                             f"grep -E '(mResumedActivity|topResumedActivity).*{self.launch_package}' >/dev/null")
+                else:
+                    check = f"pidof {self.launch_package} >/dev/null"
+                commands.append(
+                    f"i=0; while [ $i -lt {ticks} ]; do "
+                    f"if {check}; then echo {READY_MARKER}; break; fi; "
+                    f"sleep {self.poll_interval:g}; i=$((i+1)); done; "
+                    f"[ $i -ge {ticks} ] && echo {TIMEOUT_MARKER}"
+                )
+
+            if self.return_package:
+                commands.append(self._launch_command(self.return_package))
+
+        commands.append(f"echo {DONE_MARKER}")
+        return "; ".join(commands)
+
+    @property
+    def shell_timeout(self) -> float:
+        """Таймаут всей shell сессии с запасом на force-stop и запуск"""
+        return self.wait_timeout + self.settle_delay + 15
+
+
+@dataclass
+class LifecycleResult:
+    """Результат выполнения сценария на одном устройстве"""
+    device_id: str
+    success: bool = False
+    ready: bool = False
+    elapsed: float = 0.0
+    output: str = ""
+    error: Optional[str] = None
+
+
+def restart_app_script(package: str, activity: Optional[str] = None, extra_stop: Iterable[str] = (),
+                       wait_mode: str = WAIT_RESUMED, wait_timeout: float = 15.0) -> LifecycleScript:
+    """Сценарий: остановить приложение (и связанные пакеты) и запустить его заново"""
+    return LifecycleScript(
+        stop_packages=[*extra_stop, package],
+        launch_package=package,
+        launch_activity=activity,
+        wait_mode=wait_mode,
+        wait_timeout=wait_timeout
+    )
+
+
+def launch_app_script(package: str, activity: Optional[str] = None,
+                      wait_mode: str = WAIT_RESUMED, wait_timeout: float = 15.0) -> LifecycleScript:
+    """Сценарий: вывести приложение на передний план без остановки"""
+    return LifecycleScript(
+        launch_package=package,
+        launch_activity=activity,
+        wait_mode=wait_mode,
+        wait_timeout=wait_timeout
+    )
+
+
+def prewarm_app_script(package: str, return_package: str, wait_timeout: float = 5.0) -> LifecycleScript:
+    """
+    Сценарий прогрева: запустить процесс приложения и сразу вернуть текущее.
+
+    am start без -W не ждет отрисовки, ожидание - только появления процесса
+    (pidof), поэтому текущее приложение уходит с переднего плана примерно на
+    время запуска процесса, а не на время полной загрузки интерфейса.
+    """
+    return LifecycleScript(
+        launch_package=package,
+        wait_mode=WAIT_PIDOF,
+        wait_timeout=wait_timeout,
+        poll_interval=0.2,
+        no_animation=True,
+        return_package=return_package
+    )
+
+
+class AppLifecycle:
+    """
+    Пакетное управление жизненным циклом приложений.
+
+    Вместо цепочки app_stop/app_start с фиксированными паузами весь сценарий
+    (force-stop нескольких пакетов, запуск, ожидание pidof/resumed activity)
+    уходит на устройство одной командой adb shell.
+    """
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None, max_workers: int = 20):
+        self._executor = executor
+        self._own_executor = executor is None
+        self._max_workers = max_workers
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                thread_name_prefix='lifecycle')
+            watch_executor('lifecycle', self._executor)
+        return self._executor
+
+    def run_sync(self, device: u2.Device, script: LifecycleScript, device_id: str = "") -> LifecycleResult:
+        """Выполняет сценарий на устройстве (блокирующий вызов)"""
+        device_id = device_id or getattr(device, 'serial', '') or ""
+        result = LifecycleResult(device_id=device_id)
+        start_time = time.time()
+        try:
+            output = shell_output(device, script.render(), script.shell_timeout)
+            result.output = output
+            result.ready = READY_MARKER in output
+            result.success = DONE_MARKER in output and (
+                script.wait_mode == WAIT_NONE or not script.launch_package or result.ready
+            )
+            if not result.success:
+                logger.warning(f"Lifecycle on {device_id} finished without readiness: {output.strip()[-200:]}")
+        except Exception as e:
+            result.error = str(e)
+            logger.error(f"Lifecycle script failed on {device_id}: {str(e)}")
+        finally:
+            result.elapsed = time.time() - start_time
+
+        record_event(device_id, script.launch_package or '', STEP_LIFECYCLE,
+                     'ok' if result.success else 'failed', latency=result.elapsed)
+        logger.debug(f"Lifecycle on {device_id}: success={result.success}, {result.elapsed:.1f}s")
+        return result
+
+    async def run(self, device: u2.Device, script: LifecycleScript, device_id: str = "") -> LifecycleResult:
+        """Асинхронное выполнение сценария в пуле потоков"""
+        return await run_in_executor(self.executor, self.run_sync, device, script, device_id)
+
+    def fan_out(self, device_ids: Iterable[str], script: LifecycleScript,
+                connections: Optional[Dict[str, u2.Device]] = None) -> Dict[str, asyncio.Future]:
+        """
+        Запускает сценарий на всех устройствах одновременно.
+
+        Returns:
+            Dict[str, asyncio.Future]: future завершения для каждого устройства
+        """
+        loop = asyncio.get_running_loop()
+        connections = connections or {}
+        futures = {}
+
+        def job(device_id: str) -> LifecycleResult:
+            try:
+                device = connections.get(device_id) or u2.connect(device_id)
+            except Exception as e:
+                logger.error(f"Failed to connect to {device_id}: {str(e)}")
+                return LifecycleResult(device_id=device_id, error=str(e))
+            return self.run_sync(device, script, device_id)
+
+        for device_id in device_ids:
+            futures[device_id] = loop.run_in_executor(self.executor, job, device_id)
+
+        return futures
+
+    async def run_all(self, device_ids: Iterable[str], script: LifecycleScript,
+                      connections: Optional[Dict[str, u2.Device]] = None) -> Dict[str, LifecycleResult]:
+        """Выполняет сценарий на всех устройствах и ждет завершения"""
+        futures = self.fan_out(device_ids, script, connections)
+        results = await asyncio.gather(*futures.values(), return_exceptions=True)
+
+        collected = {}
+        for device_id, result in zip(futures.keys(), results):
+            if isinstance(result, Exception):
+                result = LifecycleResult(device_id=device_id, error=str(result))
+            collected[device_id] = result
+        return collected
+
+    def shutdown(self):
+        """Освобождение пула потоков"""
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -1,279 +1,44 @@
-import random
 import time
 import uiautomator2 as u2
-import telebot
-import pyautogui as pg
 import json
 from datetime import datetime
 import os
-import socket
 import logging
 import re
-from threading import Lock
-from typing import List, Dict, Optional, Set
-from dataclasses import dataclass, field
-from contextlib import contextmanager
+from typing import List, Dict, Optional
 import asyncio
 from utils.config import Config
+from utils.logging_config import set_log_device, run_in_executor
+from utils.metrics import SEARCH_LATENCY, ANR_HITS, DEVICE_RECONNECTS, watch_executor
+from utils.loop_watchdog import watch_event_loop
 from concurrent.futures import ThreadPoolExecutor
+from .app_lifecycle import AppLifecycle, restart_app_script, APPLE_MUSIC_PACKAGE
+from .automation_base import BaseAutomation, DeviceState, is_device_error
+from .track_catalog import TrackCatalog
 
 logger = logging.getLogger(__name__)
 
-@dataclass
-class DeviceState:
-    """Состояние устройства"""
-    device_id: str = ""
-    played_songs: Set[str] = field(default_factory=set)
-    lock: Lock = field(default_factory=Lock)
-    current_file: int = 1
-    total_songs: int = 0
-    songs_played: int = 0
-    track_plays: Dict[str, int] = field(default_factory=dict)
-    config: Optional[Config] = None
+class AppleMusicAutomation(BaseAutomation):
+    """Драйвер Apple Music поверх общего ядра автоматизации"""
 
-    def __post_init__(self):
-        self._load_track_plays()
-    
-    def _load_track_plays(self):
-        """Загрузка истории проигрываний для конкретного устройства"""
-        try:
-            # Проверяем наличие конфигурации
-            if not self.config:
-                # Используем значение по умолчанию или создаем временную конфигурацию
-                self.config = Config()  # Или другое значение по умолчанию
-                # Можно также залогировать это событие
-                logger.warning(f"No config for device {self.device_id}, using default")
-                
-            # Определяем сервис
-            service_type = getattr(self.config, 'service_type', 'spotify')  # Значение по умолчанию
-            
-            # Убеждаемся, что директория существует
-            os.makedirs('data', exist_ok=True)
-            
-            # Определяем путь к файлу кэша
-            cache_file = f'data/{service_type}_track_plays.json'
-            
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    all_devices_data = json.load(f)
-                    self.track_plays = all_devices_data.get(self.device_id, {})
-                    logger.debug(f"Loaded track plays for {self.device_id}: {len(self.track_plays)} tracks")
-            else:
-                self.track_plays = {}
-                logger.info(f"No track plays file found for {self.device_id}, starting fresh")
-        except Exception as e:
-            logger.error(f"Error loading track plays for device {self.device_id}: {str(e)}")
-            self.track_plays = {}
-            
-    def _save_track_plays(self):
-        """Сохранение истории проигрываний для конкретного устройства"""
-        try:
-            os.makedirs('data', exist_ok=True)
-            cache_file = 'data/apple_track_plays.json'
-            
-            all_devices_data = {}
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r') as f:
-                    all_devices_data = json.load(f)
-            
-            all_devices_data[self.device_id] = self.track_plays
-            
-            temp_file = f"{cache_file}.tmp"
-            with open(temp_file, 'w') as f:
-                json.dump(all_devices_data, f, indent=4)
-            os.replace(temp_file, cache_file)
-            
-        except Exception as e:
-            logger.error(f"Error saving track plays for device {self.device_id}: {str(e)}")
-
-    def can_play_track(self, track: str) -> bool:
-        """Проверка возможности проигрывания трека для конкретного устройства"""
-        if not self.config:
-            return True
-        current_plays = self.track_plays.get(track, 0)
-        can_play = current_plays < self.config.max_plays_per_track
-        if not can_play:
-            logger.debug(f"Device {self.device_id}: Track '{track}' reached max plays ({current_plays}/{self.config.max_plays_per_track})")
-        return can_play
+    SERVICE_TYPE = Config.SERVICE_APPLE_MUSIC
+    SERVICE_NAME = "Apple Music"
+    STATE_KEY = "apple"
+    ERROR_LOG = "data/logs/errors_apple.log"
+    # Прокси для Apple Music сейчас не используется (check_proxy/restart_proxy_full - заглушки),
+    # поэтому фоновый монитор не запускается
+    PROXY_CHECKS_ENABLED = False
 
-class AppleMusicAutomation:
-    def __init__(self, config: Config):
-        self.config = config
-        self.bot = telebot.TeleBot(config.token)
-        self.device_states = {}
-        self.state_lock = Lock()
-        self.devicelist = []
-        self.on_device_progress = None
-        self.on_status_update = None
-        self.running = True
-        self.artists_not_found = []
+    def __init__(self, config: Config, catalog: Optional[TrackCatalog] = None):
+        super().__init__(config, catalog)
+        self.artists_not_found = self.state_store.quarantine  # Сохраняется в контрольной точке
         self.device_locks = {}  # ДОБАВИТЬ
         self.executor = ThreadPoolExecutor(max_workers=20)  # ДОБАВИТЬ
+        watch_executor('apple_music', self.executor)
+        self.lifecycle = AppLifecycle(self.executor)  # Пакетные сценарии запуска/остановки приложений
         self._load_cache()
+        self.state_store.start()
 
-    def get_device_state(self, device: str) -> DeviceState:
-        with self.state_lock:
-            if device not in self.device_states:
-                state = DeviceState(device_id=device)
-                state.config = self.config
-                self.device_states[device] = state
-            return self.device_states[device]
-
-    def _periodic_cache_save(self):
-        """Периодическое сохранение кэша и статистики проигрываний"""
-        try:
-            self._save_cache()
-            # Сохраняем статистику для каждого устройства
-            for device, state in self.device_states.items():
-                state._save_track_plays()
-                # Обновляем UI через callback если он установлен
-                if self.on_device_progress:
-                    self.on_device_progress(device, state.songs_played, state.total_songs)
-                    logger.debug(f"Updated UI progress for device {device}: {state.songs_played}/{state.total_songs}")
-        except Exception as e:
-            logger.error(f"Error in periodic cache save: {str(e)}")
-
-    def _load_cache(self):
-        """Загрузка состояния из кэша"""
-        try:
-            cache_file = "data/apple_cache.json"
-            if os.path.exists(cache_file):
-                with open(cache_file, "r") as f:
-                    cached_data = json.load(f)
-                    for device, songs in cached_data.items():
-                        state = self.get_device_state(device)
-                        state.played_songs.update(songs.get("lines", []))
-                        state.current_file = songs.get("count", 1)
-                        state.songs_played = songs.get("songs_played", 0)
-                        state.total_songs = songs.get("total_songs", 0)
-                    logger.info(f"Cache loaded successfully from {cache_file}")
-                    
-                    # Обновляем прогресс через callback если он установлен
-                    if self.on_device_progress:
-                        for device, state in self.device_states.items():
-                            self.on_device_progress(device, state.songs_played, state.total_songs)
-            else:
-                logger.info("No cache file found, starting fresh")
-        except Exception as e:
-            logger.error(f"Error loading cache: {str(e)}")
-
-    def _save_cache(self, is_except: bool = False):
-        """Сохранение кэша"""
-        try:
-            os.makedirs('data', exist_ok=True)
-            filename = "data/apple_cache_except.json" if is_except else "data/apple_cache.json"
-            cache_data = {}
-            
-            for device, state in self.device_states.items():
-                cache_data[device] = {
-                    "lines": list(state.played_songs),
-                    "count": state.current_file,
-                    "songs_played": state.songs_played,
-                    "total_songs": state.total_songs
-                }
-            
-            temp_file = f"{filename}.tmp"
-            with open(temp_file, "w") as f:
-                json.dump(cache_data, f, indent=4)
-            os.replace(temp_file, filename)
-            
-            logger.info(f"Cache saved successfully to {filename}")
-            
-            # Обновляем UI после успешного сохранения
-            if self.on_device_progress:
-                for device, state in self.device_states.items():
-                    self.on_device_progress(device, state.songs_played, state.total_songs)
-        except Exception as e:
-            logger.error(f"Error saving cache: {str(e)}")
-
-    def reset_play_statistics(self):
-        """Сброс статистики прослушиваний"""
-        try:
-            # Очищаем статистику для всех устройств
-            for device, state in self.device_states.items():
-                state.track_plays.clear()
-                state._save_track_plays()
-                
-            # Очищаем файлы статистики
-            stats_files = {
-                'apple': 'data/apple_track_plays.json'
-            }
-            
-            service_type = self.config.service_type
-            stats_file = stats_files.get(service_type)
-            
-            if stats_file and os.path.exists(stats_file):
-                # Сохраняем пустой словарь в файл
-                with open(stats_file, 'w') as f:
-                    json.dump({}, f)
-                
-                logger.info(f"Play statistics reset for {service_type}")
-                return True
-        except Exception as e:
-            logger.error(f"Error resetting play statistics: {str(e)}")
-            return False
-
-
-    @contextmanager
-    def error_handling(self, device):
-        """Контекстный менеджер для обработки ошибок"""
-        try:
-            yield
-        except Exception as e:
-            if 'JsonRpcError' in str(type(e)):
-                self._handle_error("JsonRpcError", device, True)
-        except u2.exceptions.UiAutomationNotConnectedError as ue:
-            self._handle_error("UiAutomationNotConnectedError", ue, device, False)
-        except Exception as ex:
-            self._handle_error("GeneralException", ex, device, True)
-
-    def get_name(self, device: str) -> Optional[List[str]]:
-        state = self.get_device_state(device)
-        with state.lock:
-            total_available = 0
-            prefix = "apple" if self.config.service_type == "apple_music" else self.config.service_type
-            for i in range(1, 1000):
-                file_path = f"data/database_part_{prefix}_{i}.txt"
-                if not os.path.exists(file_path):
-                    break
-                with open(file_path) as f:
-                    for line in f:
-                        track = line.strip()
-                        if track and state.can_play_track(track):
-                            total_available += 1
-            
-            if total_available == 0:
-                logger.info(f"Device {device} has no more tracks available due to play limits")
-                return None
-            
-            # Поиск трека
-            while True:
-                file_path = f"data/database_part_{prefix}_{state.current_file}.txt"
-                if not os.path.exists(file_path):
-                    if state.current_file == 1 and state.songs_played > 0:
-                        logger.info(f"Device {device} has played all songs in this cycle")
-                        return None
-                    state.current_file = 1
-                    state.played_songs.clear()
-                    continue
-                
-                with open(file_path) as f:
-                    available_songs = []
-                    for line in f:
-                        track = line.strip()
-                        if track and track not in state.played_songs and state.can_play_track(track):
-                            available_songs.append(track)
-                
-                if not available_songs:
-                    state.current_file += 1
-                    continue
-                    
-                song = random.choice(available_songs)
-                state.played_songs.add(song)
-                state.track_plays[song] = state.track_plays.get(song, 0) + 1
-                state._save_track_plays()
-                return [song]
-            
     async def wait_for_search_results(self, d, timeout=15):
         """
         Ожидает загрузки результатов поиска в Apple Music.
@@ -345,6 +110,7 @@ class AppleMusicAutomation:
             d.send_keys(name_artist)
             time.sleep(1)
             d.press('enter')            
+            search_started = time.time()
             logger.info(f"Запрос '{name_artist}' введен, Enter нажат")
             
             # 2. БЫСТРАЯ ПРОВЕРКА (5 СЕКУНД)
@@ -352,6 +118,7 @@ class AppleMusicAutomation:
             quick_result = await self._wait_for_search_results(d, timeout=5)
             
             if quick_result:
+                SEARCH_LATENCY.labels(self.STATE_KEY).observe(time.time() - search_started)
                 # 3А. РЕЗУЛЬТАТЫ ЗАГРУЗИЛИСЬ БЫСТРО - СРАЗУ ВКЛЮЧАЕМ
                 logger.info("✅ Результаты загружены за 5 сек - включаем трек")
                 success = await self._play_first_result(d, name_artist)
@@ -361,7 +128,7 @@ class AppleMusicAutomation:
                     logger.info(f"🎵 Трек '{name_artist}' успешно включен")
                 else:
                     logger.warning(f"❌ Не удалось включить трек '{name_artist}'")
-                    self.artists_not_found.append(name_artist)
+                    self.mark_not_found(name_artist)
                 return
             
             # 3Б. РЕЗУЛЬТАТЫ НЕ ЗАГРУЗИЛИСЬ - ЖДЕМ ЕЩЕ 7 СЕКУНД
@@ -369,6 +136,7 @@ class AppleMusicAutomation:
             extended_result = await self._wait_for_search_results(d, timeout=7)
             
             if extended_result:
+                SEARCH_LATENCY.labels(self.STATE_KEY).observe(time.time() - search_started)
                 # 4А. ЗАГРУЗИЛИСЬ ПОСЛЕ ДОПОЛНИТЕЛЬНОГО ОЖИДАНИЯ
                 logger.info("✅ Результаты загружены после дополнительного ожидания - включаем")
                 success = await self._play_first_result(d, name_artist)
@@ -377,11 +145,11 @@ class AppleMusicAutomation:
                 if success:
                     logger.info(f"🎵 Трек '{name_artist}' включен после ожидания")
                 else:
-                    self.artists_not_found.append(name_artist)
+                    self.mark_not_found(name_artist)
             else:
                 # 4Б. НЕ ЗАГРУЗИЛИСЬ И ПОСЛЕ 12 СЕКУНД ОБЩЕГО ОЖИДАНИЯ
                 logger.warning(f"⚠️ Результаты для '{name_artist}' не загрузились за 12 сек - пропускаем")
-                self.artists_not_found.append(name_artist)
+                self.mark_not_found(name_artist)
                 await self._clear_search_field(d)
 
         except Exception as e:
@@ -543,37 +311,27 @@ class AppleMusicAutomation:
 
     async def process_device(self, device: str):
         """Оптимизированная обработка устройства с умным таймингом"""
+        set_log_device(device)
         state = self.get_device_state(device)
         logger.info(f"🚀 Запуск обработки устройства {device}. Всего треков: {state.total_songs}")
         
-        last_proxy_check = time.time()
-        proxy_check_interval = 3600  # 1 час
-        
         while state.songs_played < state.total_songs and self.running:
-            # Проверка прокси раз в час
-            current_time = time.time()
-            if current_time - last_proxy_check >= proxy_check_interval:
-                try:
-                    d = u2.connect(device)
-                    proxy_status = await self.check_proxy(d, device)
-                    if not proxy_status:
-                        logger.warning(f"Прокси на {device} не работает, перезапускаем")
-                        await self.restart_proxy_full(d, device)
-                    last_proxy_check = current_time
-                except Exception as e:
-                    logger.error(f"Ошибка проверки прокси: {str(e)}")
+            # Устройство с открытым предохранителем ждет успешной проверки
+            if not await self.wait_device_available(device):
+                return
             
             # Основная логика обработки трека
             retries = self.config.retry_attempts
             track_processed = False
             
             while retries > 0 and self.running and not track_processed:
+                name_artist = None
                 try:
                     # Подключаемся к устройству
                     d = u2.connect(device)
                     
                     # Получаем следующий трек
-                    result = self.get_name(device)
+                    result = await self.next_track(device)
                     if not result:
                         logger.info(f"✅ Устройство {device} обработало все доступные треки")
                         return
@@ -585,24 +343,24 @@ class AppleMusicAutomation:
                     await self.search_and_play(d, name_artist)
                     
                     # Обновляем статистику
-                    state.songs_played += 1
+                    self.state_store.commit_play(state, name_artist)
+                    self.breakers.record_success(device)
                     track_processed = True
                     
-                    # Обновляем UI
-                    if self.on_device_progress:
-                        self.on_device_progress(device, state.songs_played, state.total_songs)
-                    
-                    # Периодическое сохранение кэша
-                    if state.songs_played % 10 == 0:
-                        self._periodic_cache_save()
+                    # Запись на диск - фоновым таймером, UI - сразу
+                    self.state_store.report_progress(device, state.songs_played, state.total_songs)
                     
                     progress_percent = (state.songs_played / state.total_songs) * 100
                     logger.info(f"📊 Устройство {device}: {state.songs_played}/{state.total_songs} ({progress_percent:.1f}%)")
                     
                 except Exception as e:
                     logger.error(f"❌ Ошибка на устройстве {device}, попытка {self.config.retry_attempts - retries + 1}: {str(e)}")
+                    if name_artist:
+                        self.state_store.release(device, name_artist)
                     retries -= 1
                     
+                    if retries > 0:
+                        DEVICE_RECONNECTS.labels(device).inc()  # Следующая попытка подключается заново
                     if retries == 0:
                         logger.error(f"💥 Максимум попыток достигнут для устройства {device}")
                         self._handle_error("MaxRetriesExceeded", e, device, True)
@@ -619,20 +377,18 @@ class AppleMusicAutomation:
         
         logger.info(f"🏁 Устройство {device} завершило обработку всех треков")
 
+    def restart_app(self, d) -> bool:
+        return self.restart_apple(d)
+
     def restart_apple(self, d):
         """Перезапуск Apple Music"""
         try:
-            # Принудительная остановка приложения
-            d.app_stop("com.apple.android.music")
-            time.sleep(3)
-            
-            # Запуск приложения
-            d.app_start("com.apple.android.music", use_monkey=True)
-            time.sleep(5)
+            # Остановка, запуск через monkey и ожидание resumed activity одной shell сессией
+            result = self.lifecycle.run_sync(d, restart_app_script(APPLE_MUSIC_PACKAGE))
             
             # Проверка запуска приложения
-            if not d.app_wait("com.apple.android.music", timeout=10):
-                logger.error("com.apple.android.music is not running")
+            if not result.success:
+                logger.error(f"{APPLE_MUSIC_PACKAGE} is not running")
                 return False
             
             # Ожидание загрузки интерфейса
@@ -663,30 +419,6 @@ class AppleMusicAutomation:
             logger.error(f"Failed to restart Apple Music: {str(e)}")
             return False
 
-    def split_database(self, file_path: str):
-        """Разделение базы данных на части"""
-        logger.info(f"Splitting database from {file_path}")
-        os.makedirs('data', exist_ok=True)
-        small_file_number = 1
-        try:
-            with open(file_path, 'r') as big_file:
-                small_file = None
-                for lineno, line in enumerate(big_file):
-                    if lineno % self.config.lines_per_file == 0:
-                        if small_file:
-                            small_file.close()
-                        small_file_name = f"data/database_part_apple_{small_file_number}.txt"
-                        small_file = open(small_file_name, 'w')
-                        small_file_number += 1
-                        logger.debug(f"Created new database part: {small_file_name}")
-                    small_file.write(line)
-                if small_file:
-                    small_file.close()
-            logger.info(f"Database split completed. Created {small_file_number-1} parts")
-        except Exception as e:
-            logger.error(f"Error splitting database: {str(e)}")
-            raise
-
     def stop(self):
         """Остановка автоматизации"""
         try:
@@ -695,6 +427,7 @@ class AppleMusicAutomation:
             self.cleanup()
             
             # Сохраняем текущее состояние
+            self.state_store.stop()
             self._save_cache()
             
             # Отправляем уведомление о ручной остановке
@@ -712,7 +445,7 @@ class AppleMusicAutomation:
                 self.bot.send_message(self.config.chat_id, message)
                 
                 # Отправляем текущий файл статистики
-                stats_file = f"data/{self.config.service_type}_track_plays.json"
+                stats_file = self.state_store.plays_file
                 if os.path.exists(stats_file):
                     with open(stats_file, 'rb') as stats:
                         self.bot.send_document(
@@ -738,78 +471,6 @@ class AppleMusicAutomation:
         except Exception as e:
             logger.error(f"Error during stop process: {str(e)}")
 
-    def initialize_devices(self):
-        """Инициализация списка устройств"""
-        if self.config.use_adb_device_detection:
-            # Используем ADB для получения серийных номеров устройств
-            from utils.adb_chek import ADBChecker
-            adb_checker = ADBChecker()
-            
-            if not adb_checker.initialize_environment():
-                logger.error("Failed to initialize ADB environment")
-                # Fallback на метод портов
-                self._initialize_devices_by_ports()
-                return
-                
-            device_ids = adb_checker.get_connected_devices()
-            if device_ids:
-                logger.info(f"Found {len(device_ids)} devices via ADB: {device_ids}")
-                self.devicelist = device_ids
-            else:
-                logger.warning("No devices found via ADB, falling back to IP:port method")
-                self._initialize_devices_by_ports()
-        else:
-            # Используем традиционный метод IP:порт
-            self._initialize_devices_by_ports()
-
-    def _initialize_devices_by_ports(self):
-        """Инициализация устройств по портам (исходный метод)"""
-        open_ports = self.check_ports()
-        if open_ports:
-            logger.info(f"Открытые порты на {self.config.bluestacks_ip}: {open_ports}")
-            self.devicelist = [f'{self.config.bluestacks_ip}:{port}' for port in open_ports]
-        else:
-            logger.warning(f"Нет открытых портов на {self.config.bluestacks_ip}")
-
-    def check_ports(self) -> List[int]:
-        """Проверка открытых портов"""
-        open_ports = []
-        for port in range(self.config.start_port, self.config.end_port, self.config.port_step):
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(1)
-                if s.connect_ex((self.config.bluestacks_ip, port)) == 0:
-                    open_ports.append(port)
-        return open_ports
-
-    def _handle_error(self, error_type: str, error: Exception, device, screenshot: bool):
-        """Централизованная обработка ошибок"""
-        logger.error(f"{error_type}: {str(error)}")
-        self._save_error_log(error_type, error)
-        self.process_exception(device, screenshot)
-
-    def _save_error_log(self, error_type: str, error: Exception):
-        """Сохранение ошибок в лог"""
-        os.makedirs('data/logs', exist_ok=True)
-        with open("data/logs/errors_apple.log", "a") as error_file:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            error_file.write(f"[{timestamp}] {error_type}: {str(error)}\n")
-
-    def process_exception(self, device_addr: str, screenshot: bool = True):
-        """Обработка исключений"""
-        self._save_cache(is_except=True)
-        logger.info('RESTART Apple Music')
-        try:
-            d = u2.connect(device_addr)
-            self.restart_apple(d)
-            if screenshot:
-                screenshot_path = os.path.join('data', 'screenshots', f'error_{datetime.now().strftime("%Y%m%d_%H%M%S")}.png')
-                os.makedirs(os.path.dirname(screenshot_path), exist_ok=True)
-                pg.screenshot(screenshot_path)
-                with open(screenshot_path, 'rb') as img:    
-                    self.bot.send_photo(self.config.chat_id, img, caption='Server Apple Music Except')
-        except Exception as e:
-            logger.error(f"Failed to process exception for device {device_addr}: {str(e)}")
-
     def save_artists_not_found(self):
         """Сохранение списка не найденных артистов"""
         os.makedirs('data', exist_ok=True)
@@ -819,13 +480,11 @@ class AppleMusicAutomation:
     async def _send_completion_report(self):
         """Отправка отчета о завершении"""
         try:
-            screenshot_path = os.path.join('data', 'screenshots', f'completion_{datetime.now().strftime("%Y%m%d_%H%M%S")}.png')
-            os.makedirs(os.path.dirname(screenshot_path), exist_ok=True)
-            pg.screenshot(screenshot_path)
-            with open(screenshot_path, 'rb') as img:
-                self.bot.send_photo(self.config.chat_id, img, caption='Server Apple Music Good')
+            # Сводный скриншот устройств собирается в фоне
+            self.screenshots.capture_sheet(self.devicelist, 'completion', caption='Server Apple Music Good',
+                                           send=self._send_photo)
             
-            with open('data/apple_cache.json', 'rb') as file:
+            with open(self.state_store.export_cache(), 'rb') as file:
                 self.bot.send_document(self.config.chat_id, file)
             
             # Сохраняем и отправляем список ненайденных артистов
@@ -843,7 +502,7 @@ class AppleMusicAutomation:
 
         if not_way.exists() or add_collect.exists():
             logger.info(f'Wrong navigation for {name_artist}, returning back')
-            self.artists_not_found.append(name_artist)
+            self.mark_not_found(name_artist)
             d(description="Navigate up").click()
 
     @staticmethod
@@ -867,6 +526,7 @@ class AppleMusicAutomation:
         for device in self.devicelist:
             state = self.get_device_state(device)
             state.total_songs = total_songs
+        self.state_store.mark_all_dirty(self.devicelist)
         
         # ГЛАВНЫЙ ЦИКЛ - обрабатываем устройства по кругу
         current_device_index = 0
@@ -924,7 +584,7 @@ class AppleMusicAutomation:
                 return False
             
             # Получаем следующий трек
-            result = self.get_name(device)
+            result = await self.next_track(device)
             if not result:
                 logger.info(f"📭 Нет доступных треков для устройства {device}")
                 return False
@@ -942,15 +602,10 @@ class AppleMusicAutomation:
                     await self.search_and_play(d, name_artist)
                     
                     # Обновляем статистику
-                    state.songs_played += 1
+                    self.state_store.commit_play(state, name_artist)
                     
-                    # Обновляем UI
-                    if self.on_device_progress:
-                        self.on_device_progress(device, state.songs_played, state.total_songs)
-                    
-                    # Периодическое сохранение
-                    if state.songs_played % 10 == 0:
-                        self._periodic_cache_save()
+                    # Запись на диск - фоновым таймером, UI - сразу
+                    self.state_store.report_progress(device, state.songs_played, state.total_songs)
                     
                     progress_percent = (state.songs_played / state.total_songs) * 100
                     logger.info(f"📊 {device}: {state.songs_played}/{state.total_songs} ({progress_percent:.1f}%)")
@@ -961,10 +616,13 @@ class AppleMusicAutomation:
                     logger.error(f"❌ Ошибка на {device}: {str(e)}")
                     retries -= 1
                     if retries > 0:
+                        DEVICE_RECONNECTS.labels(device).inc()
                         await asyncio.sleep(2)
                     else:
                         logger.error(f"💥 Максимум попыток для {device}")
-                        # Все равно считаем трек обработанным, чтобы перейти к следующему
+                        # Все равно считаем трек обработанным, чтобы перейти к следующему,
+                        # но проигрывание не засчитываем
+                        self.state_store.release(device, name_artist)
                         state.songs_played += 1
                         return True
             
@@ -1037,13 +695,8 @@ class AppleMusicAutomation:
                             f"file={state.current_file}, played={state.songs_played}, "
                             f"tracks with plays={len(state.track_plays)}")
             
-            # Очищаем кэш-файл
-            os.makedirs('data', exist_ok=True)
-            cache_file = f"data/{self.config.service_type}_cache.json"
-            logger.debug(f"Clearing cache file: {cache_file}")
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f)
-            logger.debug(f"Cache file {cache_file} cleared successfully")
+            # Перезаписываем контрольные точки чистым состоянием цикла
+            self.state_store.reset_cycle()
             
             logger.info('State successfully reset for new cycle')
             return True
@@ -1157,78 +810,6 @@ class AppleMusicAutomation:
         logger.debug(f"Proxy restart disabled for {device_addr}")
         return True
 
-    def check_play_limits_reached(self) -> bool:
-        """Проверка достижения лимитов проигрывания для каждого устройства"""
-        try:
-            stats_file = f"data/{self.config.service_type}_track_plays.json"
-            if not os.path.exists(stats_file):
-                logger.info("No play statistics file found, limits not reached")
-                return False
-                    
-            with open(stats_file, 'r') as f:
-                all_devices_data = json.load(f)
-                    
-            if not all_devices_data:
-                logger.info("Empty play statistics, limits not reached")
-                return False
-
-            # Получаем общее количество треков в базе
-            total_tracks_in_db = 0
-            prefix = "spotify" if self.config.service_type == "spotify" else "apple"
-            for i in range(1, 1000):
-                file_path = f"data/database_part_{prefix}_{i}.txt"
-                if not os.path.exists(file_path):
-                    break
-                
-                with open(file_path) as f:
-                    total_tracks_in_db += sum(1 for line in f if line.strip())
-            
-            logger.info(f"Total tracks in database: {total_tracks_in_db}")
-            
-            # Проверяем количество треков, достигших лимита
-            tracks_at_limit = 0
-            tracks_processed = set()
-            
-            for device_id, device_data in all_devices_data.items():
-                if not isinstance(device_data, dict):
-                    continue
-                    
-                for track, plays in device_data.items():
-                    if track not in tracks_processed:
-                        tracks_processed.add(track)
-                        if plays >= self.config.max_plays_per_track:
-                            tracks_at_limit += 1
-            
-            logger.info(f"Tracks at limit: {tracks_at_limit}/{len(tracks_processed)}")
-            
-            # Если все обработанные треки достигли лимита и их количество совпадает с общим количеством
-            if len(tracks_processed) > 0 and tracks_at_limit == len(tracks_processed) and len(tracks_processed) >= total_tracks_in_db:
-                logger.info(f"All tracks ({tracks_at_limit}) have reached maximum plays limit ({self.config.max_plays_per_track})")
-                # Отправляем уведомление только если это не было сделано ранее
-                if self.running:
-                    message = (
-                        f"🎵 Достигнут лимит прослушиваний!\n\n"
-                        f"Все треки ({tracks_at_limit}) были проиграны максимальное количество раз "
-                        f"({self.config.max_plays_per_track}).\n"
-                        f"Автоматизация завершена."
-                    )
-                    self.bot.send_message(self.config.chat_id, message)
-                    
-                    with open(stats_file, 'rb') as stats:
-                        self.bot.send_document(
-                            self.config.chat_id, 
-                            stats,
-                            caption="📊 Финальная статистика прослушиваний"
-                        )
-                return True
-                    
-            return False
-                    
-        except Exception as e:
-            logger.error(f"Error checking play limits: {str(e)}")
-            logger.exception("Full exception details:")
-            return False
-        
     def _handle_app_not_responding(self, d):
         """Обработка диалога о неотвечающем приложении"""
         try:
@@ -1246,6 +827,7 @@ class AppleMusicAutomation:
                     close_button = d(text="Close app")
                     if close_button.exists:
                         close_button.click()
+                        ANR_HITS.labels(self.STATE_KEY).inc()
                         time.sleep(2)
                         return True
                         
@@ -1296,7 +878,7 @@ class AppleMusicAutomation:
         
         for device in self.devicelist:
             try:
-                result = self.get_name(device)
+                result = await self.next_track(device)
                 if result:
                     name_artist = result[0]
                     d = u2.connect(device)
@@ -1349,10 +931,10 @@ class AppleMusicAutomation:
                 if success:
                     logger.info(f"✅ {device}: '{name_artist}' включен")
                 else:
-                    self.artists_not_found.append(name_artist)
+                    self.mark_not_found(name_artist)
             else:
                 logger.warning(f"⚠️ {device}: Результаты для '{name_artist}' не найдены")
-                self.artists_not_found.append(name_artist)
+                self.mark_not_found(name_artist)
                 
             await self._clear_search_field(d)
             
@@ -1380,6 +962,7 @@ class AppleMusicAutomation:
         for device in self.devicelist:
             state = self.get_device_state(device)
             state.total_songs = total_songs
+        self.state_store.mark_all_dirty(self.devicelist)
         
         # ЗАПУСКАЕМ ВСЕ УСТРОЙСТВА ПАРАЛЛЕЛЬНО
         tasks = []
@@ -1391,6 +974,10 @@ class AppleMusicAutomation:
             tasks.append(task)
             logger.info(f"🚀 Запущена задача для устройства {device}")
         
+        if self.PROXY_CHECKS_ENABLED:
+            self.proxy_monitor.start(self.devicelist)
+        lag_task = asyncio.create_task(watch_event_loop(self.STATE_KEY, self.config))
+        
         try:
             # Ждем завершения ВСЕХ устройств
             logger.info(f"⏳ Ожидание завершения {len(tasks)} параллельных задач...")
@@ -1406,6 +993,8 @@ class AppleMusicAutomation:
             
             # Ждем отмены всех задач
             await asyncio.gather(*tasks, return_exceptions=True)
+            lag_task.cancel()
+            await self.proxy_monitor.stop()
         
         logger.info("🏁 Параллельная обработка завершена")
         await self._send_completion_report()
@@ -1415,17 +1004,20 @@ class AppleMusicAutomation:
         Параллельная обработка одного устройства
         Каждое устройство работает в своем ритме независимо от других
         """
+        set_log_device(device)
         try:
             state = self.get_device_state(device)
             device_lock = self.get_device_lock(device)
             
             logger.info(f"🎯 Устройство {device} начинает параллельную работу")
             
-            last_proxy_check = time.time()
-            proxy_check_interval = 3600  # 1 час
             processed_tracks = 0
             
             while self.running:
+                # Устройство с открытым предохранителем ждет успешной проверки
+                if not await self.wait_device_available(device):
+                    break
+                
                 # Проверяем лимиты глобально
                 if self.check_play_limits_reached():
                     logger.info(f"🎯 Устройство {device}: Достигнуты глобальные лимиты")
@@ -1433,7 +1025,7 @@ class AppleMusicAutomation:
                 
                 # Получаем следующий трек (с блокировкой для thread-safety)
                 async with device_lock:
-                    result = self.get_name(device)
+                    result = await self.next_track(device)
                     if not result:
                         logger.info(f"📭 Устройство {device}: Нет больше треков")
                         break
@@ -1441,38 +1033,32 @@ class AppleMusicAutomation:
                 
                 logger.info(f"🎵 Устройство {device}: Обрабатываем '{name_artist}'")
                 
-                # Проверка прокси раз в час
-                current_time = time.time()
-                if current_time - last_proxy_check >= proxy_check_interval:
+                # Обрабатываем трек с повторами (прокси проверяет фоновый монитор)
+                device_error = None
+                async with self.proxy_monitor.track_guard(device):
                     try:
-                        success = await self.check_and_restart_proxy_if_needed(device)
-                        if not success:
-                            logger.warning(f"⚠️ Устройство {device}: Проблемы с прокси")
-                        last_proxy_check = current_time
-                    except Exception as e:
-                        logger.error(f"Ошибка проверки прокси {device}: {str(e)}")
-                
-                # Обрабатываем трек с повторами
-                track_success = await self.process_track_with_retries(device, name_artist)
+                        track_success = await self.process_track_with_retries(device, name_artist)
+                    except Exception as e:  # Только сбои устройства или связи
+                        track_success, device_error = False, e
                 
                 if track_success:
                     # Обновляем статистику
                     async with device_lock:
-                        state.songs_played += 1
+                        self.state_store.commit_play(state, name_artist)
                         processed_tracks += 1
+                    self.breakers.record_success(device)
                     
-                    # Обновляем UI
-                    if self.on_device_progress:
-                        self.on_device_progress(device, state.songs_played, state.total_songs)
-                    
-                    # Периодическое сохранение
-                    if processed_tracks % 5 == 0:  # Чаще сохраняем для параллельной работы
-                        self._periodic_cache_save()
+                    # Запись на диск - фоновым таймером, UI - сразу
+                    self.state_store.report_progress(device, state.songs_played, state.total_songs)
                     
                     progress_percent = (state.songs_played / state.total_songs) * 100
                     logger.info(f"📊 {device}: {state.songs_played}/{state.total_songs} ({progress_percent:.1f}%)")
                 else:
+                    self.state_store.release(device, name_artist)
                     logger.warning(f"⚠️ Устройство {device}: Не удалось обработать '{name_artist}'")
+                    # Ненайденный трек - не ошибка устройства: предохранитель считает только сбои связи
+                    if device_error is not None:
+                        self.breakers.record_failure(device, type(device_error).__name__, str(device_error))
                 
                 # Небольшая пауза между треками для стабильности
                 await asyncio.sleep(30)
@@ -1494,8 +1080,12 @@ class AppleMusicAutomation:
         
         Returns:
             bool: True если трек успешно обработан
+
+        Raises:
+            Exception: последняя попытка завершилась сбоем устройства или связи
         """
         retries = self.config.retry_attempts
+        device_error = None
         
         while retries > 0:
             try:
@@ -1505,6 +1095,7 @@ class AppleMusicAutomation:
                 if success:
                     return True
                 else:
+                    device_error = None
                     logger.warning(f"⚠️ Устройство {device}: Попытка {self.config.retry_attempts - retries + 1} неудачна")
                     retries -= 1
                     if retries > 0:
@@ -1512,19 +1103,20 @@ class AppleMusicAutomation:
                         
             except Exception as e:
                 logger.error(f"❌ Устройство {device}, попытка {self.config.retry_attempts - retries + 1}: {str(e)}")
+                device_error = e if is_device_error(e) else None
                 retries -= 1
                 if retries > 0:
                     await asyncio.sleep(3)
         
         logger.error(f"💥 Устройство {device}: Исчерпаны все попытки для '{name_artist}'")
+        if device_error is not None:
+            raise device_error
         return False
 
     async def run_ui_operation(self, device: str, name_artist: str) -> bool:
         """
         Выполнение UI операций в отдельном потоке для неблокирующей работы
         """
-        loop = asyncio.get_event_loop()
-        
         def sync_ui_operation():
             try:
                 # Подключаемся к устройству
@@ -1534,14 +1126,18 @@ class AppleMusicAutomation:
                 return self.search_and_play_sync(d, name_artist)
                 
             except Exception as e:
+                if is_device_error(e):
+                    raise  # Сбой устройства учитывает предохранитель
                 logger.error(f"Ошибка UI операции для {device}: {str(e)}")
                 return False
         
         # Выполняем в отдельном потоке чтобы не блокировать event loop
         try:
-            result = await loop.run_in_executor(self.executor, sync_ui_operation)
+            result = await run_in_executor(self.executor, sync_ui_operation)  # С устройством в логе
             return result
         except Exception as e:
+            if is_device_error(e):
+                raise
             logger.error(f"Ошибка выполнения в executor для {device}: {str(e)}")
             return False
 
@@ -1583,12 +1179,14 @@ class AppleMusicAutomation:
             d.send_keys(name_artist)
             time.sleep(1)
             d.press('enter')            
+            search_started = time.time()
             logger.debug(f"Запрос '{name_artist}' введен, Enter нажат")
             
             # 2. БЫСТРАЯ ПРОВЕРКА (5 СЕКУНД)
             quick_result = self._wait_for_search_results_sync(d, timeout=5)
             
             if quick_result:
+                SEARCH_LATENCY.labels(self.STATE_KEY).observe(time.time() - search_started)
                 # 3А. РЕЗУЛЬТАТЫ ЗАГРУЗИЛИСЬ БЫСТРО - СРАЗУ ВКЛЮЧАЕМ
                 success = self._play_first_result_sync(d, name_artist)
                 self._clear_search_field_sync(d)
@@ -1598,13 +1196,14 @@ class AppleMusicAutomation:
                     return True
                 else:
                     logger.warning(f"❌ Не удалось включить трек '{name_artist}'")
-                    self.artists_not_found.append(name_artist)
+                    self.mark_not_found(name_artist)
                     return False
             
             # 3Б. РЕЗУЛЬТАТЫ НЕ ЗАГРУЗИЛИСЬ - ЖДЕМ ЕЩЕ 7 СЕКУНД
             extended_result = self._wait_for_search_results_sync(d, timeout=7)
             
             if extended_result:
+                SEARCH_LATENCY.labels(self.STATE_KEY).observe(time.time() - search_started)
                 # 4А. ЗАГРУЗИЛИСЬ ПОСЛЕ ДОПОЛНИТЕЛЬНОГО ОЖИДАНИЯ
                 success = self._play_first_result_sync(d, name_artist)
                 self._clear_search_field_sync(d)
@@ -1613,17 +1212,19 @@ class AppleMusicAutomation:
                     logger.debug(f"🎵 Трек '{name_artist}' включен после ожидания")
                     return True
                 else:
-                    self.artists_not_found.append(name_artist)
+                    self.mark_not_found(name_artist)
                     return False
             else:
                 # 4Б. НЕ ЗАГРУЗИЛИСЬ И ПОСЛЕ 12 СЕКУНД ОБЩЕГО ОЖИДАНИЯ
                 logger.warning(f"⚠️ Результаты для '{name_artist}' не загрузились за 12 сек - пропускаем")
-                self.artists_not_found.append(name_artist)
+                self.mark_not_found(name_artist)
                 self._clear_search_field_sync(d)
                 return False
 
         except Exception as e:
             logger.error(f"Ошибка при поиске трека '{name_artist}': {str(e)}")
+            if is_device_error(e):
+                raise
             self._clear_search_field_sync(d)
             return False
 
@@ -1684,43 +1285,6 @@ class AppleMusicAutomation:
         except Exception as e:
             logger.error(f"Ошибка при очистке поиска: {str(e)}")
 
-    async def check_and_restart_proxy_if_needed(self, device: str) -> bool:
-        """Проверка и перезапуск прокси при необходимости"""
-        try:
-            loop = asyncio.get_event_loop()
-            
-            def sync_proxy_check():
-                try:
-                    d = u2.connect(device)
-                    # ИСПРАВЛЕНО: используем синхронную версию проверки прокси
-                    return self.check_proxy_sync(d, device)
-                except Exception as e:
-                    logger.error(f"Ошибка проверки прокси: {str(e)}")
-                    return False
-            
-            # Выполняем проверку прокси в отдельном потоке
-            proxy_ok = await loop.run_in_executor(self.executor, sync_proxy_check)
-            
-            if not proxy_ok:
-                logger.warning(f"Прокси на {device} не работает, перезапускаем")
-                
-                def sync_proxy_restart():
-                    try:
-                        d = u2.connect(device)
-                        # ИСПРАВЛЕНО: используем синхронную версию перезапуска прокси
-                        return self.restart_proxy_full_sync(d, device)
-                    except Exception as e:
-                        logger.error(f"Ошибка перезапуска прокси: {str(e)}")
-                        return False
-                
-                return await loop.run_in_executor(self.executor, sync_proxy_restart)
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"Ошибка проверки прокси {device}: {str(e)}")
-            return False
-
     # def check_proxy_sync(self, device, device_addr: str) -> bool:
     #     """Синхронная версия проверки прокси"""
     #     try:
@@ -1830,6 +1394,12 @@ class AppleMusicAutomation:
     def cleanup(self):
         """Очистка ресурсов"""
         try:
+            if hasattr(self, 'proxy_monitor'):
+                self.proxy_monitor.shutdown()
+            if hasattr(self, 'breakers'):
+                self.breakers.shutdown()
+            if getattr(self, 'farm_executor', None):
+                self.farm_executor.shutdown(wait=False)
             if hasattr(self, 'executor'):
                 self.executor.shutdown(wait=True)
                 logger.info("Thread pool executor shut down")
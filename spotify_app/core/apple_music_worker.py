@@ -4,7 +4,8 @@ import logging
 import os
 from typing import Optional
 from utils.config import Config
-from utils.logging_config import setup_service_logging
+from utils.logging_config import setup_service_logging, attach_handler, UI_LOG_FORMAT, UI_DATE_FORMAT
+from utils.progress_bus import format_progress
 from .apple_music_core import AppleMusicAutomation  # или spotify_core для SpotifyWorker
 from utils.config import Config, load_config  # Добавьте load_config
 logger = logging.getLogger(__name__)
@@ -20,6 +21,7 @@ class AppleMusicWorker(QThread):
         self.config = config
         self.running = False
         self.automation = None
+        self.progress_bus = None  # ProgressBus главного окна: прогресс числами, пачками раз в кадр
         self.logger = setup_service_logging('apple_music')
         self._setup_logging()
 
@@ -55,8 +57,7 @@ class AppleMusicWorker(QThread):
             def __init__(self, signal):
                 super().__init__()
                 self.signal = signal
-                self.setFormatter(logging.Formatter('%(asctime)s - %(message)s', 
-                                                datefmt='%Y-%m-%d %H:%M'))
+                self.setFormatter(logging.Formatter(UI_LOG_FORMAT, datefmt=UI_DATE_FORMAT))
 
             def emit(self, record):
                 msg = self.format(record)
@@ -64,19 +65,10 @@ class AppleMusicWorker(QThread):
 
         # Создаем и настраиваем handler
         handler = QtHandler(self.log_message)
-        
-        # Получаем корневой логгер
-        root_logger = logging.getLogger()
-        
-        # Удаляем все существующие handlers чтобы избежать дублирования
-        for h in root_logger.handlers[:]:
-            root_logger.removeHandler(h)
-        
-        # Добавляем только один handler к корневому логгеру
-        root_logger.addHandler(handler)
-        
-        # Устанавливаем уровень логирования
-        root_logger.setLevel(logging.INFO)
+
+        # Подключаем к очереди логов: handler работает в потоке QueueListener,
+        # предыдущий handler воркера с тем же именем заменяется
+        attach_handler(handler, 'qt')
         
         # Отключаем передачу логов родительским логгерам для apple_music_core
         logging.getLogger('apple_music_core').propagate = False
@@ -193,11 +185,11 @@ class AppleMusicWorker(QThread):
 
     def _handle_device_progress(self, device: str, current: int, total: int):
         try:
-            if total <= 0:  # Защита от деления на ноль
-                progress = f"{current}/0 (0.0%)"
-            else:
-                progress = f"{current}/{total} ({(current/total*100):.1f}%)"
-                
+            if self.progress_bus:
+                self.progress_bus.publish(device, current, total)
+                return
+
+            progress = format_progress(current, total)
             self.progress_updated.emit(device, progress)
             self.log_message.emit("INFO", f"Device {device} progress: {progress}")
         except Exception as e:
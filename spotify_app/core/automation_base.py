@@ -0,0 +1,634 @@
+import uiautomator2 as u2
+import telebot
+import asyncio
+import json
+from datetime import datetime
+import os
+import socket
+import zlib
+from abc import ABC, abstractmethod
+from typing import List, Dict, Optional, Set
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import Lock
+from utils.config import Config
+from utils.metrics import TRACKS_NOT_FOUND, start_metrics_server, watch_executor
+from utils.logging_config import run_in_executor
+from .proxy_monitor import ProxyHealthMonitor
+from .state_store import StateStore
+from .track_catalog import TrackCatalog
+from .farm_coordinator import FarmUnavailable, connect_farm
+from .event_log import configure_event_log, record_event, STEP_ERROR
+from .device_screenshots import ScreenshotService, capture_raw
+from .device_breaker import CircuitBreakers, probe_device
+
+logger = logging.getLogger(__name__)
+
+# Общий файл статистики проигрываний по сервису
+PLAYS_FILES = {
+    Config.SERVICE_SPOTIFY: 'data/spotify_track_plays.json',
+    Config.SERVICE_APPLE_MUSIC: 'data/apple_track_plays.json',
+}
+
+
+def select_shard(device_ids: List[str], index: int, count: int) -> List[str]:
+    """
+    Устройства шарда index из count.
+
+    Шард определяется по crc32 идентификатора, поэтому устройство остается
+    в своем шарде при появлении или пропаже других устройств.
+    """
+    if count <= 1:
+        return list(device_ids)
+    return [device_id for device_id in device_ids
+            if zlib.crc32(device_id.encode('utf-8')) % count == index % count]
+
+
+def is_device_error(error: BaseException) -> bool:
+    """
+    Сбой устройства или связи с ним (adb, агент uiautomator, сеть), а не
+    ненайденный трек или элемент UI - только такие ошибки считает предохранитель.
+    """
+    if isinstance(error, (OSError, u2.exceptions.UiAutomationNotConnectedError)):
+        return True
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {'ConnectError', 'GatewayError', 'AdbError', 'AdbTimeout'})
+
+
+@dataclass
+class DeviceState:
+    """Состояние устройства"""
+    device_id: str = ""
+    played_songs: Set[str] = field(default_factory=set)
+    lock: Lock = field(default_factory=Lock)
+    current_file: int = 1
+    total_songs: int = 0
+    songs_played: int = 0
+    track_plays: Dict[str, int] = field(default_factory=dict)
+    config: Optional[Config] = None
+    plays_file: str = ""  # Общий файл статистики сервиса; пусто - по config.service_type
+    catalog: Optional[TrackCatalog] = None  # Счетчики берутся из общего каталога
+    service: str = ""  # Ключ сервиса в каталоге
+
+    def __post_init__(self):
+        self._load_track_plays()
+
+    def _load_track_plays(self):
+        """Загрузка истории проигрываний для конкретного устройства"""
+        try:
+            if not self.config:
+                self.config = Config()
+                logger.warning(f"No config for device {self.device_id}, using default")
+
+            if not self.plays_file:
+                service_type = getattr(self.config, 'service_type', Config.SERVICE_SPOTIFY)
+                self.plays_file = PLAYS_FILES.get(service_type, PLAYS_FILES[Config.SERVICE_SPOTIFY])
+
+            if self.catalog:
+                self.track_plays = self.catalog.track_plays(self.service, self.device_id, self.plays_file)
+                return
+
+            os.makedirs('data', exist_ok=True)
+
+            if os.path.exists(self.plays_file):
+                with open(self.plays_file, 'r', encoding='utf-8') as f:
+                    all_devices_data = json.load(f)
+                    self.track_plays = all_devices_data.get(self.device_id, {})
+                    logger.debug(f"Loaded track plays for {self.device_id}: {len(self.track_plays)} tracks")
+            else:
+                self.track_plays = {}
+                logger.info(f"No track plays file found for {self.device_id}, starting fresh")
+        except Exception as e:
+            logger.error(f"Error loading track plays for device {self.device_id}: {str(e)}")
+            self.track_plays = {}
+
+    def can_play_track(self, track: str) -> bool:
+        """Проверка возможности проигрывания трека для конкретного устройства"""
+        if not self.config:
+            return True
+        current_plays = self.track_plays.get(track, 0)
+        can_play = current_plays < self.config.max_plays_per_track
+        if not can_play:
+            logger.debug(f"Device {self.device_id}: Track '{track}' reached max plays ({current_plays}/{self.config.max_plays_per_track})")
+        return can_play
+
+
+class BaseAutomation(ABC):
+    """
+    Общее ядро автоматизации, не зависящее от сервиса.
+
+    Здесь живут устройства и их состояние, выбор треков, контрольные точки,
+    лимиты проигрываний, монитор прокси и обработка ошибок. Наследники
+    (SpotifyAutomation, AppleMusicAutomation) - драйверы сервиса: описывают
+    его константами ниже и реализуют UI-операции (search_and_play, restart_app).
+    """
+
+    SERVICE_TYPE = Config.SERVICE_SPOTIFY
+    SERVICE_NAME = "Spotify"  # Название для логов и Telegram
+    STATE_KEY = "spotify"  # Префикс частей базы и каталога состояния
+    ERROR_LOG = "data/logs/errors_spotify.log"
+    NOTIFY_DEVICE_EXHAUSTED = False  # Сообщать в Telegram, что устройство проиграло все треки
+    FARM_RETRY_DELAY = 5  # Первая пауза перед повтором без связи с координатором (сек)
+    FARM_MAX_RETRY_DELAY = 60
+
+    def __init__(self, config: Config, catalog: Optional[TrackCatalog] = None):
+        self.config = config
+        # Каталог треков; в Mix-режиме один на оба сервиса, на ферме - от координатора
+        farm = connect_farm(config)
+        configure_event_log(config)
+        start_metrics_server(config)
+        if catalog is None:
+            catalog = (TrackCatalog.from_farm(farm, config.lines_per_file) if farm
+                       else TrackCatalog.from_parts(self.STATE_KEY, config.lines_per_file))
+        catalog.attach_farm(farm)
+        self.catalog = catalog
+        # Сетевые вызовы фермы (аренда трека) идут вне event loop
+        self.farm_executor: Optional[ThreadPoolExecutor] = None
+        if farm:
+            self.farm_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='farm')
+            watch_executor('farm', self.farm_executor)
+        self.bot = telebot.TeleBot(config.token)
+        self.screenshots = ScreenshotService.from_config(config)
+        self.device_states = {}
+        self.state_lock = Lock()
+        self.devicelist = []
+        self.on_device_progress = None
+        self.on_status_update = None
+        self.running = True
+        self._limits_cache = None  # (ключ, результат) последней проверки лимитов
+        # Инкрементальное сохранение состояния устройств на фоновом таймере
+        self.state_store = StateStore(
+            self.STATE_KEY, self.device_states, PLAYS_FILES[self.SERVICE_TYPE],
+            flush_interval=config.state_flush_interval,
+            on_progress=self._emit_progress,
+            catalog=self.catalog,
+            **self._shard_options(config)
+        )
+        self.proxy_monitor = ProxyHealthMonitor(
+            self.restart_proxy_full,
+            interval=config.proxy_monitor_interval,
+            failure_threshold=config.proxy_monitor_failures,
+            on_status=self._status_update
+        )
+        # Предохранители устройств: повторы ошибок считаются, мертвые устройства паркуются
+        self.breakers = CircuitBreakers(
+            failure_threshold=config.breaker_failure_threshold,
+            cooldown=config.breaker_cooldown,
+            max_cooldown=config.breaker_max_cooldown,
+            report_window=config.breaker_report_window,
+            on_status=self._breaker_notice
+        )
+
+    @staticmethod
+    def _shard_options(config: Config) -> dict:
+        """Параметры StateStore для процесса-шарда (пусто без шардирования)"""
+        shard_count = getattr(config, 'shard_count', 1)
+        if shard_count <= 1:
+            return {}
+        index = config.shard_index
+        return {
+            'shard': f"shard{index}",
+            'owns': lambda device_id: bool(select_shard([device_id], index, shard_count)),
+        }
+
+    # --- Операции драйвера сервиса ---
+
+    @abstractmethod
+    def restart_app(self, d) -> bool:
+        """Перезапуск приложения сервиса на устройстве"""
+
+    @abstractmethod
+    async def search_and_play(self, d, name_artist: str):
+        """Поиск и воспроизведение трека"""
+
+    async def restart_proxy_full(self, device: u2.Device, device_addr: str) -> bool:
+        """Полный перезапуск прокси (по умолчанию отключен)"""
+        logger.debug(f"Proxy restart disabled for {device_addr}")
+        return True
+
+    # --- Callbacks UI ---
+
+    def _emit_progress(self, device: str, songs_played: int, total_songs: int):
+        """Передача прогресса устройства в UI, если callback установлен"""
+        if self.on_device_progress:
+            self.on_device_progress(device, songs_played, total_songs)
+
+    def _status_update(self, message: str):
+        """Передача статуса в UI, если callback установлен"""
+        if self.on_status_update:
+            self.on_status_update(message)
+
+    def _breaker_notice(self, message: str):
+        """Смена состояния предохранителя устройства: в UI и одним сообщением в Telegram"""
+        self._status_update(message)
+        try:
+            self.bot.send_message(self.config.chat_id, f"{self.SERVICE_NAME}: {message}")
+        except Exception as e:
+            logger.error(f"Failed to send breaker notice: {str(e)}")
+
+    # --- Состояние устройств ---
+
+    def get_device_state(self, device: str) -> DeviceState:
+        with self.state_lock:
+            if device not in self.device_states:
+                # config и каталог передаем сразу: история читается в __post_init__
+                self.device_states[device] = DeviceState(
+                    device_id=device, config=self.config, plays_file=self.state_store.plays_file,
+                    catalog=self.catalog, service=self.STATE_KEY
+                )
+            return self.device_states[device]
+
+    def _load_cache(self):
+        """Восстановление состояния из контрольных точек и журнала проигрываний"""
+        try:
+            restored = self.state_store.restore(self.get_device_state)
+            if not restored:
+                logger.info("No cache found, starting fresh")
+                return
+
+            for device, state in restored.items():
+                logger.info(f"Loaded cache for device {device}: {state.songs_played}/{state.total_songs}")
+                if self.on_device_progress:
+                    self.on_device_progress(device, state.songs_played, state.total_songs)
+
+            logger.info(f"Cache loaded successfully from {self.state_store.directory}")
+        except Exception as e:
+            logger.error(f"Error loading cache: {str(e)}")
+
+    def _save_cache(self, is_except: bool = False):
+        """
+        Запись контрольной точки. Без is_except также выгружается общий кэш для отчетов
+        (при исключении достаточно контрольной точки - по ней и восстанавливаемся)
+        """
+        try:
+            self.state_store.flush()
+            if not is_except:
+                self.state_store.export_cache()
+            logger.info(f"Cache saved successfully to {self.state_store.directory}")
+        except Exception as e:
+            logger.error(f"Error saving cache: {str(e)}")
+
+    def _periodic_cache_save(self):
+        """Запись измененных устройств (прогресс в UI - только для изменившихся)"""
+        try:
+            self.state_store.flush()
+        except Exception as e:
+            logger.error(f"Error in periodic cache save: {str(e)}")
+
+    def reset_play_statistics(self):
+        """Сброс статистики прослушиваний"""
+        try:
+            for device, state in self.device_states.items():
+                state.track_plays.clear()
+            # Счетчики устройств, еще не получивших DeviceState, тоже в каталоге
+            self.catalog.reset_plays(self.STATE_KEY)
+            self._limits_cache = None
+
+            # Сохраняем пустой словарь в файл
+            os.makedirs('data', exist_ok=True)
+            with open(self.state_store.plays_file, 'w') as f:
+                json.dump({}, f)
+
+            logger.info(f"Play statistics reset for {self.config.service_type}")
+            return True
+        except Exception as e:
+            logger.error(f"Error resetting play statistics: {str(e)}")
+            return False
+
+    # --- База треков ---
+
+    def split_database(self, file_path: str):
+        """Разделение базы данных на части"""
+        logger.info(f"Splitting database from {file_path}")
+        os.makedirs('data', exist_ok=True)
+        small_file_number = 1
+        try:
+            with open(file_path, 'r') as big_file:
+                small_file = None
+                for lineno, line in enumerate(big_file):
+                    if lineno % self.config.lines_per_file == 0:
+                        if small_file:
+                            small_file.close()
+                        small_file_name = f"data/database_part_{self.STATE_KEY}_{small_file_number}.txt"
+                        small_file = open(small_file_name, 'w')
+                        small_file_number += 1
+                        logger.debug(f"Created new database part: {small_file_name}")
+                    small_file.write(line)
+                if small_file:
+                    small_file.close()
+            logger.info(f"Database split completed. Created {small_file_number-1} parts")
+        except Exception as e:
+            logger.error(f"Error splitting database: {str(e)}")
+            raise
+
+    def get_name(self, device: str) -> Optional[List[str]]:
+        state = self.get_device_state(device)
+        self.catalog.refresh()
+
+        with state.lock:
+            # Проверяем есть ли еще треки, которые можно проиграть
+            total_available = sum(1 for track in self.catalog if state.can_play_track(track))
+
+            if total_available == 0:
+                logger.info(f"Device {device} has no more tracks available due to play limits")
+                if self.NOTIFY_DEVICE_EXHAUSTED:
+                    self.bot.send_message(
+                        self.config.chat_id,
+                        f"Device {device} has completed playing all available tracks (reached max plays limit)"
+                    )
+                return None
+
+            # Стандартный поиск подходящего трека
+            skipped_parts = 0
+            while True:
+                part = self.catalog.part(state.current_file)
+                if part is None:
+                    if state.current_file == 1 and state.songs_played > 0:
+                        logger.info(f"Device {device} has played all songs in this cycle")
+                        return None
+                    state.current_file = 1
+                    state.played_songs.clear()
+                    self.state_store.mark_dirty(device)
+                    continue
+
+                available_songs = [track for track in part
+                                   if track not in state.played_songs and state.can_play_track(track)]
+
+                if not available_songs:
+                    state.current_file += 1
+                    continue
+
+                # Трек, который сейчас играет на другом сервисе, не выбираем.
+                # Без связи с фермой claim поднимает FarmUnavailable (повтор в next_track)
+                song = self.catalog.claim(available_songs, device, self.STATE_KEY)
+                if song is None:
+                    # Часть занята другим сервисом или исчерпана на ферме - переходим к следующей
+                    skipped_parts += 1
+                    if skipped_parts >= len(self.catalog.parts):
+                        logger.info(f"Device {device}: no free track in any part "
+                                    f"(playing on another service or farm limit reached)")
+                        return None
+                    logger.info(f"Device {device}: no free track in part {state.current_file}, moving to next part")
+                    state.current_file += 1
+                    self.state_store.mark_dirty(device)
+                    continue
+                state.played_songs.add(song)
+                # Счетчик увеличится только после успешного проигрывания (commit_play)
+                self.state_store.reserve(device, song)
+                return [song]
+
+    async def next_track(self, device: str) -> Optional[List[str]]:
+        """
+        get_name для корутин устройств.
+
+        С фермой выбор трека идет в пуле farm_executor (аренда - сетевой вызов),
+        а пропажа связи с координатором не завершает устройство: выбор
+        повторяется с растущей паузой, пока автоматизация запущена.
+        """
+        if self.farm_executor is None:
+            return self.get_name(device)
+        delay = self.FARM_RETRY_DELAY
+        while self.running:
+            try:
+                return await run_in_executor(self.farm_executor, self.get_name, device)
+            except FarmUnavailable as e:
+                logger.warning(f"Device {device}: {str(e)}, retrying in {delay:.0f}s")
+                self._status_update(f"Нет связи с координатором фермы, повтор через {delay:.0f} сек")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.FARM_MAX_RETRY_DELAY)
+        return None
+
+    def _plays_snapshot(self) -> Dict[str, Dict[str, int]]:
+        """
+        Счетчики проигрываний сервиса по устройствам из памяти каталога.
+
+        Шард дополняет их устройствами других процессов из общего файла
+        (без принудительной записи своего состояния).
+        """
+        all_devices_data = {}
+        if self.state_store.shard and os.path.exists(self.state_store.plays_file):
+            with open(self.state_store.plays_file, 'r', encoding='utf-8') as f:
+                all_devices_data = {device_id: device_data for device_id, device_data in json.load(f).items()
+                                    if isinstance(device_data, dict)}
+        owns = self.state_store.owns
+        for (device_id, service), counters in list(self.catalog.plays.items()):
+            # Устройства других шардов в памяти - на момент запуска, их берем из файла
+            if service == self.STATE_KEY and (owns is None or owns(device_id)):
+                all_devices_data[device_id] = dict(counters)
+        return all_devices_data
+
+    def _limits_cache_key(self) -> tuple:
+        """Результат проверки лимитов меняется только вместе с этими значениями"""
+        plays_mtime = None
+        if self.state_store.shard and os.path.exists(self.state_store.plays_file):
+            plays_mtime = os.path.getmtime(self.state_store.plays_file)
+        return self.state_store.plays_version, self.catalog.size, self.config.max_plays_per_track, plays_mtime
+
+    def check_play_limits_reached(self) -> bool:
+        """
+        Проверка достижения лимитов проигрывания для каждого устройства.
+
+        Считается по счетчикам в памяти; результат кэшируется, пока не
+        изменятся счетчики (plays_version) или размер базы, поэтому частые
+        вызовы из циклов устройств почти ничего не стоят.
+        """
+        try:
+            self.catalog.refresh()
+            key = self._limits_cache_key()
+            if self._limits_cache is not None and self._limits_cache[0] == key:
+                return self._limits_cache[1]
+
+            reached = self._compute_play_limits()
+            self._limits_cache = (key, reached)
+            return reached
+
+        except Exception as e:
+            logger.error(f"Error checking play limits: {str(e)}")
+            logger.exception("Full exception details:")
+            return False
+
+    def _compute_play_limits(self) -> bool:
+        all_devices_data = self._plays_snapshot()
+        if not all_devices_data:
+            logger.info("No play statistics yet, limits not reached")
+            return False
+
+        # Общее количество треков в базе
+        total_tracks_in_db = self.catalog.size
+
+        # Треки, достигшие лимита
+        tracks_at_limit = 0
+        tracks_processed = set()
+
+        for device_id, device_data in all_devices_data.items():
+            for track, plays in device_data.items():
+                if track not in tracks_processed:
+                    tracks_processed.add(track)
+                    if plays >= self.config.max_plays_per_track:
+                        tracks_at_limit += 1
+
+        logger.debug(f"Tracks at limit: {tracks_at_limit}/{len(tracks_processed)}, in database: {total_tracks_in_db}")
+
+        # Все проигранные треки на лимите и покрывают всю базу
+        if tracks_processed and tracks_at_limit == len(tracks_processed) and len(tracks_processed) >= total_tracks_in_db:
+            logger.info(f"All tracks ({tracks_at_limit}) have reached maximum plays limit ({self.config.max_plays_per_track})")
+            # Уведомление один раз: повторные вызовы получают результат из кэша
+            if self.running:
+                message = (
+                    f"🎵 Достигнут лимит прослушиваний!\n\n"
+                    f"Все треки ({tracks_at_limit}) были проиграны максимальное количество раз "
+                    f"({self.config.max_plays_per_track}).\n"
+                    f"Автоматизация завершена."
+                )
+                self.bot.send_message(self.config.chat_id, message)
+
+                # Файл статистики для отчета записывается только здесь
+                self.state_store.flush()
+                with open(self.state_store.plays_file, 'rb') as stats:
+                    self.bot.send_document(
+                        self.config.chat_id,
+                        stats,
+                        caption="📊 Финальная статистика прослушиваний"
+                    )
+            return True
+
+        return False
+
+    # --- Устройства ---
+
+    def check_ports(self) -> List[int]:
+        """Проверка открытых портов"""
+        open_ports = []
+        for port in range(self.config.start_port, self.config.end_port, self.config.port_step):
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(1)
+                if s.connect_ex((self.config.bluestacks_ip, port)) == 0:
+                    open_ports.append(port)
+        return open_ports
+
+    def initialize_devices(self):
+        """Инициализация списка устройств (только шард этого процесса)"""
+        self._discover_devices()
+        shard_count = getattr(self.config, 'shard_count', 1)
+        if shard_count > 1:
+            found = len(self.devicelist)
+            self.devicelist = select_shard(self.devicelist, self.config.shard_index, shard_count)
+            logger.info(f"Shard {self.config.shard_index + 1}/{shard_count}: "
+                        f"{len(self.devicelist)} of {found} devices")
+
+    def _discover_devices(self):
+        """Поиск устройств через ADB или по портам"""
+        if self.config.use_adb_device_detection:
+            # Используем ADB для получения серийных номеров устройств
+            from utils.adb_chek import ADBChecker
+            adb_checker = ADBChecker()
+
+            if not adb_checker.initialize_environment():
+                logger.error("Failed to initialize ADB environment")
+                # Fallback на метод портов
+                self._initialize_devices_by_ports()
+                return
+
+            device_ids = adb_checker.get_connected_devices()
+            if device_ids:
+                logger.info(f"Found {len(device_ids)} devices via ADB: {device_ids}")
+                self.devicelist = device_ids
+            else:
+                logger.warning("No devices found via ADB, falling back to IP:port method")
+                self._initialize_devices_by_ports()
+        else:
+            # Используем традиционный метод IP:порт
+            self._initialize_devices_by_ports()
+
+    def _initialize_devices_by_ports(self):
+        """Инициализация устройств по портам (исходный метод)"""
+        open_ports = self.check_ports()
+        if open_ports:
+            logger.info(f"Открытые порты на {self.config.bluestacks_ip}: {open_ports}")
+            self.devicelist = [f'{self.config.bluestacks_ip}:{port}' for port in open_ports]
+        else:
+            logger.warning(f"Нет открытых портов на {self.config.bluestacks_ip}")
+
+    def mark_not_found(self, track: str):
+        """Трек не найден или не включился: в карантин (сохраняется в контрольной точке) и в метрики"""
+        self.state_store.quarantine.append(track)
+        TRACKS_NOT_FOUND.labels(self.STATE_KEY).inc()
+
+    # --- Ошибки ---
+
+    @contextmanager
+    def error_handling(self, device, screenshot: bool = True):
+        """Контекстный менеджер для обработки ошибок"""
+        try:
+            yield
+        except u2.exceptions.XPathElementNotFoundError as xe:
+            self._handle_error("XPathElementNotFoundError", xe, device, screenshot)
+        except u2.exceptions.UiAutomationNotConnectedError as ue:
+            self._handle_error("UiAutomationNotConnectedError", ue, device, False)
+        except Exception as ex:
+            error_type = "JsonRpcError" if 'JsonRpcError' in str(type(ex)) else "GeneralException"
+            self._handle_error(error_type, ex, device, screenshot)
+
+    def _handle_error(self, error_type: str, error: Exception, device, screenshot: bool):
+        """
+        Централизованная обработка ошибок.
+
+        Полностью (лог ошибок, перезапуск, скриншот) обрабатывается первая
+        ошибка с данным отпечатком; повторы только перезапускают приложение.
+        Предохранитель считает только сбои устройства и связи (is_device_error),
+        промахи UI проходят лишь дедупликацию. После срабатывания
+        предохранителя устройство не трогается - его проверяет wait_device_available.
+        """
+        verdict = self.breakers.record_failure(str(device), error_type, f"{type(error).__name__}: {error}",
+                                               count=is_device_error(error))
+        record_event(str(device), self.STATE_KEY, STEP_ERROR, error_type, error=str(error)[:200],
+                     fingerprint=verdict.fingerprint, reported=verdict.report)
+        if verdict.report:
+            logger.error(f"{error_type}: {str(error)}")
+            self._save_error_log(error_type, error, verdict.repeats)
+        else:
+            logger.warning(f"{error_type} on {device} repeated (fingerprint {verdict.fingerprint}), not reported again")
+        if verdict.parked:
+            self._save_cache(is_except=True)
+            return
+        self.process_exception(device, screenshot and verdict.report)
+
+    def _save_error_log(self, error_type: str, error: Exception, repeats: int = 0):
+        """Сохранение ошибок в лог"""
+        os.makedirs(os.path.dirname(self.ERROR_LOG), exist_ok=True)
+        with open(self.ERROR_LOG, "a") as error_file:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            suffix = f" (повторов с прошлой записи: {repeats})" if repeats else ""
+            error_file.write(f"[{timestamp}] {error_type}: {str(error)}{suffix}\n")
+
+    async def wait_device_available(self, device: str) -> bool:
+        """
+        Парковка устройства с открытым предохранителем до успешной проверки.
+        False - автоматизация остановлена во время парковки.
+        """
+        if not self.breakers.is_open(device):
+            return True
+        return await self.breakers.wait_until_closed(device, probe_device, lambda: self.running)
+
+    def _send_photo(self, data: bytes, caption: str):
+        """Отправка изображения в Telegram (из потока обработки скриншотов)"""
+        self.bot.send_photo(self.config.chat_id, data, caption=caption)
+
+    def process_exception(self, device_addr: str, screenshot: bool = True):
+        """Обработка исключений"""
+        self._save_cache(is_except=True)
+        logger.info(f'RESTART {self.SERVICE_NAME}')
+        try:
+            d = u2.connect(device_addr)
+            # Экран снимается до перезапуска, пока на нем состояние ошибки
+            raw = capture_raw(d) if screenshot else None
+            self.restart_app(d)
+            if screenshot:
+                self.screenshots.submit(raw, 'error', str(device_addr),
+                                        caption=f'Server {self.SERVICE_NAME} Except {device_addr}',
+                                        send=self._send_photo)
+        except Exception as e:
+            logger.error(f"Failed to process exception for device {device_addr}: {str(e)}")
+            logger.exception("Full error details:")
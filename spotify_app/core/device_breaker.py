@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, NamedTuple, Optional
+
+import uiautomator2 as u2
+
+from utils.logging_config import run_in_executor
+from utils.metrics import REGISTRY, watch_executor
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = REGISTRY.gauge('music_device_breaker_state',
+                               'Предохранитель устройства: 0 - closed, 1 - half-open, 2 - open', ('device',))
+BREAKER_TRIPS = REGISTRY.counter('music_device_breaker_trips_total', 'Срабатывания предохранителя', ('device',))
+DEVICE_ERRORS = REGISTRY.counter('music_device_errors_total',
+                                 'Ошибки устройств: reported - обработаны полностью, suppressed - повтор',
+                                 ('device', 'outcome'))
+
+# Переменные части сообщений (адреса, порты, номера строк, таймауты) не влияют на отпечаток
+VOLATILE_RE = re.compile(r'0x[0-9a-fA-F]+|\d+')
+
+
+def error_fingerprint(error_type: str, message: str) -> str:
+    """Отпечаток ошибки: одинаковые по сути ошибки с разными числами совпадают"""
+    normalized = VOLATILE_RE.sub('#', message)[:300]
+    return f"{zlib.crc32(f'{error_type}|{normalized}'.encode('utf-8')):08x}"
+
+
+def probe_device(device_id: str) -> bool:
+    """Дешевая проверка живости устройства: shell через adb и ответ агента uiautomator (блокирующий вызов)"""
+    try:
+        d = u2.connect(device_id)
+        d.shell('echo ok', timeout=10)
+        d.info
+        return True
+    except Exception as e:
+        logger.debug(f"Device probe failed on {device_id}: {str(e)}")
+        return False
+
+
+class Verdict(NamedTuple):
+    """Решение по ошибке: report - обработать полностью, repeats - подавленных повторов с прошлого отчета"""
+    fingerprint: str
+    report: bool
+    repeats: int
+    parked: bool  # Предохранитель открыт: устройство уходит на парковку, перезапуск не нужен
+
+
+@dataclass
+class _Fingerprint:
+    error_type: str
+    count: int = 0
+    suppressed: int = 0
+    last_reported: float = 0.0
+
+
+@dataclass
+class DeviceBreaker:
+    state: str = CLOSED
+    failures: int = 0  # Ошибок подряд
+    trips: int = 0  # Срабатываний подряд без восстановления (для удвоения паузы)
+    opened_at: float = 0.0
+    cooldown: float = 0.0
+    fingerprints: Dict[str, _Fingerprint] = field(default_factory=dict)
+
+
+class CircuitBreakers:
+    """
+    Предохранители устройств (closed / open / half-open) с дедупликацией ошибок.
+
+    Каждая ошибка получает отпечаток (тип + сообщение без чисел). Первая
+    ошибка с отпечатком обрабатывается полностью (лог ошибок, перезапуск,
+    скриншот и Telegram), повторы в течение report_window только считаются
+    и попадают в следующий отчет числом повторов.
+
+    После failure_threshold ошибок подряд предохранитель открывается:
+    устройство паркуется в wait_until_closed и раз в cooldown проходит
+    дешевую проверку в маленьком пуле потоков. Прошедшее проверку устройство
+    получает один пробный трек (half-open): успех закрывает предохранитель,
+    ошибка снова открывает его с удвоенной паузой (до max_cooldown).
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 60, max_cooldown: float = 900,
+                 report_window: float = 600, max_concurrent_probes: int = 2,
+                 on_status: Optional[Callable[[str], None]] = None):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = max(5.0, float(cooldown))
+        self.max_cooldown = max(self.cooldown, float(max_cooldown))
+        self.report_window = max(0.0, float(report_window))
+        self.on_status = on_status
+        self.devices: Dict[str, DeviceBreaker] = {}
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent_probes),
+                                           thread_name_prefix='device-probe')
+        watch_executor('device-probe', self.executor)
+
+    def _get(self, device_id: str) -> DeviceBreaker:
+        breaker = self.devices.get(device_id)
+        if breaker is None:
+            breaker = self.devices[device_id] = DeviceBreaker()
+            BREAKER_STATE.labels(device_id).set(STATE_VALUES[CLOSED])
+        return breaker
+
+    def _set_state(self, device_id: str, breaker: DeviceBreaker, state: str):
+        breaker.state = state
+        BREAKER_STATE.labels(device_id).set(STATE_VALUES[state])
+
+    def _notify(self, message: str):
+        if self.on_status:
+            try:
+                self.on_status(message)
+            except Exception as e:
+                logger.debug(f"Status callback failed: {str(e)}")
+
+    def _trip(self, device_id: str, breaker: DeviceBreaker) -> bool:
+        """Открытие предохранителя; True - устройство только что было рабочим"""
+        first = breaker.state == CLOSED
+        breaker.cooldown = min(self.max_cooldown, self.cooldown * 2 ** breaker.trips)
+        breaker.trips += 1
+        breaker.opened_at = time.time()
+        self._set_state(device_id, breaker, OPEN)
+        BREAKER_TRIPS.labels(device_id).inc()
+        return first
+
+    def state(self, device_id: str) -> str:
+        breaker = self.devices.get(device_id)
+        return breaker.state if breaker else CLOSED
+
+    def is_open(self, device_id: str) -> bool:
+        return self.state(device_id) == OPEN
+
+    def record_failure(self, device_id: str, error_type: str, message: str, count: bool = True) -> Verdict:
+        """
+        Учет ошибки устройства и решение, нужна ли полная обработка.
+
+        count=False - ошибка UI (трек или элемент не найден): проходит
+        дедупликацию по отпечатку, но предохранитель не приближает.
+        """
+        fingerprint = error_fingerprint(error_type, message)
+        now = time.time()
+        with self._lock:
+            breaker = self._get(device_id)
+            entry = breaker.fingerprints.get(fingerprint)
+            if entry is None:
+                entry = breaker.fingerprints[fingerprint] = _Fingerprint(error_type)
+            entry.count += 1
+            report = now - entry.last_reported >= self.report_window or entry.last_reported == 0.0
+            repeats = entry.suppressed
+            if report:
+                entry.suppressed = 0
+                entry.last_reported = now
+            else:
+                entry.suppressed += 1
+
+            tripped = first_trip = False
+            if count:
+                breaker.failures += 1
+            if count and (breaker.state == HALF_OPEN
+                          or (breaker.state == CLOSED and breaker.failures >= self.failure_threshold)):
+                tripped = True
+                first_trip = self._trip(device_id, breaker)
+            parked = breaker.state == OPEN
+            cooldown = breaker.cooldown
+            failures = breaker.failures
+
+        DEVICE_ERRORS.labels(device_id, 'reported' if report else 'suppressed').inc()
+        if tripped:
+            logger.error(f"Circuit breaker open for {device_id} after {failures} failures "
+                         f"(last: {error_type}), next probe in {cooldown:.0f}s")
+            if first_trip:
+                self._notify(f"Устройство {device_id} остановлено после {failures} ошибок подряд "
+                             f"({error_type}), проверка раз в {cooldown:.0f} сек")
+        return Verdict(fingerprint, report, repeats, parked)
+
+    def record_success(self, device_id: str):
+        """Успешный трек: счетчик ошибок сбрасывается, half-open предохранитель закрывается"""
+        breaker = self.devices.get(device_id)
+        if breaker is None or (breaker.failures == 0 and breaker.state == CLOSED):
+            return
+        with self._lock:
+            recovered = breaker.state != CLOSED
+            breaker.failures = 0
+            breaker.trips = 0
+            self._set_state(device_id, breaker, CLOSED)
+        if recovered:
+            logger.info(f"Circuit breaker closed for {device_id}")
+            self._notify(f"Устройство {device_id} снова работает")
+
+    async def wait_until_closed(self, device_id: str, probe: Callable[[str], bool] = probe_device,
+                                is_running: Callable[[], bool] = lambda: True) -> bool:
+        """
+        Парковка устройства с открытым предохранителем.
+
+        Возвращает True, когда устройство прошло проверку (half-open - можно
+        пробовать трек), False - если автоматизация остановлена.
+        """
+        while is_running():
+            breaker = self._get(device_id)
+            if breaker.state != OPEN:
+                return True
+            remaining = breaker.opened_at + breaker.cooldown - time.time()
+            if remaining > 0:
+                await asyncio.sleep(min(remaining, 5.0))  # Короткие паузы, чтобы быстро реагировать на остановку
+                continue
+            healthy = await run_in_executor(self.executor, probe, device_id)
+            with self._lock:
+                if healthy:
+                    self._set_state(device_id, breaker, HALF_OPEN)
+                    breaker.failures = 0
+                else:
+                    self._trip(device_id, breaker)
+            if healthy:
+                logger.info(f"Device {device_id} passed probe, trying one track (half-open)")
+                return True
+            logger.info(f"Device {device_id} still unavailable, next probe in {breaker.cooldown:.0f}s")
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
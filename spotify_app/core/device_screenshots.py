@@ -0,0 +1,177 @@
+import io
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import uiautomator2 as u2
+from PIL import Image
+
+from utils.config import Config
+from utils.metrics import REGISTRY, watch_executor
+
+logger = logging.getLogger(__name__)
+
+SCREENSHOTS = REGISTRY.counter('music_screenshots_total', 'Скриншоты устройств', ('kind', 'outcome'))
+
+Sender = Callable[[bytes, str], None]  # (JPEG, подпись) -> отправка, например в Telegram
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """Перцептивный хэш (difference hash): 64 бита, похожие экраны отличаются на несколько бит"""
+    gray = image.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def capture_raw(d: u2.Device) -> Optional[bytes]:
+    """
+    Скриншот экрана устройства в JPEG, как его закодировало устройство
+    (один RPC uiautomator2, без снимка рабочего стола хоста).
+    """
+    try:
+        data = d.screenshot(format='raw')
+        return data if data else None
+    except Exception as e:
+        logger.warning(f"Device screenshot failed on {getattr(d, 'serial', '?')}: {str(e)}")
+        return None
+
+
+class ScreenshotService:
+    """
+    Скриншоты устройств для ошибок и отчетов.
+
+    Снимок делает устройство (JPEG), обработка идет в фоновом потоке:
+    изображение декодируется один раз, уменьшается до max_side, сжимается и
+    сравнивается по dHash с недавними снимками. Похожий на отправленный за
+    последние dedupe_window секунд снимок не сохраняется и не отправляется -
+    серия одинаковых ошибок дает одну картинку.
+    """
+
+    def __init__(self, directory: str = 'data/screenshots', max_side: int = 720, quality: int = 70,
+                 dedupe_window: float = 600, hash_distance: int = 6):
+        self.directory = directory
+        self.max_side = max(160, int(max_side))
+        self.quality = min(95, max(20, int(quality)))
+        self.dedupe_window = float(dedupe_window)
+        self.hash_distance = int(hash_distance)
+        self._recent = deque(maxlen=256)  # (время, вид, хэш)
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='screenshots')
+        watch_executor('screenshots', self.executor)
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'ScreenshotService':
+        return cls(max_side=config.screenshot_max_side, quality=config.screenshot_quality,
+                   dedupe_window=config.screenshot_dedupe_window, hash_distance=config.screenshot_hash_distance)
+
+    def _is_duplicate(self, kind: str, image_hash: int) -> bool:
+        now = time.time()
+        with self._lock:
+            for taken, recent_kind, recent_hash in self._recent:
+                if (recent_kind == kind and now - taken < self.dedupe_window
+                        and hamming(recent_hash, image_hash) <= self.hash_distance):
+                    return True
+            self._recent.append((now, kind, image_hash))
+        return False
+
+    def _encode(self, image: Image.Image) -> bytes:
+        image = image.convert('RGB')
+        image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=self.quality, optimize=True)
+        return buffer.getvalue()
+
+    def _store(self, kind: str, label: str, data: bytes) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        safe_label = label.replace(':', '_').replace('/', '_')
+        name = f"{kind}_{safe_label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _process(self, raw: bytes, kind: str, label: str, caption: str,
+                 send: Optional[Sender]) -> Optional[str]:
+        try:
+            with Image.open(io.BytesIO(raw)) as image:
+                image.load()
+                if self._is_duplicate(kind, dhash(image)):
+                    SCREENSHOTS.labels(kind, 'duplicate').inc()
+                    logger.info(f"Screenshot {kind} from {label} skipped: same screen as a recent one")
+                    return None
+                data = self._encode(image)
+            path = self._store(kind, label, data)
+            SCREENSHOTS.labels(kind, 'saved').inc()
+            if send:
+                send(data, caption)
+            return path
+        except Exception as e:
+            SCREENSHOTS.labels(kind, 'failed').inc()
+            logger.error(f"Error processing screenshot from {label}: {str(e)}")
+            return None
+
+    def submit(self, raw: Optional[bytes], kind: str, device_id: str, caption: str = '',
+               send: Optional[Sender] = None) -> Optional[Future]:
+        """Обработка уже снятого скриншота в фоне; Future вернет путь файла или None"""
+        if not raw:
+            SCREENSHOTS.labels(kind, 'failed').inc()
+            return None
+        return self.executor.submit(self._process, raw, kind, device_id, caption, send)
+
+    def capture(self, d: u2.Device, kind: str, device_id: str, caption: str = '',
+                send: Optional[Sender] = None) -> Optional[Future]:
+        """Снимок в вызывающем потоке (состояние экрана на момент вызова), обработка - в фоне"""
+        return self.submit(capture_raw(d), kind, device_id, caption, send)
+
+    def _contact_sheet(self, device_ids: List[str], kind: str, caption: str, send: Optional[Sender],
+                       columns: int) -> Optional[str]:
+        tiles: List[Tuple[str, Image.Image]] = []
+        for device_id in device_ids:
+            try:
+                raw = capture_raw(u2.connect(device_id))
+            except Exception as e:
+                logger.warning(f"Failed to connect to {device_id} for screenshot: {str(e)}")
+                continue
+            if not raw:
+                continue
+            with Image.open(io.BytesIO(raw)) as image:
+                tile = image.convert('RGB')
+            tile.thumbnail((self.max_side // 2, self.max_side // 2), Image.LANCZOS)
+            tiles.append((device_id, tile))
+        if not tiles:
+            SCREENSHOTS.labels(kind, 'failed').inc()
+            return None
+
+        columns = max(1, min(columns, len(tiles)))
+        rows = (len(tiles) + columns - 1) // columns
+        width = max(tile.width for _, tile in tiles)
+        height = max(tile.height for _, tile in tiles)
+        sheet = Image.new('RGB', (columns * width, rows * height), (30, 30, 30))
+        for position, (_, tile) in enumerate(tiles):
+            sheet.paste(tile, ((position % columns) * width, (position // columns) * height))
+        buffer = io.BytesIO()
+        sheet.save(buffer, 'JPEG', quality=self.quality, optimize=True)
+        return self._process(buffer.getvalue(), kind, 'all', caption, send)
+
+    def capture_sheet(self, device_ids: Iterable[str], kind: str, caption: str = '',
+                      send: Optional[Sender] = None, limit: int = 16, columns: int = 4) -> Future:
+        """Сводный снимок нескольких устройств (отчет о завершении) полностью в фоне"""
+        return self.executor.submit(self._contact_sheet, list(device_ids)[:limit], kind, caption, send, columns)
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
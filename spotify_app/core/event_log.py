@@ -0,0 +1,378 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_RE = re.compile(r'^events_(\d{8})_(\d{2})(.*)\.jsonl$')
+INDEX_SUFFIX = '.idx.json'
+
+# Шаги в событиях
+STEP_PLAY = 'play'  # Проигрывание трека: от резерва до засчитывания
+STEP_LIFECYCLE = 'lifecycle'  # Сценарий запуска/перезапуска приложения
+STEP_SWITCH = 'switch'  # Переключение сервиса в Mix-режиме
+STEP_ERROR = 'error'  # Ошибка, после которой приложение перезапускается
+
+
+class EventLog:
+    """
+    Структурированный журнал событий устройств.
+
+    Событие - одна строка JSON (ts, device, service, track, step, latency,
+    outcome). Файлы разбиты по часам (events_YYYYMMDD_HH<suffix>.jsonl), поэтому
+    имя файла служит индексом по времени. Рядом с файлом лежит индекс блоков
+    (.idx.json): смещение, длина, интервал времени, устройства и шаги каждых
+    BLOCK_SIZE событий. Запрос по устройству и интервалу читает только
+    подходящие блоки.
+
+    record() только ставит событие в очередь - запись и обновление индекса
+    выполняет фоновый поток раз в flush_interval секунд.
+    """
+
+    BLOCK_SIZE = 256
+    INDEX_VERSION = 1
+
+    def __init__(self, directory: str = 'data/events', suffix: str = '', flush_interval: float = 1.0):
+        self.directory = directory
+        self.suffix = suffix  # Отдельные файлы для процессов-шардов
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._hour: Optional[int] = None
+        self._file = None
+        self._index: Dict[str, Any] = {}
+        self._block: Optional[Dict[str, Any]] = None
+
+    def record(self, device: str, service: str, step: str, outcome: str = 'ok',
+               track: str = '', latency: Optional[float] = None, ts: Optional[float] = None, **extra):
+        """Добавление события (не блокирует вызывающий поток)"""
+        event = {
+            'ts': round(ts if ts is not None else time.time(), 3),
+            'device': device,
+            'service': service,
+            'track': track,
+            'step': step,
+            'latency': round(latency, 3) if latency is not None else None,
+            'outcome': outcome,
+        }
+        event.update(extra)
+        self._queue.put(event)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batch:
+                stopping = True
+                batch = [event for event in batch if event is not None]
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error(f"Error writing event log: {str(e)}")
+        self._close_segment()
+
+    # --- Запись сегментов ---
+
+    def segment_path(self, hour: int) -> str:
+        stamp = datetime.fromtimestamp(hour).strftime('%Y%m%d_%H')
+        return os.path.join(self.directory, f"events_{stamp}{self.suffix}.jsonl")
+
+    def _open_segment(self, hour: int):
+        self._close_segment()
+        path = self.segment_path(hour)
+        self._file = open(path, 'ab')
+        self._hour = hour
+        # Продолжение сегмента после перезапуска: индекс дочитывается до конца файла
+        self._index = load_index(path)
+        self._block = None
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._finish_block()
+        self._file.close()
+        self._write_index()
+        self._file = None
+        self._hour = None
+
+    def _finish_block(self):
+        if self._block:
+            block = self._block
+            block['devices'] = sorted(block['devices'])
+            block['steps'] = sorted(block['steps'])
+            self._index['blocks'].append(block)
+            self._block = None
+
+    def _write_index(self):
+        path = self.segment_path(self._hour) + INDEX_SUFFIX
+        index = dict(self._index)
+        if self._block:
+            # Незаконченный блок тоже попадает в индекс - запросы видят свежие события
+            block = dict(self._block, devices=sorted(self._block['devices']),
+                         steps=sorted(self._block['steps']))
+            index['blocks'] = index['blocks'] + [block]
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    def _write(self, events: List[Dict[str, Any]]):
+        for event in events:
+            hour = int(event['ts'] // 3600 * 3600)
+            if hour != self._hour:
+                self._open_segment(hour)
+            line = (json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+            offset = self._file.tell()
+            self._file.write(line)
+
+            block = self._block
+            if block is None:
+                block = self._block = {'offset': offset, 'length': 0, 'count': 0,
+                                       't0': event['ts'], 't1': event['ts'],
+                                       'devices': set(), 'steps': set()}
+            block['length'] += len(line)
+            block['count'] += 1
+            block['t0'] = min(block['t0'], event['ts'])
+            block['t1'] = max(block['t1'], event['ts'])
+            block['devices'].add(event['device'])
+            block['steps'].add(event['step'])
+            self._index['end'] = offset + len(line)
+            if block['count'] >= self.BLOCK_SIZE:
+                self._finish_block()
+
+        self._file.flush()
+        self._write_index()
+
+    def close(self, timeout: float = 5.0):
+        """Запись оставшихся событий и остановка фонового потока"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+# --- Журнал процесса ---
+
+_event_log: Optional[EventLog] = None
+_event_log_lock = threading.Lock()
+
+
+def configure_event_log(config: Config) -> Optional[EventLog]:
+    """Журнал событий этого процесса (один на процесс, у шардов - свой суффикс файлов)"""
+    global _event_log
+    if not getattr(config, 'event_log_enabled', True):
+        return None
+    suffix = f"_shard{config.shard_index}" if getattr(config, 'shard_count', 1) > 1 else ''
+    with _event_log_lock:
+        if _event_log is None:
+            _event_log = EventLog(config.event_log_dir, suffix)
+            atexit.register(close_event_log)
+        return _event_log
+
+
+def record_event(device: str, service: str, step: str, outcome: str = 'ok', **fields):
+    """Событие в журнал процесса (без configure_event_log - игнорируется)"""
+    if _event_log is not None:
+        _event_log.record(device, service, step, outcome, **fields)
+
+
+def close_event_log():
+    global _event_log
+    with _event_log_lock:
+        event_log, _event_log = _event_log, None
+    if event_log:
+        event_log.close()
+
+
+# --- Чтение и запросы ---
+
+def _scan_blocks(path: str, start: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """Индекс блоков по содержимому файла (для сегментов без индекса или с недописанным хвостом)"""
+    blocks = []
+    block = None
+    offset = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # Недописанная строка - процесс упал во время записи
+            try:
+                event = json.loads(line)
+            except ValueError:
+                offset += len(line)
+                continue
+            if block is None:
+                block = {'offset': offset, 'length': 0, 'count': 0, 't0': event['ts'], 't1': event['ts'],
+                         'devices': set(), 'steps': set()}
+            block['length'] += len(line)
+            block['count'] += 1
+            block['t0'] = min(block['t0'], event['ts'])
+            block['t1'] = max(block['t1'], event['ts'])
+            block['devices'].add(event.get('device', ''))
+            block['steps'].add(event.get('step', ''))
+            offset += len(line)
+            if block['count'] >= EventLog.BLOCK_SIZE:
+                blocks.append(block)
+                block = None
+    if block:
+        blocks.append(block)
+    for block in blocks:
+        block['devices'] = sorted(block['devices'])
+        block['steps'] = sorted(block['steps'])
+    return blocks, offset
+
+
+def load_index(path: str) -> Dict[str, Any]:
+    """Индекс сегмента; события после конца индекса дочитываются из файла"""
+    index = {'version': EventLog.INDEX_VERSION, 'end': 0, 'blocks': []}
+    try:
+        with open(path + INDEX_SUFFIX, 'r', encoding='utf-8') as f:
+            loaded = json.load(f)
+        if loaded.get('version') == EventLog.INDEX_VERSION:
+            index = loaded
+    except (OSError, ValueError):
+        pass
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if index['end'] > size:
+        index = {'version': EventLog.INDEX_VERSION, 'end': 0, 'blocks': []}
+    if index['end'] < size:
+        blocks, end = _scan_blocks(path, index['end'])
+        index['blocks'] = index['blocks'] + blocks
+        index['end'] = end
+    return index
+
+
+def list_segments(directory: str, since: Optional[float] = None,
+                  until: Optional[float] = None) -> List[str]:
+    """Файлы событий, чей час пересекается с интервалом [since, until)"""
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        match = SEGMENT_RE.match(name)
+        if not match:
+            continue
+        hour = datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H').timestamp()
+        if since is not None and hour + 3600 <= since:
+            continue
+        if until is not None and hour >= until:
+            continue
+        segments.append((hour, name))
+    return [os.path.join(directory, name) for hour, name in sorted(segments)]
+
+
+def device_matches(device: str, wanted: Iterable[str]) -> bool:
+    """Полный адрес устройства или только порт ('6745' совпадает с '127.0.0.1:6745')"""
+    return any(device == item or device.endswith(f":{item}") for item in wanted)
+
+
+def query_events(directory: str = 'data/events', since: Optional[float] = None, until: Optional[float] = None,
+                 devices: Optional[List[str]] = None, steps: Optional[List[str]] = None,
+                 outcomes: Optional[List[str]] = None, service: str = '',
+                 track: str = '') -> Iterator[Dict[str, Any]]:
+    """
+    События по фильтрам в порядке файлов.
+
+    Сегменты отбираются по часу в имени, блоки - по интервалу времени,
+    устройствам и шагам из индекса; строки читаются только из подходящих блоков.
+    """
+    track = track.lower()
+    for path in list_segments(directory, since, until):
+        index = load_index(path)
+        with open(path, 'rb') as f:
+            for block in index['blocks']:
+                if since is not None and block['t1'] < since:
+                    continue
+                if until is not None and block['t0'] >= until:
+                    continue
+                if devices and not any(device_matches(device, devices) for device in block['devices']):
+                    continue
+                if steps and not set(steps) & set(block['steps']):
+                    continue
+                f.seek(block['offset'])
+                for line in f.read(block['length']).splitlines():
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is not None and event['ts'] < since:
+                        continue
+                    if until is not None and event['ts'] >= until:
+                        continue
+                    if devices and not device_matches(event.get('device', ''), devices):
+                        continue
+                    if steps and event.get('step') not in steps:
+                        continue
+                    if outcomes and event.get('outcome') not in outcomes:
+                        continue
+                    if service and event.get('service') != service:
+                        continue
+                    if track and track not in (event.get('track') or '').lower():
+                        continue
+                    yield event
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def group_key(event: Dict[str, Any], field: str) -> str:
+    """Значение поля группировки ('hour' - час события)"""
+    if field == 'hour':
+        return datetime.fromtimestamp(event['ts']).strftime('%Y-%m-%d %H:00')
+    return str(event.get(field) or '-')
+
+
+def aggregate_events(events: Iterable[Dict[str, Any]], by: List[str]) -> List[Dict[str, Any]]:
+    """Сводка по группам: число событий, успешных, задержка avg/p50/p95"""
+    groups = defaultdict(lambda: {'count': 0, 'ok': 0, 'latencies': []})
+    for event in events:
+        group = groups[tuple(group_key(event, field) for field in by)]
+        group['count'] += 1
+        if event.get('outcome') == 'ok':
+            group['ok'] += 1
+        if event.get('latency') is not None:
+            group['latencies'].append(event['latency'])
+
+    rows = []
+    for key, group in sorted(groups.items()):
+        latencies = sorted(group['latencies'])
+        rows.append({
+            'key': key,
+            'count': group['count'],
+            'ok': group['ok'],
+            'avg': sum(latencies) / len(latencies) if latencies else None,
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+        })
+    return rows
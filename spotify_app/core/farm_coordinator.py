@@ -0,0 +1,466 @@
+import atexit
+import json
+import logging
+import os
+import random
+import socket
+import socketserver
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.config import Config
+from .track_catalog import TrackCatalog
+
+logger = logging.getLogger(__name__)
+
+ROLE_COORDINATOR = 'coordinator'
+ROLE_CLIENT = 'client'
+
+
+class FarmUnavailable(ConnectionError):
+    """Нет связи с координатором фермы (в отличие от None - треки исчерпаны на ферме)"""
+
+
+class FarmCoordinator:
+    """
+    Владелец каталога и глобальных счетчиков фермы из нескольких машин.
+
+    Треки выдаются в аренду (lease): трек доступен, пока проигрывания на всей
+    ферме плюс активные аренды меньше max_plays, поэтому лимит не
+    превышается, даже когда машины выбирают треки одновременно. Аренда
+    засчитывается (commit) или снимается (release); брошенная аренда (машина
+    упала) истекает через lease_ttl секунд.
+
+    Счетчики хранятся в plays_file, ключ - сервис (как STATE_KEY автоматизации).
+    """
+
+    SAVE_INTERVAL = 5  # Не чаще раза в столько секунд пишем счетчики на диск
+
+    def __init__(self, catalog: TrackCatalog, max_plays: int, lease_ttl: float = 900,
+                 plays_file: str = 'data/farm_plays.json'):
+        self.catalog = catalog
+        self.max_plays = max_plays
+        self.lease_ttl = lease_ttl
+        self.plays_file = plays_file
+        self.plays: Dict[str, Dict[str, int]] = {}  # сервис -> трек -> проигрываний на ферме
+        self._leases: Dict[Tuple[str, str, str], Tuple[str, float]] = {}  # (машина, устройство, сервис) -> (трек, истекает)
+        self._dirty = False
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.plays_file):
+            return
+        try:
+            with open(self.plays_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for service, counters in data.items():
+                self.plays[service] = {sys.intern(track): plays for track, plays in counters.items()}
+            logger.info(f"Farm plays loaded: {sum(len(c) for c in self.plays.values())} tracks")
+        except Exception as e:
+            logger.error(f"Error loading farm plays from {self.plays_file}: {str(e)}")
+
+    def save(self, force: bool = True):
+        """Атомарная запись счетчиков (force=False - только если прошло SAVE_INTERVAL)"""
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._saved_at < self.SAVE_INTERVAL):
+                return
+            data = {service: dict(counters) for service, counters in self.plays.items()}
+            self._dirty = False
+            self._saved_at = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.plays_file) or '.', exist_ok=True)
+            temp_file = f"{self.plays_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+            os.replace(temp_file, self.plays_file)
+        except Exception as e:
+            logger.error(f"Error saving farm plays: {str(e)}")
+            with self._lock:
+                self._dirty = True
+
+    def _expire_leases(self, now: float):
+        expired = [key for key, (_, expires) in self._leases.items() if expires <= now]
+        for key in expired:
+            track, _ = self._leases.pop(key)
+            logger.warning(f"Lease expired: {key[0]}/{key[1]} ({key[2]}): {track}")
+
+    def _leased_counts(self, service: str) -> Counter:
+        return Counter(leased_track for (_, _, leased_service), (leased_track, _) in self._leases.items()
+                       if leased_service == service)
+
+    def lease(self, node: str, device_id: str, service: str, candidates: List[str]) -> Optional[str]:
+        """
+        Аренда случайного трека из кандидатов, у которого остался запас до лимита.
+
+        Предыдущая аренда устройства снимается - устройство играет один трек за раз.
+
+        Returns:
+            Optional[str]: трек или None, если все кандидаты исчерпаны на ферме
+        """
+        now = time.time()
+        with self._lock:
+            self._expire_leases(now)
+            key = (node, device_id, service)
+            self._leases.pop(key, None)
+            counters = self.plays.get(service, {})
+            leased = self._leased_counts(service)
+            free = [track for track in candidates
+                    if counters.get(track, 0) + leased[track] < self.max_plays]
+            if not free:
+                return None
+            track = sys.intern(random.choice(free))
+            self._leases[key] = (track, now + self.lease_ttl)
+            return track
+
+    def commit(self, node: str, device_id: str, service: str, track: str) -> int:
+        """Засчитывание проигрывания. Returns: проигрываний трека на ферме"""
+        with self._lock:
+            key = (node, device_id, service)
+            if self._leases.get(key, (None,))[0] == track:
+                del self._leases[key]
+            counters = self.plays.setdefault(service, {})
+            counters[track] = counters.get(track, 0) + 1
+            self._dirty = True
+            plays = counters[track]
+        self.save(force=False)
+        return plays
+
+    def release(self, node: str, device_id: str, service: str, track: Optional[str] = None):
+        """Снятие аренды без засчитывания (track=None - снять в любом случае)"""
+        with self._lock:
+            key = (node, device_id, service)
+            if track is None or self._leases.get(key, (None,))[0] == track:
+                self._leases.pop(key, None)
+
+    def catalog_version(self) -> str:
+        """Версия каталога: меняется, когда владелец перечитал базу"""
+        self.catalog.refresh()
+        return f"{self.catalog.size}:{id(self.catalog.parts)}"
+
+    def catalog_tracks(self) -> List[str]:
+        self.catalog.refresh()
+        return list(self.catalog)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire_leases(time.time())
+            return {
+                "tracks": self.catalog.size,
+                "max_plays": self.max_plays,
+                "leases": len(self._leases),
+                "plays": {service: sum(counters.values()) for service, counters in self.plays.items()},
+            }
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Обработка запроса протокола (одна JSON-строка от FarmClient)"""
+        op = request.get('op')
+        try:
+            if op == 'lease':
+                result = self.lease(request['node'], request['device'], request['service'], request['candidates'])
+            elif op == 'commit':
+                result = self.commit(request['node'], request['device'], request['service'], request['track'])
+            elif op == 'release':
+                result = self.release(request['node'], request['device'], request['service'], request.get('track'))
+            elif op == 'catalog_version':
+                result = self.catalog_version()
+            elif op == 'catalog':
+                result = self.catalog_tracks()
+            elif op == 'stats':
+                result = self.stats()
+            else:
+                return {"ok": False, "error": f"unknown op: {op}"}
+            return {"ok": True, "result": result}
+        except KeyError as e:
+            return {"ok": False, "error": f"missing field: {e.args[0]}"}
+        except Exception as e:
+            logger.error(f"Farm request {op} failed: {str(e)}")
+            return {"ok": False, "error": str(e)}
+
+
+class FarmServer:
+    """
+    TCP-сервер координатора: по одной JSON-строке запроса и ответа.
+
+        {"op": "lease", "node": "host-2", "device": "127.0.0.1:6695",
+         "service": "spotify", "candidates": [...]}
+        {"ok": true, "result": "Artist - Title"}
+    """
+
+    def __init__(self, coordinator: FarmCoordinator, host: str = '0.0.0.0', port: int = 8790):
+        self.coordinator = coordinator
+        self.host = host
+        self.port = port
+        self._server: Optional[socketserver.ThreadingTCPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _make_handler(self):
+        coordinator = self.coordinator
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        response = coordinator.handle(json.loads(line))
+                    except ValueError:
+                        response = {"ok": False, "error": "invalid json"}
+                    self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+
+        return Handler
+
+    def start(self) -> 'FarmServer':
+        """Запуск сервера в фоновом потоке"""
+        if self._server is not None:
+            return self
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='farm-server', daemon=True)
+        self._thread.start()
+        logger.info(f"Farm coordinator listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        """Остановка сервера с сохранением счетчиков"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
+        self.coordinator.save()
+
+
+class FarmNode(ABC):
+    """
+    Доступ машины фермы к координатору; подключается к TrackCatalog (attach_farm).
+
+    Наследники реализуют только _call - в процессе (LocalFarm) или по TCP (FarmClient).
+    """
+
+    def __init__(self, node: str):
+        self.node = node
+
+    @abstractmethod
+    def _call(self, op: str, **params) -> Any:
+        """Запрос к координатору; результат операции"""
+
+    def lease(self, device_id: str, service: str, candidates: List[str]) -> Optional[str]:
+        return self._call('lease', device=device_id, service=service, candidates=list(candidates))
+
+    def commit(self, device_id: str, service: str, track: str):
+        return self._call('commit', device=device_id, service=service, track=track)
+
+    def release(self, device_id: str, service: str, track: Optional[str] = None):
+        self._call('release', device=device_id, service=service, track=track)
+
+    def catalog_version(self) -> Optional[str]:
+        return self._call('catalog_version')
+
+    def catalog_tracks(self) -> List[str]:
+        return self._call('catalog') or []
+
+    def stats(self) -> Dict[str, Any]:
+        return self._call('stats') or {}
+
+
+class LocalFarm(FarmNode):
+    """
+    Координатор в том же процессе: машина-координатор и замена сети в тестах.
+
+    Запросы проходят через FarmCoordinator.handle с сериализацией в JSON,
+    как по TCP.
+    """
+
+    def __init__(self, coordinator: FarmCoordinator, node: str = 'local'):
+        super().__init__(node)
+        self.coordinator = coordinator
+
+    def _call(self, op: str, **params) -> Any:
+        request = json.loads(json.dumps(dict(params, op=op, node=self.node)))
+        response = self.coordinator.handle(request)
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error'))
+        return response.get('result')
+
+
+class FarmClient(FarmNode):
+    """
+    Машина фермы, берущая треки в аренду у координатора по TCP.
+
+    Без связи с координатором запросы с ответом (lease, каталог) поднимают
+    FarmUnavailable. commit и release ответа не ждут: они ставятся в очередь
+    и отправляются фоновым потоком по порядку, а без связи копятся и уходят
+    после ее восстановления. Перед lease очередь отправляется первой, поэтому
+    координатор видит запросы устройства в исходном порядке.
+    """
+
+    RETRY_INTERVAL = 5  # Пауза между попытками отправить очередь без связи (сек)
+
+    def __init__(self, host: str, port: int, node: str, timeout: float = 10.0):
+        super().__init__(node)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+        self._outbox: deque = deque()  # commit/release в порядке вызова
+        self._wake = threading.Event()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._sender = threading.Thread(target=self._send_outbox, name='farm-client', daemon=True)
+        self._sender.start()
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._socket.makefile('rb')
+
+    def _close(self):
+        if self._socket:
+            try:
+                self._reader.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._reader = None
+
+    def _request(self, request: Dict[str, Any]) -> Any:
+        """Запрос с одним переподключением; вызывается под self._lock"""
+        payload = json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n'
+        for attempt in range(2):
+            try:
+                if self._socket is None:
+                    self._connect()
+                self._socket.sendall(payload)
+                line = self._reader.readline()
+                if not line:
+                    raise ConnectionError("coordinator closed connection")
+                response = json.loads(line)
+                if not response.get('ok'):
+                    raise RuntimeError(response.get('error'))
+                return response.get('result')
+            except (OSError, ValueError):
+                self._close()
+                if attempt:
+                    raise
+
+    def _flush_outbox(self):
+        """Отправка очереди commit/release; вызывается под self._lock"""
+        while self._outbox:
+            request = self._outbox[0]
+            try:
+                self._request(request)
+            except RuntimeError as e:
+                logger.error(f"Farm coordinator rejected {request.get('op')}: {str(e)}")
+            self._outbox.popleft()
+
+    def _send_outbox(self):
+        """Поток отправки очереди: без связи повторяет раз в RETRY_INTERVAL"""
+        while not self._closed:
+            self._wake.wait(self.RETRY_INTERVAL if self._outbox else None)
+            self._wake.clear()
+            if not self._outbox:
+                continue
+            with self._lock:
+                try:
+                    self._flush_outbox()
+                except (OSError, ValueError) as e:
+                    logger.error(f"Farm coordinator {self.host}:{self.port} unavailable, "
+                                 f"{len(self._outbox)} requests queued: {str(e)}")
+
+    def _enqueue(self, op: str, **params):
+        self._outbox.append(dict(params, op=op, node=self.node))
+        self._wake.set()
+
+    def _call(self, op: str, **params) -> Any:
+        """Запрос с ответом (блокирующий: вызывается вне event loop)"""
+        request = dict(params, op=op, node=self.node)
+        with self._lock:
+            try:
+                self._flush_outbox()
+                return self._request(request)
+            except (OSError, ValueError) as e:
+                raise FarmUnavailable(f"farm coordinator {self.host}:{self.port} unavailable ({op}): {e}") from e
+            except RuntimeError as e:
+                logger.error(f"Farm request {op} rejected: {str(e)}")
+                return None
+
+    def commit(self, device_id: str, service: str, track: str):
+        self._enqueue('commit', device=device_id, service=service, track=track)
+
+    def release(self, device_id: str, service: str, track: Optional[str] = None):
+        self._enqueue('release', device=device_id, service=service, track=track)
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        with self._lock:
+            try:
+                self._flush_outbox()
+            except (OSError, ValueError) as e:
+                logger.error(f"Farm client closed with {len(self._outbox)} unsent requests: {str(e)}")
+            self._close()
+
+
+_farm_nodes: Dict[Tuple[str, str, int], FarmNode] = {}
+_farm_servers: List[FarmServer] = []
+_farm_lock = threading.Lock()
+
+
+def farm_node_name(config: Config) -> str:
+    return config.farm_node or socket.gethostname()
+
+
+def connect_farm(config: Config) -> Optional[FarmNode]:
+    """
+    Узел фермы процесса по config.farm_role; один на процесс (Mix-режим
+    подключает обе автоматизации к одному узлу).
+
+    coordinator - координатор в этом процессе + TCP-сервер для остальных машин,
+    client - подключение к координатору farm_host:farm_port, пусто - без фермы.
+    """
+    role = config.farm_role
+    if role not in (ROLE_COORDINATOR, ROLE_CLIENT):
+        return None
+    key = (role, config.farm_host, config.farm_port)
+    with _farm_lock:
+        if key in _farm_nodes:
+            return _farm_nodes[key]
+        if role == ROLE_COORDINATOR:
+            coordinator = FarmCoordinator(
+                TrackCatalog.from_database(config.database_path, config.lines_per_file),
+                config.farm_max_plays_per_track or config.max_plays_per_track,
+                lease_ttl=config.farm_lease_ttl
+            )
+            server = FarmServer(coordinator, config.farm_host, config.farm_port).start()
+            _farm_servers.append(server)
+            atexit.register(shutdown_farm)  # Последние счетчики пишутся при выходе
+            node = LocalFarm(coordinator, farm_node_name(config))
+        else:
+            node = FarmClient(config.farm_host, config.farm_port, farm_node_name(config))
+            logger.info(f"Farm client {node.node} -> {config.farm_host}:{config.farm_port}")
+        _farm_nodes[key] = node
+        return node
+
+
+def shutdown_farm():
+    """Остановка серверов координатора процесса с сохранением счетчиков"""
+    with _farm_lock:
+        for server in _farm_servers:
+            server.stop()
+        _farm_servers.clear()
+        for node in _farm_nodes.values():
+            if isinstance(node, FarmClient):
+                node.close()
+        _farm_nodes.clear()
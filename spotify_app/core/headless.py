@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+
+from utils.config import Config
+from utils.logging_config import attach_handler
+from utils.metrics import REGISTRY, CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+
+def memory_usage_mb() -> Optional[float]:
+    """Память процесса (RSS; без psutil - пиковая), МБ; None - платформа не поддерживается"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return None
+
+
+class StatusBoard:
+    """
+    Сводка состояния headless-процесса для endpoint статуса.
+
+    sink(kind, *args) получает каждое событие - так процесс-шард передает
+    прогресс супервизору.
+    """
+
+    def __init__(self, config: Config, log_size: int = 50,
+                 sink: Optional[Callable[..., None]] = None):
+        self.mode = config.service_type
+        self.shard = f"{config.shard_index + 1}/{config.shard_count}"
+        self.started = time.time()
+        self.running = False
+        self.completed: Optional[bool] = None
+        self.last_status = ""
+        self.devices: Dict[str, Dict[str, Any]] = {}
+        self.log = deque(maxlen=log_size)
+        self.sink = sink
+        self._lock = threading.Lock()
+
+    def _forward(self, kind: str, *args):
+        if self.sink:
+            try:
+                self.sink(kind, *args)
+            except Exception as e:
+                logger.debug(f"Status sink failed: {str(e)}")
+
+    def on_progress(self, device_id: str, songs_played: int, total_songs: int, service: str = ""):
+        with self._lock:
+            self.devices[device_id] = {
+                "service": service or self.mode,
+                "played": songs_played,
+                "total": total_songs,
+                "updated": time.time()
+            }
+        self._forward('progress', device_id, songs_played, total_songs, service or self.mode)
+
+    def on_service_switched(self, device_id: str, service: str):
+        with self._lock:
+            self.devices.setdefault(device_id, {"played": 0, "total": 0})["service"] = service
+        self._forward('service', device_id, service)
+
+    def on_status(self, message: str):
+        with self._lock:
+            self.last_status = message
+        self._forward('status', message)
+
+    def on_log(self, level: str, message: str):
+        with self._lock:
+            self.log.append({"level": level, "message": message})
+        self._forward('log', level, message)
+
+    def on_completed(self, success: bool):
+        with self._lock:
+            self.completed = success
+        self._forward('completed', success)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            devices = {device_id: dict(info) for device_id, info in self.devices.items()}
+            return {
+                "mode": self.mode,
+                "shard": self.shard,
+                "pid": os.getpid(),
+                "running": self.running,
+                "completed": self.completed,
+                "uptime": round(time.time() - self.started, 1),
+                "memory_mb": memory_usage_mb(),
+                "played": sum(info.get("played", 0) for info in devices.values()),
+                "devices": devices,
+                "last_status": self.last_status,
+                "log": list(self.log)
+            }
+
+
+class StatusServer:
+    """
+    Локальный HTTP endpoint статуса headless-процесса.
+
+    GET /status - JSON сводка StatusBoard, GET /health - 200, пока процесс жив,
+    GET /metrics - метрики процесса в текстовом формате Prometheus.
+    """
+
+    def __init__(self, board: StatusBoard, host: str = '127.0.0.1', port: int = 8765):
+        self.board = board
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/health':
+                    body = b'ok'
+                    content_type = 'text/plain'
+                elif path == '/metrics':
+                    body = REGISTRY.render().encode('utf-8')
+                    content_type = CONTENT_TYPE
+                elif path in ('/', '/status'):
+                    body = json.dumps(server.board.to_dict(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Status {self.client_address[0]}: {format % args}")
+
+        return Handler
+
+    def start(self) -> 'StatusServer':
+        """Запуск сервера в фоновом потоке"""
+        if self._server is not None:
+            return self
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='status-server', daemon=True)
+        self._thread.start()
+        logger.info(f"Status endpoint: http://{self.host}:{self.port}/status")
+        return self
+
+    def stop(self):
+        """Остановка сервера"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
+
+
+class HeadlessRunner:
+    """
+    Запуск автоматизации без Qt.
+
+    Режим берется из config.service_type (spotify / apple_music / mix),
+    устройства - только шард config.shard_index из config.shard_count.
+    Движки импортируются при запуске, PyQt6 не загружается.
+    """
+
+    def __init__(self, config: Config, sink: Optional[Callable[..., None]] = None):
+        self.config = config
+        self.board = StatusBoard(config, sink=sink)
+        self.status_server: Optional[StatusServer] = None
+        self.automation = None  # SpotifyAutomation / AppleMusicAutomation
+        self.engine = None  # MixEngine
+        self.running = False
+
+    def _attach_logging(self):
+        """Последние сообщения лога попадают в статус"""
+        board = self.board
+
+        class BoardHandler(logging.Handler):
+            def emit(self, record):
+                board.on_log(record.levelname, record.getMessage())
+
+        attach_handler(BoardHandler(level=logging.INFO), 'status-board')
+
+    def run(self) -> int:
+        """Запуск до завершения или остановки. Возвращает код выхода процесса"""
+        if not os.path.exists(self.config.database_path):
+            logger.error(f"Database file not found: {self.config.database_path}")
+            return 2
+
+        self.running = True
+        self.board.running = True
+        self._attach_logging()
+        if self.config.status_port:
+            try:
+                self.status_server = StatusServer(self.board, self.config.status_host,
+                                                  self.config.status_port).start()
+            except OSError as e:
+                logger.error(f"Status endpoint not started: {str(e)}")
+
+        try:
+            if self.config.service_type == Config.SERVICE_MIX:
+                self._run_mix()
+            else:
+                asyncio.run(self._run_service())
+            return 0 if self.board.completed is not False else 1
+        except Exception as e:
+            logger.error(f"Headless run failed: {str(e)}")
+            logger.exception("Full error details:")
+            return 1
+        finally:
+            self.running = False
+            self.board.running = False
+            if self.status_server:
+                self.status_server.stop()
+
+    def _run_mix(self):
+        from .mix_engine import MixEngine
+
+        self.engine = MixEngine(self.config)
+        self.engine.progress_updated.connect(self.board.on_progress)
+        self.engine.service_switched.connect(self.board.on_service_switched)
+        self.engine.status_updated.connect(self.board.on_status)
+        self.engine.task_completed.connect(self.board.on_completed)
+        self.engine.log_message.connect(self._log_engine_message)
+        if not self.running:
+            return
+        self.engine.run()
+
+    @staticmethod
+    def _log_engine_message(level: str, message: str):
+        """Сообщения MixEngine (в GUI идут в сигнал log_message) - в обычный лог"""
+        logger.log(getattr(logging, level, logging.INFO), message)
+
+    async def _run_service(self):
+        if self.config.service_type == Config.SERVICE_APPLE_MUSIC:
+            from .apple_music_core import AppleMusicAutomation as Automation
+        else:
+            from .spotify_core import SpotifyAutomation as Automation
+
+        self.automation = Automation(self.config)
+        self.automation.on_device_progress = self.board.on_progress
+        self.automation.on_status_update = self.board.on_status
+        for device_id, state in self.automation.device_states.items():
+            self.board.on_progress(device_id, state.songs_played, state.total_songs)
+
+        # Тот же цикл, что у QThread-воркеров
+        while self.running and self.automation.running:
+            try:
+                await self.automation.main()
+                if not self.running or self.automation.check_play_limits_reached():
+                    logger.info("Automation complete or stop signal received")
+                    break
+                logger.info("Automation cycle completed, waiting before next cycle")
+                await asyncio.sleep(60)
+            except Exception as e:
+                logger.error(f"Error in automation cycle: {str(e)}")
+                if not self.running:
+                    break
+                await asyncio.sleep(5)
+        self.board.on_completed(True)
+
+    def stop(self):
+        """Остановка по сигналу процесса"""
+        logger.info("Stopping headless runner...")
+        self.running = False
+        if self.engine:
+            self.engine.stop()
+        if self.automation:
+            self.automation.stop()
@@ -0,0 +1,580 @@
+import asyncio
+import logging
+import random
+import time
+import os
+import json
+import re
+from typing import Dict, Optional, Tuple, List
+from utils.config import Config
+from utils.engine_signal import EngineSignal
+from utils.logging_config import set_log_device
+from utils.loop_watchdog import watch_event_loop
+from .spotify_core import SpotifyAutomation
+from .apple_music_core import AppleMusicAutomation
+from .automation_base import PLAYS_FILES
+from .mix_scheduler import MixScheduler, DeviceTimer, SwitchCostModel
+from .app_lifecycle import launch_app_script, prewarm_app_script, shell_output, SPOTIFY_PACKAGE, APPLE_MUSIC_PACKAGE
+from .track_catalog import TrackCatalog
+from .farm_coordinator import connect_farm
+from .event_log import record_event, STEP_SWITCH
+import uiautomator2 as u2
+
+logger = logging.getLogger(__name__)
+
+class MixEngine:
+    """
+    Mix-режим без Qt: оба сервиса на каждом устройстве с переключением по таймеру.
+
+    Используется MixWorker (GUI) и headless-демоном. События передаются
+    через EngineSignal с тем же интерфейсом, что у pyqtSignal.
+    """
+
+    def __init__(self, config: Config):
+        self.progress_updated = EngineSignal()  # device_id, played, total, service_type
+        self.status_updated = EngineSignal()
+        self.task_completed = EngineSignal()
+        self.log_message = EngineSignal()
+        self.service_switched = EngineSignal()  # device_id, new_service
+        self.config = config
+        self.running = False
+        self.spotify_automation = None
+        self.apple_music_automation = None
+        self.catalog: Optional[TrackCatalog] = None  # Общий каталог треков обоих сервисов
+        
+        # Явно инициализируем атрибуты, которых может не хватать
+        self.current_services = {}  # device_id -> current service
+        self.service_timers: Dict[str, DeviceTimer] = {}  # device_id -> таймер текущего сервиса
+        self.device_connections = {}  # device_id -> u2.Device (кэш подключений)
+        self.scheduler: Optional[MixScheduler] = None
+        self.switch_costs = SwitchCostModel()  # Стоимость переключения сервисов по устройствам
+    
+    def stop(self):
+        try:
+            self.log_message.emit("INFO", "Останавливаем Mix Worker...")
+            self.running = False
+            if self.scheduler:
+                self.scheduler.stop()
+            
+            # Закрыть все подключения uiautomator2
+            for device_id, device in self.device_connections.items():
+                try:
+                    device.service("uiautomator").stop()
+                    device.watchers.remove()
+                    del device
+                except Exception as e:
+                    self.log_message.emit("ERROR", f"Ошибка закрытия соединения {device_id}: {str(e)}")
+            
+            self.device_connections.clear()
+            
+            # Остановка автоматизаторов
+            if self.spotify_automation:
+                try:
+                    self.spotify_automation.stop()
+                except Exception as e:
+                    self.log_message.emit("ERROR", f"Ошибка остановки Spotify: {str(e)}")
+            
+            if self.apple_music_automation:
+                try:
+                    self.apple_music_automation.stop()
+                except Exception as e:
+                    self.log_message.emit("ERROR", f"Ошибка остановки Apple Music: {str(e)}")
+            
+            # Освобождение памяти
+            self.spotify_automation = None
+            self.apple_music_automation = None
+            self.catalog = None
+            
+            self.log_message.emit("INFO", "Mix Worker остановлен")
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Ошибка в процессе остановки: {str(e)}")
+    
+    def reset_statistics(self) -> bool:
+        """
+        Сброс статистики прослушиваний для обоих сервисов.
+
+        Во время работы счетчики живут в общем каталоге, и StateStore записал бы
+        их обратно в файл - поэтому сброс идет через автоматизации, которые
+        очищают счетчики на месте. Файлы напрямую переписываются, только если
+        автоматизация сервиса не запущена.
+        """
+        try:
+            os.makedirs('data', exist_ok=True)
+            success = True
+            services = (
+                ("Spotify", self.spotify_automation, PLAYS_FILES[Config.SERVICE_SPOTIFY]),
+                ("Apple Music", self.apple_music_automation, PLAYS_FILES[Config.SERVICE_APPLE_MUSIC]),
+            )
+            for name, automation, stats_file in services:
+                if automation:
+                    reset = automation.reset_play_statistics()
+                else:
+                    with open(stats_file, 'w') as f:
+                        json.dump({}, f)
+                    reset = True
+                if reset:
+                    self.log_message.emit("INFO", f"Успешно сброшена статистика {name}")
+                else:
+                    self.log_message.emit("ERROR", f"Не удалось сбросить статистику {name}")
+                success = success and reset
+            return success
+            
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Ошибка сброса статистики: {str(e)}")
+            return False
+    
+    def _get_random_duration(self) -> int:
+        """Получает случайную длительность из диапазона в настройках"""
+        min_time = self.config.mix_min_time
+        max_time = self.config.mix_max_time
+        
+        # Проверка корректности диапазона
+        if min_time < 60:
+            min_time = 60  # Минимум 1 минута
+        
+        if max_time <= min_time:
+            max_time = min_time + 300  # По умолчанию +5 минут к минимуму
+        
+        duration = random.randint(min_time, max_time)
+        self.log_message.emit("INFO", f"Выбрана длительность {duration} секунд (диапазон {min_time}-{max_time})")
+        return duration
+    
+    def _get_next_service(self, device_id: str) -> str:
+        """Определяет следующий сервис для устройства, чередуя их"""
+        current = self.current_services.get(device_id)
+        
+        if current == 'spotify':
+            return 'apple_music'
+        elif current == 'apple_music':
+            return 'spotify'
+        else:
+            # Если сервис не был установлен ранее, выбираем случайно
+            return random.choice(['spotify', 'apple_music'])
+    
+    def _switch_service(self, device_id: str, initial: bool = False) -> Tuple[str, int]:
+        """
+        Переключает сервис для устройства и возвращает новый сервис
+        и случайную длительность
+        """
+        if initial:
+            # При первом запуске выбираем случайно
+            service = random.choice(['spotify', 'apple_music'])
+        else:
+            # При переключении чередуем
+            service = 'apple_music' if self.current_services.get(device_id) == 'spotify' else 'spotify'
+        
+        duration = self._get_random_duration()
+        
+        self.current_services[device_id] = service
+        self.service_timers[device_id] = DeviceTimer(service, time.time(), duration)
+        
+        service_name = "SPOTIFY" if service == 'spotify' else "APPLE MUSIC"
+        self.log_message.emit("INFO", 
+                             f"{'Инициализация' if initial else 'Переключение'} устройства {device_id} "
+                             f"на {service_name} на {duration} секунд")
+        
+        # Отправляем сигнал о смене сервиса
+        self.service_switched.emit(device_id, service)
+        
+        return service, duration
+    
+    def _handle_device_progress(self, device: str, current: int, total: int, service_type: str):
+        """Обработчик обновления прогресса: числа без форматирования, строку собирает потребитель"""
+        self.progress_updated.emit(device, current, total, service_type)
+        logger.debug(f"Устройство {device} ({service_type}): {current}/{total}")
+    
+    def _handle_status_update(self, status: str):
+        """Обработчик обновления статуса"""
+        self.status_updated.emit(status)
+        self.log_message.emit("INFO", status)
+    
+    def run(self):
+        try:
+            self.running = True
+            self.log_message.emit("INFO", "Запуск Mix Worker...")
+            
+            # Проверяем настройки микс-режима
+            if not hasattr(self.config, 'mix_min_time') or not hasattr(self.config, 'mix_max_time'):
+                self.log_message.emit("ERROR", "Не настроены параметры Mix режима")
+                self.task_completed.emit(False)
+                return
+            
+            # Проверяем наличие базы данных
+            if not self.config.database_path or not os.path.exists(self.config.database_path):
+                self.log_message.emit("ERROR", f"Файл базы данных не найден: {self.config.database_path}")
+                self.task_completed.emit(False)
+                return
+            
+            # Создаем конфигурации для обоих сервисов
+            spotify_config = Config.from_dict(vars(self.config))
+            spotify_config.service_type = Config.SERVICE_SPOTIFY
+            
+            apple_config = Config.from_dict(vars(self.config))
+            apple_config.service_type = Config.SERVICE_APPLE_MUSIC
+            
+            # Один каталог треков и счетчиков на оба сервиса: база читается один раз,
+            # части формируются в памяти без split_database
+            farm = connect_farm(self.config)
+            if farm:
+                self.catalog = TrackCatalog.from_farm(farm, self.config.lines_per_file)
+            else:
+                self.catalog = TrackCatalog.from_database(self.config.database_path, self.config.lines_per_file)
+            self.catalog.refresh()
+            
+            # Создаем автоматизаторы для обоих сервисов
+            self.spotify_automation = SpotifyAutomation(spotify_config, self.catalog)
+            self.apple_music_automation = AppleMusicAutomation(apple_config, self.catalog)
+            
+            # Добавляем нужные атрибуты, если их нет
+            if not hasattr(self.spotify_automation, 'device_connections'):
+                self.spotify_automation.device_connections = {}
+                
+            if not hasattr(self.apple_music_automation, 'device_connections'):
+                self.apple_music_automation.device_connections = {}
+            
+            # Регистрируем обработчики обновления прогресса
+            def spotify_progress_handler(device, current, total):
+                # Простой адаптер, добавляет тип сервиса
+                self._handle_device_progress(device, current, total, 'spotify')
+            
+            def apple_progress_handler(device, current, total):
+                # Простой адаптер, добавляет тип сервиса
+                self._handle_device_progress(device, current, total, 'apple_music')
+            
+            self.spotify_automation.on_device_progress = spotify_progress_handler
+            self.apple_music_automation.on_device_progress = apple_progress_handler
+                    
+            # Общий обработчик статуса
+            self.spotify_automation.on_status_update = self._handle_status_update
+            self.apple_music_automation.on_status_update = self._handle_status_update
+            
+            # Список устройств уже получен при создании SpotifyAutomation
+            if not self.spotify_automation.devicelist:
+                self.spotify_automation.initialize_devices()
+            devicelist = self.spotify_automation.devicelist
+            
+            if not devicelist:
+                self.log_message.emit("ERROR", "Не найдено ни одного устройства")
+                self.task_completed.emit(False)
+                return
+            
+            # Создаем event loop
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            
+            try:
+                loop.run_until_complete(self._run_mix_automation(devicelist))
+            finally:
+                loop.close()
+                self.log_message.emit("INFO", "Event loop завершен")
+            
+        except Exception as e:
+            error_msg = f"Критическая ошибка в Mix Worker: {str(e)}"
+            self.log_message.emit("ERROR", error_msg)
+            self.task_completed.emit(False)
+        finally:
+            self.running = False
+            self.log_message.emit("INFO", "Mix Worker остановлен")
+    
+    def _ensure_track_plays_files(self):
+        """Создает файлы статистики если они не существуют"""
+        os.makedirs('data', exist_ok=True)
+        
+        # Проверяем файл Spotify
+        spotify_stats = 'data/spotify_track_plays.json'
+        if not os.path.exists(spotify_stats):
+            with open(spotify_stats, 'w') as f:
+                json.dump({}, f)
+            self.log_message.emit("INFO", "Создан файл статистики Spotify")
+        
+        # Проверяем файл Apple Music
+        apple_stats = 'data/apple_track_plays.json'
+        if not os.path.exists(apple_stats):
+            with open(apple_stats, 'w') as f:
+                json.dump({}, f)
+            self.log_message.emit("INFO", "Создан файл статистики Apple Music")
+    
+    async def _run_mix_automation(self, devicelist):
+        """Запуск смешанной автоматизации"""
+        try:
+            self.log_message.emit("INFO", f"Запуск Mix режима для {len(devicelist)} устройств")
+            
+            # Создаем файлы статистики если они не существуют
+            self._ensure_track_plays_files()
+            
+            # Инициализируем начальный сервис для каждого устройства случайно
+            # Общее количество треков в базе - по общему каталогу
+            total_songs = self.catalog.size
+            
+            # Устанавливаем это значение для обоих автоматизаций
+            for device in devicelist:
+                spotify_state = self.spotify_automation.get_device_state(device)
+                spotify_state.total_songs = total_songs
+                
+                apple_state = self.apple_music_automation.get_device_state(device) 
+                apple_state.total_songs = total_songs
+                self._switch_service(device, initial=True)
+            
+            # Приложения начальных сервисов выводятся на передний план на всех устройствах сразу
+            await self._launch_initial_services(devicelist)
+            
+            # У каждого устройства своя задача; общий лимит одновременной работы
+            self.scheduler = MixScheduler(max_concurrent=self.config.mix_max_concurrent)
+            # Шаги устройств блокируют только свои потоки; следим за общим циклом планировщика
+            lag_task = asyncio.create_task(watch_event_loop('mix', self.config))
+            try:
+                await self.scheduler.run(devicelist, self._device_step, self._limits_reached)
+            finally:
+                lag_task.cancel()
+                self.scheduler.shutdown()
+                self._report_switch_costs()
+            
+            self.log_message.emit("INFO", "Автоматизация Mix завершена")
+            self.task_completed.emit(True)
+            
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Ошибка запуска Mix автоматизации: {str(e)}")
+            self.task_completed.emit(False)
+    
+    async def _launch_initial_services(self, devicelist: List[str]):
+        """Параллельный запуск приложения начального сервиса на всех устройствах (одна shell сессия на устройство)"""
+        groups: Dict[str, List[str]] = {}
+        for device_id in devicelist:
+            groups.setdefault(self._service_package(self.current_services.get(device_id)), []).append(device_id)
+        lifecycle = self.spotify_automation.lifecycle
+        batches = await asyncio.gather(*(
+            lifecycle.run_all(device_ids, launch_app_script(package), self.device_connections)
+            for package, device_ids in groups.items()
+        ))
+        failed = [device_id for results in batches for device_id, result in results.items() if not result.success]
+        if failed:
+            self.log_message.emit("WARNING", f"Начальный сервис не запустился на: {', '.join(failed)}")
+    
+    async def _device_step(self, device_id: str):
+        """
+        Один шаг устройства: переключение сервиса на границе трека и проигрывание трека.
+        Перед переключением следующее приложение прогревается в фоне.
+        Шаг выполняется в потоке планировщика, поэтому блокирующие вызовы допустимы.
+        """
+        set_log_device(device_id)
+        if not self.running:
+            return False
+        
+        start_time = time.time()
+        timer = self.service_timers.get(device_id)
+        switched = False
+        if timer is None:
+            self._switch_service(device_id, initial=True)
+        elif self.switch_costs.should_switch(device_id, timer):
+            self._switch_service(device_id)
+            switched = True
+            # Выводим приложение на передний план без остановки: прогретое стартует быстро
+            self._activate_service(device_id)
+        
+        if self.current_services.get(device_id) == 'spotify':
+            await self._process_spotify_device(device_id)
+        else:
+            await self._process_apple_device(device_id)
+        
+        lost = self.switch_costs.record_step(device_id, time.time() - start_time, switched)
+        if switched:
+            record_event(device_id, self.current_services.get(device_id, ''), STEP_SWITCH, 'ok', latency=lost)
+            self.log_message.emit("INFO", f"Переключение на устройстве {device_id} стоило {lost:.1f} сек")
+        
+        timer = self.service_timers.get(device_id)
+        if timer and self.running and self.switch_costs.should_prewarm(device_id, timer, self.config.mix_prewarm_lead):
+            timer.prewarmed = True
+            self._prewarm_next_service(device_id)
+    
+    @staticmethod
+    def _service_package(service: str) -> str:
+        return SPOTIFY_PACKAGE if service == 'spotify' else APPLE_MUSIC_PACKAGE
+    
+    def _get_connection(self, device_id: str) -> u2.Device:
+        """Подключение к устройству из кэша"""
+        d = self.device_connections.get(device_id)
+        if d is None:
+            d = u2.connect(device_id)
+            self.device_connections[device_id] = d
+        return d
+    
+    def _activate_service(self, device_id: str):
+        """Вывод приложения текущего сервиса на передний план (блокирующий вызов)"""
+        package = self._service_package(self.current_services.get(device_id))
+        try:
+            self.spotify_automation.lifecycle.run_sync(
+                self._get_connection(device_id), launch_app_script(package), device_id
+            )
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Ошибка запуска {package} на устройстве {device_id}: {str(e)}")
+    
+    def _available_memory_mb(self, d: u2.Device) -> Optional[int]:
+        """Свободная память устройства по /proc/meminfo"""
+        match = re.search(r'(\d+)', shell_output(d, "grep MemAvailable /proc/meminfo"))
+        return int(match.group(1)) // 1024 if match else None
+    
+    def _prewarm_next_service(self, device_id: str):
+        """
+        Прогрев приложения следующего сервиса (блокирующий вызов).
+
+        Одной shell сессией запускается процесс следующего приложения (без
+        анимации и без ожидания интерфейса) и сразу возвращается текущее:
+        экран проигрывания пропадает примерно на время запуска процесса
+        (ожидание pidof ограничено 5 сек), звук текущего трека не прерывается.
+        """
+        start_time = time.time()
+        current = self.current_services.get(device_id)
+        next_package = self._service_package('apple_music' if current == 'spotify' else 'spotify')
+        try:
+            d = self._get_connection(device_id)
+            available = self._available_memory_mb(d)
+            if available is not None and available < self.config.mix_prewarm_min_memory_mb:
+                self.log_message.emit("INFO", f"Прогрев {next_package} на {device_id} пропущен: "
+                                              f"свободно {available} МБ")
+                return
+            
+            if shell_output(d, f"pidof {next_package}").strip():
+                return  # Процесс уже запущен
+            
+            script = prewarm_app_script(next_package, self._service_package(current))
+            self.spotify_automation.lifecycle.run_sync(d, script, device_id)
+            self.switch_costs.record_prewarm(device_id, time.time() - start_time)
+            self.log_message.emit("INFO", f"Прогрет {next_package} на устройстве {device_id}")
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Ошибка прогрева на устройстве {device_id}: {str(e)}")
+    
+    def _report_switch_costs(self):
+        """Отчет о времени, потерянном на переключения сервисов"""
+        for line in self.switch_costs.format_report():
+            self.log_message.emit("INFO", line)
+        self._handle_status_update(f"Потери на переключение сервисов: {self.switch_costs.total_lost:.0f} сек")
+    
+    def _limits_reached(self) -> bool:
+        """Общее условие остановки: ручная остановка или лимиты обоих сервисов"""
+        if not self.running:
+            return True
+        spotify_limits = self.spotify_automation.check_play_limits_reached()
+        apple_limits = self.apple_music_automation.check_play_limits_reached()
+        if spotify_limits and apple_limits:
+            self.log_message.emit("INFO", 
+                                 "Достигнуты лимиты проигрывания для обоих сервисов. Завершаем работу")
+            return True
+        return False
+    
+    async def _process_spotify_device(self, device_id: str):
+        """Обработка устройства для Spotify"""
+        name_artist = None
+        try:
+            # Получаем состояние устройства
+            state = self.spotify_automation.get_device_state(device_id)
+            
+            # Проверяем, что config установлен
+            if not hasattr(state, 'config') or state.config is None:
+                state.config = self.spotify_automation.config
+                self.log_message.emit("INFO", f"Установлена конфигурация для Spotify устройства {device_id}")
+            
+            # Проверяем, достигнуты ли лимиты для Spotify
+            if self.spotify_automation.check_play_limits_reached():
+                self.log_message.emit("INFO", f"Достигнуты лимиты для Spotify на устройстве {device_id}")
+                # Принудительно переключаем на Apple Music
+                self._switch_service(device_id)
+                return
+            
+            # Получаем трек
+            result = await self.spotify_automation.next_track(device_id)
+            if not result:
+                self.log_message.emit("INFO", f"Нет доступных треков для Spotify на устройстве {device_id}")
+                # Принудительно переключаем на Apple Music
+                self._switch_service(device_id)
+                return
+            
+            # Воспроизводим трек
+            name_artist = result[0]
+            self.log_message.emit("INFO", f"Spotify на устройстве {device_id}: Воспроизведение {name_artist}")
+            
+            # Подключаемся к устройству с обработкой возможного отсутствия атрибута
+            d = None
+            
+            # Проверяем наш собственный кэш подключений
+            if device_id in self.device_connections:
+                d = self.device_connections[device_id]
+                
+            # В противном случае создаем новое подключение
+            if d is None:
+                d = u2.connect(device_id)
+                self.device_connections[device_id] = d
+                
+                # Сохраняем также в автоматизаторе для совместимости
+                if hasattr(self.spotify_automation, 'device_connections'):
+                    self.spotify_automation.device_connections[device_id] = d
+            
+            # Поиск и воспроизведение
+            await self.spotify_automation.search_and_play(d, name_artist)
+            
+            # Засчитываем проигрывание (состояние пишется фоновым таймером автоматизации)
+            self.spotify_automation.state_store.commit_play(state, name_artist)
+            self._handle_device_progress(device_id, state.songs_played, state.total_songs, 'spotify')
+            
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Ошибка обработки Spotify на устройстве {device_id}: {str(e)}")
+            if name_artist:
+                self.spotify_automation.state_store.release(device_id, name_artist)
+
+    async def _process_apple_device(self, device_id: str):
+        """Обработка устройства для Apple Music"""
+        name_artist = None
+        try:
+            # Получаем состояние устройства
+            state = self.apple_music_automation.get_device_state(device_id)
+            
+            # Проверяем, что config установлен
+            if not hasattr(state, 'config') or state.config is None:
+                state.config = self.apple_music_automation.config
+                self.log_message.emit("INFO", f"Установлена конфигурация для Apple Music устройства {device_id}")
+            
+            # Проверяем, достигнуты ли лимиты для Apple Music
+            if self.apple_music_automation.check_play_limits_reached():
+                self.log_message.emit("INFO", f"Достигнуты лимиты для Apple Music на устройстве {device_id}")
+                # Принудительно переключаем на Spotify
+                self._switch_service(device_id)
+                return
+            
+            # Получаем трек
+            result = await self.apple_music_automation.next_track(device_id)
+            if not result:
+                self.log_message.emit("INFO", f"Нет доступных треков для Apple Music на устройстве {device_id}")
+                # Принудительно переключаем на Spotify
+                self._switch_service(device_id)
+                return
+            
+            # Воспроизводим трек
+            name_artist = result[0]
+            self.log_message.emit("INFO", f"Apple Music на устройстве {device_id}: Воспроизведение {name_artist}")
+            
+            # Подключаемся к устройству
+            d = None
+            
+            # Проверяем наш собственный кэш подключений
+            if device_id in self.device_connections:
+                d = self.device_connections[device_id]
+            
+            # В противном случае создаем новое подключение
+            if d is None:
+                d = u2.connect(device_id)
+                self.device_connections[device_id] = d
+                
+                # Сохраняем также в автоматизаторе для совместимости
+                if hasattr(self.apple_music_automation, 'device_connections'):
+                    self.apple_music_automation.device_connections[device_id] = d
+            
+            # Поиск и воспроизведение
+            await self.apple_music_automation.search_and_play(d, name_artist)
+            
+            # Засчитываем проигрывание (состояние пишется фоновым таймером автоматизации)
+            self.apple_music_automation.state_store.commit_play(state, name_artist)
+            self._handle_device_progress(device_id, state.songs_played, state.total_songs, 'apple_music')
+            
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Ошибка обработки Apple Music на устройстве {device_id}: {str(e)}")
+            if name_artist:
+                self.apple_music_automation.state_store.release(device_id, name_artist)
\ No newline at end of file
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from utils.logging_config import set_log_device
+from utils.metrics import watch_executor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeviceTimer:
+    """Таймер текущего сервиса устройства в Mix-режиме"""
+    service: str
+    started: float
+    duration: int
+    prewarmed: bool = False  # Следующий сервис уже прогрет
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started
+
+    @property
+    def remaining(self) -> float:
+        return self.duration - self.elapsed
+
+    @property
+    def expired(self) -> bool:
+        return self.elapsed >= self.duration
+
+
+@dataclass
+class DeviceSchedule:
+    """Статистика задачи одного устройства"""
+    device_id: str
+    steps: int = 0
+    errors: int = 0
+    last_step: float = 0.0  # Длительность последнего шага, сек
+
+
+@dataclass
+class SwitchStats:
+    """Стоимость переключения сервисов на одном устройстве"""
+    step_estimate: float = 0.0  # Сглаженная длительность обычного шага, сек
+    switch_estimate: float = 0.0  # Сглаженная длительность шага с переключением, сек
+    switches: int = 0
+    prewarms: int = 0
+    lost: float = 0.0  # Всего потеряно на переключения и прогрев, сек
+
+
+class SwitchCostModel:
+    """
+    Модель стоимости переключения сервиса для Mix-режима.
+
+    Длительности шагов сглаживаются экспоненциально (alpha). Стоимость
+    переключения - насколько шаг с переключением дольше обычного; по ней
+    выбирается момент прогрева следующего приложения и граница трека,
+    на которой переключаться.
+    """
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.stats: Dict[str, SwitchStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, device_id: str) -> SwitchStats:
+        if device_id not in self.stats:
+            self.stats[device_id] = SwitchStats()
+        return self.stats[device_id]
+
+    def _smooth(self, current: float, value: float) -> float:
+        return value if current <= 0 else current + self.alpha * (value - current)
+
+    def record_step(self, device_id: str, duration: float, switched: bool) -> float:
+        """
+        Учет длительности шага.
+
+        Returns:
+            float: потери на переключение в этом шаге (0 для обычного шага)
+        """
+        with self._lock:
+            stats = self._stats(device_id)
+            if not switched:
+                stats.step_estimate = self._smooth(stats.step_estimate, duration)
+                return 0.0
+            stats.switches += 1
+            stats.switch_estimate = self._smooth(stats.switch_estimate, duration)
+            lost = max(0.0, duration - stats.step_estimate)
+            stats.lost += lost
+            return lost
+
+    def record_prewarm(self, device_id: str, duration: float):
+        with self._lock:
+            stats = self._stats(device_id)
+            stats.prewarms += 1
+            stats.lost += duration
+
+    def step_estimate(self, device_id: str) -> float:
+        with self._lock:
+            return self._stats(device_id).step_estimate
+
+    def switch_cost(self, device_id: str) -> float:
+        with self._lock:
+            stats = self._stats(device_id)
+            if stats.switches == 0:
+                return 0.0
+            return max(0.0, stats.switch_estimate - stats.step_estimate)
+
+    def should_switch(self, device_id: str, timer: DeviceTimer) -> bool:
+        """Переключаться на этой границе трека: следующий трек закончится позже таймера больше чем наполовину"""
+        return timer.expired or timer.remaining < self.step_estimate(device_id) / 2
+
+    def should_prewarm(self, device_id: str, timer: DeviceTimer, lead: float) -> bool:
+        """Пора прогревать следующий сервис: до переключения осталось меньше lead или одного шага"""
+        if timer.prewarmed:
+            return False
+        return timer.remaining <= max(lead, self.step_estimate(device_id) + self.switch_cost(device_id))
+
+    @property
+    def total_lost(self) -> float:
+        with self._lock:
+            return sum(stats.lost for stats in self.stats.values())
+
+    def format_report(self) -> List[str]:
+        """Текстовая таблица потерь на переключения для лога"""
+        with self._lock:
+            lines = [f"{'Device':<22} switches prewarm  step  cost   lost"]
+            for device_id, stats in sorted(self.stats.items()):
+                cost = max(0.0, stats.switch_estimate - stats.step_estimate) if stats.switches else 0.0
+                lines.append(f"{device_id:<22} {stats.switches:^8} {stats.prewarms:^7} "
+                             f"{stats.step_estimate:5.1f} {cost:5.1f} {stats.lost:6.1f}s")
+            lines.append(f"Total lost: {sum(stats.lost for stats in self.stats.values()):.1f}s")
+            return lines
+
+
+class MixScheduler:
+    """
+    Планировщик Mix-режима: у каждого устройства своя задача с циклом
+    переключения сервисов, одновременно работают не больше max_concurrent устройств.
+
+    UI-операции uiautomator2 блокирующие, поэтому шаг устройства выполняется
+    в пуле потоков, у каждого потока свой event loop. Медленный эмулятор
+    задерживает только свою задачу.
+    """
+
+    def __init__(self, max_concurrent: int = 8, step_pause: float = 5.0,
+                 stop_check_interval: float = 30.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.step_pause = step_pause
+        self.stop_check_interval = stop_check_interval
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                           thread_name_prefix='mix-device')
+        watch_executor('mix-device', self.executor)
+        self.schedules: Dict[str, DeviceSchedule] = {}
+        self.running = False
+        self._local = threading.local()
+        self._loops: List[asyncio.AbstractEventLoop] = []
+        self._loops_lock = threading.Lock()
+
+    def _thread_loop(self) -> asyncio.AbstractEventLoop:
+        """Event loop текущего потока пула (создается один раз на поток)"""
+        loop = getattr(self._local, 'loop', None)
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self._local.loop = loop
+            with self._loops_lock:
+                self._loops.append(loop)
+        return loop
+
+    def _run_step(self, step: Callable[[str], Awaitable[Any]], device_id: str) -> Any:
+        # Контекст в пул не копируется: устройство для записей лога задается в самом задании
+        set_log_device(device_id)
+        return self._thread_loop().run_until_complete(step(device_id))
+
+    async def _device_loop(self, device_id: str, step: Callable[[str], Awaitable[Any]]):
+        """Цикл одного устройства"""
+        loop = asyncio.get_running_loop()
+        schedule = self.schedules[device_id]
+
+        while self.running:
+            start_time = time.time()
+            try:
+                result = await loop.run_in_executor(self.executor, self._run_step, step, device_id)
+                schedule.steps += 1
+                if result is False:
+                    logger.info(f"Mix scheduler: device {device_id} finished")
+                    break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                schedule.errors += 1
+                logger.error(f"Mix step failed on {device_id}: {str(e)}")
+            finally:
+                schedule.last_step = time.time() - start_time
+
+            await asyncio.sleep(self.step_pause)
+
+    async def _watch_stop_condition(self, stop_condition: Callable[[], bool]):
+        """Периодическая проверка общего условия остановки (лимиты, ручная остановка)"""
+        loop = asyncio.get_running_loop()
+        while self.running:
+            await asyncio.sleep(self.stop_check_interval)
+            try:
+                if await loop.run_in_executor(None, stop_condition):
+                    logger.info("Mix scheduler: stop condition reached")
+                    self.running = False
+            except Exception as e:
+                logger.error(f"Error checking mix stop condition: {str(e)}")
+
+    async def run(self, device_ids: Iterable[str], step: Callable[[str], Awaitable[Any]],
+                  stop_condition: Optional[Callable[[], bool]] = None):
+        """
+        Запуск задач устройств и ожидание их завершения.
+
+        Args:
+            device_ids: устройства
+            step: корутина одного шага устройства; False - устройство закончило работу
+            stop_condition: общее условие остановки, проверяется раз в stop_check_interval
+        """
+        self.running = True
+        device_ids = list(device_ids)
+        self.schedules = {device_id: DeviceSchedule(device_id=device_id) for device_id in device_ids}
+        logger.info(f"Mix scheduler: {len(device_ids)} devices, up to {self.max_concurrent} at once")
+
+        tasks = [asyncio.create_task(self._device_loop(device_id, step), name=f"mix_{device_id}")
+                 for device_id in device_ids]
+        watcher = asyncio.create_task(self._watch_stop_condition(stop_condition)) if stop_condition else None
+
+        try:
+            # Ждем, пока все устройства закончат или сработает условие остановки
+            pending = set(tasks)
+            while pending and self.running:
+                _, pending = await asyncio.wait(pending, timeout=1.0)
+        finally:
+            self.running = False
+            if watcher:
+                watcher.cancel()
+            # Текущие шаги в потоках доигрывают трек; задачи устройств ждем
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if watcher:
+                await asyncio.gather(watcher, return_exceptions=True)
+
+    def stop(self):
+        """Остановка: новые шаги не запускаются"""
+        self.running = False
+
+    def shutdown(self):
+        """Освобождение пула потоков и event loop'ов потоков"""
+        self.running = False
+        self.executor.shutdown(wait=True)
+        with self._loops_lock:
+            for loop in self._loops:
+                if not loop.is_closed():
+                    loop.close()
+            self._loops.clear()
@@ -0,0 +1,207 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.config import Config
+from .headless import StatusBoard
+from .farm_coordinator import ROLE_CLIENT, ROLE_COORDINATOR, connect_farm
+
+logger = logging.getLogger(__name__)
+
+
+def _shard_main(config_data: Dict[str, Any], index: int, count: int, events, stop_event):
+    """
+    Точка входа процесса-шарда.
+
+    Запускает HeadlessRunner на своей части устройств; все события StatusBoard
+    уходят в очередь супервизора с номером шарда. Логи процесса попадают туда же,
+    поэтому своих обработчиков логирования шард не заводит.
+    """
+    logging.getLogger().setLevel(logging.INFO)
+
+    from .headless import HeadlessRunner
+
+    config = Config.from_dict(config_data)
+    config.shard_index, config.shard_count = index, count
+    config.status_port = 0  # Статус отдает супервизор
+    if config.metrics_port:
+        config.metrics_port += index + 1  # Метрики каждого шарда - на своем порту
+
+    def sink(kind, *args):
+        events.put((index, kind) + args)
+
+    runner = HeadlessRunner(config, sink=sink)
+
+    def watch_stop():
+        stop_event.wait()
+        runner.stop()
+
+    threading.Thread(target=watch_stop, name='shard-stop', daemon=True).start()
+    exit_code = runner.run()
+    events.put((index, 'exit', exit_code))
+    return exit_code
+
+
+class ShardSupervisor:
+    """
+    Распределение устройств по нескольким процессам.
+
+    Каждый процесс получает шард index/processes (select_shard) и запускает
+    свой движок; счетчики проигрываний шарды сводят через общий файл
+    статистики StateStore. События шардов собираются в одну StatusBoard и
+    передаются в on_event(kind, *args) - формат тот же, что у sink StatusBoard.
+    Упавший шард перезапускается до max_restarts раз.
+    """
+
+    def __init__(self, config: Config, processes: int,
+                 on_event: Optional[Callable[..., None]] = None, max_restarts: int = 3):
+        self.config = config
+        self.processes = max(1, processes)
+        self.on_event = on_event
+        self.max_restarts = max_restarts
+        self.board = StatusBoard(config)
+        self.board.shard = f"{self.processes} processes"
+        self.running = False
+        self._context = multiprocessing.get_context('spawn')  # Одинаково на Windows и Linux
+        self._events = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._workers: Dict[int, multiprocessing.Process] = {}
+        self._restarts: Dict[int, int] = {}
+        self._exit_codes: Dict[int, int] = {}
+        self._config_data: Dict[str, Any] = {}
+        self._stop_deadline: Optional[float] = None  # После него run() завершает шарды принудительно
+
+    def _shard_config(self) -> Dict[str, Any]:
+        """
+        Конфигурация процессов-шардов.
+
+        Координатор фермы должен быть один на машину: он запускается в процессе
+        супервизора, а шарды подключаются к нему клиентами.
+        """
+        config_data = asdict(self.config)
+        if self.config.farm_role == ROLE_COORDINATOR:
+            connect_farm(self.config)
+            config_data['farm_role'] = ROLE_CLIENT
+            if self.config.farm_host in ('', '0.0.0.0'):
+                config_data['farm_host'] = '127.0.0.1'
+        return config_data
+
+    def _start_shard(self, index: int):
+        process = self._context.Process(
+            target=_shard_main,
+            args=(self._config_data, index, self.processes, self._events, self._stop_event),
+            name=f"shard-{index + 1}",
+            daemon=True
+        )
+        process.start()
+        self._workers[index] = process
+        logger.info(f"Shard {index + 1}/{self.processes} started (pid {process.pid})")
+
+    def _dispatch(self, event: tuple):
+        index, kind, *args = event
+        if kind == 'exit':
+            self._exit_codes[index] = args[0]
+            return
+        if kind == 'progress':
+            self.board.on_progress(*args)
+        elif kind == 'service':
+            self.board.on_service_switched(*args)
+        elif kind == 'status':
+            args = [f"[shard {index + 1}] {args[0]}"]
+            self.board.on_status(*args)
+        elif kind == 'log':
+            level, message = args
+            logger.log(getattr(logging, level, logging.INFO), f"[shard {index + 1}] {message}")
+            return  # В on_event лог приходит через обработчики логирования родителя
+        elif kind == 'completed':
+            return  # Итог считается по всем шардам в run()
+
+        if self.on_event:
+            try:
+                self.on_event(kind, *args)
+            except Exception as e:
+                logger.error(f"Error in shard event callback: {str(e)}")
+
+    def _drain(self, timeout: float):
+        try:
+            self._dispatch(self._events.get(timeout=timeout))
+            while True:
+                self._dispatch(self._events.get_nowait())
+        except queue.Empty:
+            pass
+
+    def _check_workers(self):
+        dead = [index for index, process in self._workers.items() if not process.is_alive()]
+        if not dead:
+            return
+        self._drain(timeout=0.1)  # Событие 'exit' могло еще не быть прочитано
+
+        for index in dead:
+            process = self._workers[index]
+            process.join()
+            del self._workers[index]
+            exit_code = self._exit_codes.get(index, process.exitcode)
+            if exit_code in (0, None) and index in self._exit_codes:
+                logger.info(f"Shard {index + 1}/{self.processes} finished")
+                continue
+            if self._stop_event.is_set():
+                continue
+            restarts = self._restarts.get(index, 0)
+            if restarts >= self.max_restarts:
+                logger.error(f"Shard {index + 1} failed (exit code {exit_code}), restart limit reached")
+                self._exit_codes[index] = exit_code if exit_code else 1
+                continue
+            self._restarts[index] = restarts + 1
+            self._exit_codes.pop(index, None)
+            logger.warning(f"Shard {index + 1} exited with code {exit_code}, "
+                           f"restarting ({restarts + 1}/{self.max_restarts})")
+            self._start_shard(index)
+
+    def run(self) -> int:
+        """Запуск всех шардов до их завершения или остановки. Возвращает код выхода"""
+        self.running = True
+        self.board.running = True
+        logger.info(f"Starting {self.processes} shard processes, mode={self.config.service_type}")
+        try:
+            self._config_data = self._shard_config()
+            for index in range(self.processes):
+                self._start_shard(index)
+            while self._workers:
+                self._drain(timeout=0.5)
+                self._terminate_overdue()
+                self._check_workers()
+            self._drain(timeout=0.1)
+        finally:
+            self.running = False
+            self.board.running = False
+
+        failed: List[int] = [index for index, code in self._exit_codes.items() if code]
+        success = not failed
+        self.board.on_completed(success)
+        if self.on_event:
+            self.on_event('completed', success)
+        return 0 if success else 1
+
+    def _terminate_overdue(self):
+        """Шарды, не завершившиеся за таймаут остановки, завершаются принудительно (поток run)"""
+        if self._stop_deadline is None or time.time() < self._stop_deadline:
+            return
+        for process in self._workers.values():
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating")
+                process.terminate()
+        self._stop_deadline = None
+
+    def stop(self, timeout: float = 60):
+        """
+        Сигнал остановки всем шардам; не блокирует (вызывается из потока UI).
+
+        Ожидание процессов и terminate по таймауту выполняет цикл run().
+        """
+        logger.info("Stopping shard processes...")
+        self._stop_deadline = time.time() + timeout
+        self._stop_event.set()
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, List, Optional
+
+import uiautomator2 as u2
+
+from utils.config import Config
+from utils.probe_endpoint import ProbeEndpoint
+from utils.metrics import PROXY_RESTARTS, watch_executor
+from .app_lifecycle import (AppLifecycle, LifecycleScript, launch_app_script, shell_output, WAIT_RESUMED,
+                            SPOTIFY_PACKAGE, APPLE_MUSIC_PACKAGE, SURFBOARD_PACKAGE)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProxyRestartResult:
+    """Результат перезапуска прокси на одном устройстве"""
+    device_id: str
+    attempts: int = 0
+    restarted: bool = False  # Surfboard перезапущен
+    vpn_active: bool = False  # Кнопка Stop VPN видна
+    connectivity: bool = False  # Проверочный запрос прошел
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.restarted and self.vpn_active and self.connectivity
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['ok'] = self.ok
+        return data
+
+
+class ProxyFleetManager:
+    """
+    Параллельный перезапуск Surfboard на парке устройств.
+
+    Каждое устройство обрабатывается в отдельном потоке (u2 вызовы блокирующие),
+    одновременно - не больше proxy_restart_concurrency. После перезапуска
+    проверяется VPN и реальная связность; повторяются только неудачные устройства.
+    """
+
+    def __init__(self, config: Config, lifecycle: Optional[AppLifecycle] = None):
+        self.config = config
+        self.concurrency = max(1, config.proxy_restart_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                           thread_name_prefix='proxy-fleet')
+        watch_executor('proxy-fleet', self.executor)
+        self.lifecycle = lifecycle or AppLifecycle(self.executor)
+        self.running = True
+
+    def _service_packages(self) -> List[str]:
+        """Пакеты сервисов, которые нужно остановить вместе с прокси"""
+        if self.config.service_type == Config.SERVICE_SPOTIFY:
+            return [SPOTIFY_PACKAGE]
+        if self.config.service_type == Config.SERVICE_APPLE_MUSIC:
+            return [APPLE_MUSIC_PACKAGE]
+        return [SPOTIFY_PACKAGE, APPLE_MUSIC_PACKAGE]
+
+    def _activate_vpn_sync(self, device: u2.Device, device_addr: str) -> bool:
+        """Включение VPN в Surfboard (синхронно)"""
+        for _ in range(3):
+            if device(description="Stop VPN").exists:
+                logger.info(f"VPN already running on {device_addr}")
+                return True
+            if device(description="Start VPN").exists:
+                logger.info(f"Starting VPN on {device_addr}")
+                device(description="Start VPN").click()
+                time.sleep(2)
+                # Обработка возможных диалогов
+                for text in ("Connect", "OK"):
+                    if device(text=text).exists:
+                        device(text=text).click()
+                        time.sleep(1)
+                if device(description="Stop VPN").exists:
+                    logger.info(f"VPN successfully started on {device_addr}")
+                    return True
+            time.sleep(1)
+
+        logger.error(f"Failed to verify VPN status on {device_addr}")
+        return False
+
+    def probe_connectivity_sync(self, device: u2.Device, url: str, timeout: int = 5) -> bool:
+        """Проверка связности: HTTP запрос с устройства (curl, при отсутствии - toybox wget)"""
+        command = (
+            f"if command -v curl >/dev/null 2>&1; then "
+            f"curl -s -o /dev/null -m {timeout} -w 'HTTP:%{{http_code}}' '{url}'; "
+            f"else wget -q -T {timeout} -O /dev/null '{url}' && echo HTTP:204; fi"
+        )
+        try:
+            output = shell_output(device, command, timeout + 10)
+            if 'HTTP:' not in output:
+                return False
+            code = output.rsplit('HTTP:', 1)[1].strip()[:3]
+            return code.isdigit() and 200 <= int(code) < 400
+        except Exception as e:
+            logger.warning(f"Connectivity probe failed: {str(e)}")
+            return False
+
+    def restart_device_sync(self, device_addr: str, probe_url: str,
+                            result: ProxyRestartResult,
+                            connection: Optional[u2.Device] = None) -> ProxyRestartResult:
+        """Перезапуск прокси и проверка связности на одном устройстве"""
+        start_time = time.time()
+        result.attempts += 1
+        result.error = None
+        try:
+            device = connection or u2.connect(device_addr)
+            current_app = device.app_current()
+
+            script = LifecycleScript(
+                stop_packages=[SURFBOARD_PACKAGE, *self._service_packages()],
+                launch_package=SURFBOARD_PACKAGE,
+                wait_mode=WAIT_RESUMED
+            )
+            result.restarted = self.lifecycle.run_sync(device, script, device_addr).success
+            result.vpn_active = self._activate_vpn_sync(device, device_addr)
+            result.connectivity = result.vpn_active and self.probe_connectivity_sync(device, probe_url)
+
+            # Возвращаемся к предыдущему приложению
+            if current_app and current_app.get("package") not in (None, SURFBOARD_PACKAGE):
+                self.lifecycle.run_sync(device, launch_app_script(current_app["package"]), device_addr)
+        except Exception as e:
+            result.error = str(e)
+            logger.error(f"Error restarting proxy on {device_addr}: {str(e)}")
+        finally:
+            result.elapsed = time.time() - start_time
+        PROXY_RESTARTS.labels('manual', 'ok' if result.ok else 'failed').inc()
+        return result
+
+    async def restart_all(self, device_ids: Iterable[str],
+                          connections: Optional[Dict[str, u2.Device]] = None) -> Dict[str, ProxyRestartResult]:
+        """
+        Перезапуск прокси на всех устройствах с повтором только неудачных.
+
+        Returns:
+            Dict[str, ProxyRestartResult]: матрица результатов по устройствам
+        """
+        connections = connections or {}
+        results = {device_id: ProxyRestartResult(device_id=device_id) for device_id in device_ids}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+
+        endpoint = None
+        probe_url = self.config.proxy_check_url
+        if not probe_url:
+            endpoint = ProbeEndpoint().start()
+            probe_url = endpoint.url_for(self.config.proxy_probe_host)
+
+        async def restart_one(device_id: str):
+            async with semaphore:
+                if not self.running:
+                    return
+                await loop.run_in_executor(
+                    self.executor, self.restart_device_sync,
+                    device_id, probe_url, results[device_id], connections.get(device_id)
+                )
+
+        try:
+            pending = list(results.keys())
+            for attempt in range(1, max(1, self.config.retry_attempts) + 1):
+                if not pending or not self.running:
+                    break
+                logger.info(f"Proxy restart round {attempt}: {len(pending)} devices")
+                await asyncio.gather(*(restart_one(device_id) for device_id in pending))
+                pending = [device_id for device_id in pending if not results[device_id].ok]
+                if pending:
+                    logger.warning(f"Proxy restart round {attempt} failed on: {', '.join(pending)}")
+        finally:
+            if endpoint:
+                endpoint.stop()
+
+        return results
+
+    @staticmethod
+    def format_matrix(results: Dict[str, ProxyRestartResult]) -> List[str]:
+        """Текстовая таблица результатов для лога"""
+        mark = lambda value: "+" if value else "-"
+        lines = [f"{'Device':<22} restart vpn net tries  time"]
+        for device_id, result in sorted(results.items()):
+            line = (f"{device_id:<22} {mark(result.restarted):^7} {mark(result.vpn_active):^3} "
+                    f"{mark(result.connectivity):^3} {result.attempts:^5} {result.elapsed:5.1f}s")
+            if result.error:
+                line += f" ({result.error[:60]})"
+            lines.append(line)
+        ok_count = sum(1 for result in results.values() if result.ok)
+        lines.append(f"OK: {ok_count}/{len(results)}")
+        return lines
+
+    def stop(self):
+        """Остановка менеджера"""
+        self.running = False
+        self.executor.shutdown(wait=False)
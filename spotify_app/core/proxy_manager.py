@@ -4,6 +4,9 @@ import asyncio
 import time
 from typing import Dict, List
 from utils.config import Config  # Проверьте импорт
+from .app_lifecycle import (AppLifecycle, LifecycleScript, launch_app_script, WAIT_RESUMED,
+                            SPOTIFY_PACKAGE, APPLE_MUSIC_PACKAGE, SURFBOARD_PACKAGE)
+from .proxy_fleet import ProxyFleetManager, ProxyRestartResult
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +16,8 @@ class ProxyManager:
         self.devicelist: List[str] = []
         self.device_connections: Dict[str, u2.Device] = {}
         self.running = True
+        self.lifecycle = AppLifecycle()
+        self.fleet = None
         
     def initialize_devices(self):
         """Инициализация подключений к устройствам"""
@@ -34,6 +39,15 @@ class ProxyManager:
             logger.warning("No devices found!")
             raise Exception("No devices available")
 
+    @staticmethod
+    def _surfboard_script(*service_packages: str) -> LifecycleScript:
+        """Сценарий: остановить Surfboard и сервисы, запустить Surfboard и дождаться его activity"""
+        return LifecycleScript(
+            stop_packages=[SURFBOARD_PACKAGE, *service_packages],
+            launch_package=SURFBOARD_PACKAGE,
+            wait_mode=WAIT_RESUMED
+        )
+
     async def restart_proxy_spotify(self, device: u2.Device, device_addr: str):
         """Перезапуск прокси для Spotify"""
         try:
@@ -41,14 +55,8 @@ class ProxyManager:
             current_app = device.app_current()
             logger.info(f"Restarting proxy for device {device_addr}")
             
-            # Только останавливаем приложения, без очистки данных
-            device.app_stop('com.getsurfboard')
-            device.app_stop('com.spotify.music')
-            await asyncio.sleep(1)
-            
-            # Запускаем Surfboard
-            device.app_start('com.getsurfboard')
-            await asyncio.sleep(3)  # Увеличиваем задержку для надежности
+            # Останавливаем приложения (без очистки данных) и запускаем Surfboard одной shell сессией
+            await self.lifecycle.run(device, self._surfboard_script(SPOTIFY_PACKAGE), device_addr)
             
             # Проверяем статус VPN
             retry_attempts = 3
@@ -80,8 +88,7 @@ class ProxyManager:
                 
             # Возвращаемся к предыдущему приложению
             if current_app:
-                device.app_start(current_app["package"])
-                await asyncio.sleep(2)
+                await self.lifecycle.run(device, launch_app_script(current_app["package"]), device_addr)
                 
             return True
             
@@ -96,14 +103,8 @@ class ProxyManager:
             current_app = device.app_current()
             logger.info(f"Restarting proxy for device {device_addr}")
             
-            # Только останавливаем приложения
-            device.app_stop('com.getsurfboard')
-            device.app_stop('com.apple.android.music')
-            await asyncio.sleep(1)
-            
-            # Запускаем Surfboard
-            device.app_start('com.getsurfboard')
-            await asyncio.sleep(3)
+            # Останавливаем приложения (без очистки данных) и запускаем Surfboard одной shell сессией
+            await self.lifecycle.run(device, self._surfboard_script(APPLE_MUSIC_PACKAGE), device_addr)
             
             # Проверяем статус VPN
             retry_attempts = 3
@@ -135,8 +136,7 @@ class ProxyManager:
                 
             # Возвращаемся к предыдущему приложению
             if current_app:
-                device.app_start(current_app["package"])
-                await asyncio.sleep(2)
+                await self.lifecycle.run(device, launch_app_script(current_app["package"]), device_addr)
                 
             return True
             
@@ -144,23 +144,22 @@ class ProxyManager:
             logger.error(f"Error restarting proxy on {device_addr}: {str(e)}")
             return False
 
-    async def restart_all_proxies(self):
+    async def restart_all_proxies(self) -> Dict[str, ProxyRestartResult]:
+        """Параллельный перезапуск прокси на всех устройствах с проверкой связности"""
         try:
             logger.info("Starting proxy restart process")
             self.initialize_devices()
             
-            tasks = []
-            for device_addr, device in self.device_connections.items():
-                # Корректное сравнение с типом сервиса
-                if self.config.service_type == Config.SERVICE_SPOTIFY:
-                    tasks.append(self.restart_proxy_spotify(device, device_addr))
-                elif self.config.service_type == Config.SERVICE_APPLE_MUSIC:
-                    tasks.append(self.restart_proxy_apple(device, device_addr))
-                else:
-                    logger.warning(f"Unknown service type: {self.config.service_type}")
+            self.fleet = ProxyFleetManager(self.config, self.lifecycle)
+            try:
+                results = await self.fleet.restart_all(self.devicelist, self.device_connections)
+            finally:
+                self.fleet.stop()
             
-            await asyncio.gather(*tasks)
+            for line in ProxyFleetManager.format_matrix(results):
+                logger.info(line)
             logger.info("Proxy restart completed on all devices")
+            return results
             
         except Exception as e:
             logger.error(f"Proxy restart failed: {str(e)}")
@@ -171,15 +170,10 @@ class ProxyManager:
         try:
             logger.info(f"Performing full proxy reset for {device_addr}")
             
-            # Останавливаем все приложения
-            device.app_stop('com.getsurfboard')
-            device.app_stop('com.spotify.music')
-            device.app_stop('com.apple.android.music')
-            await asyncio.sleep(2)
-            
-            # Перезапускаем прокси
-            device.app_start('com.getsurfboard')
-            await asyncio.sleep(5)
+            # Останавливаем все приложения и перезапускаем прокси одной shell сессией
+            await self.lifecycle.run(
+                device, self._surfboard_script(SPOTIFY_PACKAGE, APPLE_MUSIC_PACKAGE), device_addr
+            )
             
             # Настраиваем заново
             retry_attempts = 3
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+import uiautomator2 as u2
+
+from utils.logging_config import run_in_executor, set_log_device
+from utils.metrics import PROXY_RESTARTS, watch_executor
+
+from .app_lifecycle import SURFBOARD_PACKAGE, shell_output
+
+logger = logging.getLogger(__name__)
+
+VPN_UP = 'VPN_UP'
+VPN_NOTIFY = 'VPN_NOTIFY'
+VPN_DOWN = 'VPN_DOWN'
+
+# Одна shell команда: VPN сеть в dumpsys connectivity или уведомление Surfboard
+PROBE_COMMAND = (
+    "(dumpsys connectivity | grep -q -E 'VPN CONNECTED|VPN\\[.*CONNECTED' && echo " + VPN_UP + ") || "
+    "(dumpsys notification | grep -q 'pkg=" + SURFBOARD_PACKAGE + "' && echo " + VPN_NOTIFY + ") || "
+    "echo " + VPN_DOWN
+)
+
+
+class ProxyHealthMonitor:
+    """
+    Фоновый монитор состояния прокси, независимый от цикла проигрывания.
+
+    Для каждого устройства работает своя низкоприоритетная задача: дешевая
+    проверка VPN через dumpsys раз в interval секунд в отдельном маленьком пуле
+    потоков. После failure_threshold неудачных проверок подряд устройство
+    помечается degraded и для него вызывается restart_proxy_full. Перезапуск
+    ждет окончания текущего трека через track_guard, поэтому здоровые
+    устройства никогда не ждут монитор.
+
+    restart_func - корутина; блокирующие RPC устройства она выполняет в
+    пуле монитора (executor), чтобы перезапуск не останавливал event loop.
+    """
+
+    def __init__(self, restart_func: Callable[[u2.Device, str], Awaitable[bool]],
+                 interval: float = 300, failure_threshold: int = 2,
+                 max_concurrent_probes: int = 2,
+                 on_status: Optional[Callable[[str], None]] = None):
+        self.restart_func = restart_func
+        self.interval = max(30.0, float(interval))
+        self.failure_threshold = max(1, failure_threshold)
+        self.on_status = on_status
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent_probes),
+                                           thread_name_prefix='proxy-monitor')
+        watch_executor('proxy-monitor', self.executor)
+        self.degraded: Set[str] = set()
+        self.failures: Dict[str, int] = {}
+        self.restarts: Dict[str, int] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._guards: Dict[str, asyncio.Lock] = {}
+        self.running = False
+
+    def _guard(self, device_id: str) -> asyncio.Lock:
+        if device_id not in self._guards:
+            self._guards[device_id] = asyncio.Lock()
+        return self._guards[device_id]
+
+    @asynccontextmanager
+    async def track_guard(self, device_id: str):
+        """Обертка обработки одного трека: перезапуск прокси не начнется посреди трека"""
+        async with self._guard(device_id):
+            yield
+
+    def is_degraded(self, device_id: str) -> bool:
+        return device_id in self.degraded
+
+    def probe_sync(self, device_id: str) -> bool:
+        """Дешевая проверка VPN на устройстве (блокирующий вызов)"""
+        try:
+            output = shell_output(u2.connect(device_id), PROBE_COMMAND, 20)
+            return VPN_DOWN not in output and (VPN_UP in output or VPN_NOTIFY in output)
+        except Exception as e:
+            logger.debug(f"Proxy probe failed on {device_id}: {str(e)}")
+            return False
+
+    def _notify(self, message: str):
+        if self.on_status:
+            try:
+                self.on_status(message)
+            except Exception as e:
+                logger.debug(f"Status callback failed: {str(e)}")
+
+    async def _restart(self, device_id: str):
+        """Перезапуск прокси на деградировавшем устройстве между треками"""
+        async with self._guard(device_id):
+            logger.warning(f"Proxy degraded on {device_id}, performing full restart")
+            self.restarts[device_id] = self.restarts.get(device_id, 0) + 1
+            try:
+                d = await run_in_executor(self.executor, u2.connect, device_id)
+                restored = await self.restart_func(d, device_id)
+            except Exception as e:
+                logger.error(f"Error during proxy restart on {device_id}: {str(e)}")
+                restored = False
+
+        PROXY_RESTARTS.labels('monitor', 'ok' if restored else 'failed').inc()
+        if restored:
+            self.failures[device_id] = 0
+            self.degraded.discard(device_id)
+            logger.info(f"Proxy restored on {device_id}")
+            self._notify(f"Прокси на {device_id} восстановлен")
+        else:
+            logger.error(f"Failed to restore proxy functionality on {device_id}")
+
+    async def _monitor_device(self, device_id: str):
+        """Цикл мониторинга одного устройства"""
+        set_log_device(device_id)
+        # Разносим проверки устройств по времени
+        await asyncio.sleep(random.uniform(0, self.interval))
+
+        while self.running:
+            healthy = await run_in_executor(self.executor, self.probe_sync, device_id)
+            if healthy:
+                self.failures[device_id] = 0
+                if device_id in self.degraded:
+                    self.degraded.discard(device_id)
+                    logger.info(f"Proxy on {device_id} is healthy again")
+            else:
+                self.failures[device_id] = self.failures.get(device_id, 0) + 1
+                if self.failures[device_id] >= self.failure_threshold:
+                    if device_id not in self.degraded:
+                        self.degraded.add(device_id)
+                        self._notify(f"Прокси на {device_id} не работает, устройство помечено как degraded")
+                    await self._restart(device_id)
+
+            await asyncio.sleep(self.interval)
+
+    def start(self, device_ids: Iterable[str]):
+        """Запуск задач мониторинга (повторный вызов добавляет только новые устройства)"""
+        self.running = True
+        for device_id in device_ids:
+            task = self._tasks.get(device_id)
+            if task and not task.done():
+                continue
+            self._tasks[device_id] = asyncio.create_task(
+                self._monitor_device(device_id), name=f"proxy_monitor_{device_id}"
+            )
+        logger.info(f"Proxy health monitor started for {len(self._tasks)} devices (interval {self.interval:.0f}s)")
+
+    async def stop(self):
+        """Остановка всех задач мониторинга"""
+        self.running = False
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def shutdown(self):
+        """Освобождение пула потоков"""
+        self.running = False
+        self.executor.shutdown(wait=False)
@@ -4,16 +4,19 @@ import logging
 from .proxy_manager import ProxyManager
 from core.proxy_manager import ProxyManager
 from utils.config import Config, load_config  # Добавьте load_config
+from utils.logging_config import attach_handler, detach_handler, UI_LOG_FORMAT, UI_DATE_FORMAT
 logger = logging.getLogger(__name__)
 
 class ProxyWorker(QThread):
     log_message = pyqtSignal(str, str)
     task_completed = pyqtSignal(bool)
+    result_matrix = pyqtSignal(dict)  # device_id -> результат перезапуска прокси
 
     def __init__(self, config: Config):
         super().__init__()
         self.config = config
         self.running = False
+        self.proxy_manager = None
         self._setup_logging()
 
     def _setup_logging(self):
@@ -22,43 +25,23 @@ class ProxyWorker(QThread):
             def __init__(self, signal):
                 super().__init__()
                 self.signal = signal
-                self.setFormatter(logging.Formatter('%(asctime)s - %(message)s', 
-                                                datefmt='%Y-%m-%d %H:%M'))
+                self.setFormatter(logging.Formatter(UI_LOG_FORMAT, datefmt=UI_DATE_FORMAT))
 
             def emit(self, record):
                 msg = self.format(record)
                 self.signal.emit(record.levelname, msg)
 
-        # Получаем корневой логгер
-        root_logger = logging.getLogger()
-        
-        # Удаляем все существующие handlers чтобы избежать дублирования
-        for handler in root_logger.handlers[:]:
-            root_logger.removeHandler(handler)
-        
-        # Создаем и настраиваем новый handler
-        handler = QtHandler(self.log_message)
-        root_logger.addHandler(handler)
+        # Подключаем handler к очереди логов вместо handler'а предыдущего воркера
+        attach_handler(QtHandler(self.log_message), 'qt')
         
         # Отключаем передачу логов родительским логгерам для proxy_manager
         logging.getLogger('proxy_manager').propagate = False
-        
-        # Устанавливаем уровень логирования
-        root_logger.setLevel(logging.INFO)
 
     def cleanup_logging(self):
         """Очистка логгеров"""
         try:
-            # Получаем корневой логгер
-            root_logger = logging.getLogger()
-            
-            # Удаляем все хендлеры
-            for handler in root_logger.handlers[:]:
-                try:
-                    handler.close()
-                    root_logger.removeHandler(handler)
-                except Exception as e:
-                    logger.error(f"Error removing handler: {str(e)}")
+            # Отключаем только свой handler - файл и консоль продолжают писать
+            detach_handler('qt')
                     
             # Отключаем распространение логов
             logging.getLogger('proxy_manager').propagate = False
@@ -70,6 +53,8 @@ class ProxyWorker(QThread):
         """Остановка воркера"""
         try:
             self.running = False
+            if self.proxy_manager and self.proxy_manager.fleet:
+                self.proxy_manager.fleet.running = False
             self.cleanup_logging()
         except Exception as e:
             logger.error(f"Error stopping proxy worker: {str(e)}")
@@ -84,6 +69,7 @@ class ProxyWorker(QThread):
 
             # Создаем менеджер прокси с загруженной конфигурацией
             proxy_manager = ProxyManager(config)
+            self.proxy_manager = proxy_manager
 
             # Создаем и запускаем event loop
             loop = asyncio.new_event_loop()
@@ -91,9 +77,15 @@ class ProxyWorker(QThread):
             
             try:
                 # Используем корректный метод менеджера
-                loop.run_until_complete(proxy_manager.restart_all_proxies())
-                self.log_message.emit("INFO", "Proxy restart completed successfully")
-                self.task_completed.emit(True)
+                results = loop.run_until_complete(proxy_manager.restart_all_proxies())
+                self.result_matrix.emit({device_id: result.to_dict() for device_id, result in results.items()})
+                
+                failed = [device_id for device_id, result in results.items() if not result.ok]
+                if failed:
+                    self.log_message.emit("WARNING", f"Proxy restart failed on {len(failed)} devices: {', '.join(failed)}")
+                else:
+                    self.log_message.emit("INFO", "Proxy restart completed successfully")
+                self.task_completed.emit(not failed)
             except Exception as e:
                 error_msg = f"Error during proxy restart: {str(e)}"
                 self.log_message.emit("ERROR", error_msg)
@@ -101,6 +93,7 @@ class ProxyWorker(QThread):
                 self.task_completed.emit(False)
             finally:
                 loop.close()
+                self.proxy_manager = None
 
         except Exception as e:
             error_msg = f"Critical error in proxy worker thread: {str(e)}"
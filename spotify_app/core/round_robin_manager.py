@@ -4,6 +4,7 @@ import logging
 from dataclasses import dataclass
 from typing import Dict, Optional, List
 from enum import Enum
+from utils.metrics import SEARCH_LATENCY
 
 logger = logging.getLogger(__name__)
 
@@ -130,6 +131,7 @@ class RoundRobinAppleMusic:
                           results_view.child(className="android.view.ViewGroup").exists)
             
             if has_results:
+                SEARCH_LATENCY.labels('apple_music').observe(elapsed)
                 # Результаты готовы - пытаемся включить
                 success = await self._try_play_first_result(d, device_state)
                 if success:
@@ -157,8 +159,7 @@ class RoundRobinAppleMusic:
                 else:
                     # Второй таймаут тоже прошел - отдаем устройство
                     logger.warning(f"Search timeout for '{device_state.current_track}' on {device_state.device_id}")
-                    if hasattr(self.automation, 'artists_not_found'):
-                        self.automation.artists_not_found.append(device_state.current_track)
+                    self.automation.mark_not_found(device_state.current_track)
                     device_state.status = DeviceStatus.IDLE
                     device_state.current_track = None
                     self.automation.clear_search_field(d)
@@ -192,8 +193,7 @@ class RoundRobinAppleMusic:
                 
                 if wrong_nav:
                     logger.info(f'Wrong navigation for {device_state.current_track}, going back')
-                    if hasattr(self.automation, 'artists_not_found'):
-                        self.automation.artists_not_found.append(device_state.current_track)
+                    self.automation.mark_not_found(device_state.current_track)
                     d(description="Navigate up").click()
                     return False
                 
@@ -202,8 +202,7 @@ class RoundRobinAppleMusic:
                 return True
             else:
                 logger.info(f"No playable results found for '{device_state.current_track}' on {device_state.device_id}")
-                if hasattr(self.automation, 'artists_not_found'):
-                    self.automation.artists_not_found.append(device_state.current_track)
+                self.automation.mark_not_found(device_state.current_track)
                 return False
                 
         except Exception as e:
@@ -214,26 +213,21 @@ class RoundRobinAppleMusic:
         """Обновляет прогресс устройства"""
         try:
             state = self.automation.get_device_state(device_state.device_id)
-            state.songs_played += 1
-            
-            if self.automation.on_device_progress:
-                self.automation.on_device_progress(
-                    device_state.device_id, 
-                    state.songs_played, 
-                    state.total_songs
-                )
-                
-            # ВАЖНО: Периодически сохраняем кэш
-            if state.songs_played % 5 == 0:  # Каждые 5 треков
-                self.automation._periodic_cache_save()
+            # Засчитываем проигрывание; состояние пишется фоновым таймером автоматизации
+            self.automation.state_store.commit_play(state, device_state.current_track)
+            self.automation.state_store.report_progress(
+                device_state.device_id, 
+                state.songs_played, 
+                state.total_songs
+            )
                 
         except Exception as e:
             logger.error(f"Error updating progress: {str(e)}")
     
-    def _get_next_track_for_device(self, device_id: str) -> Optional[str]:
+    async def _get_next_track_for_device(self, device_id: str) -> Optional[str]:
         """Получает следующий трек для устройства"""
         try:
-            result = self.automation.get_name(device_id)
+            result = await self.automation.next_track(device_id)
             return result[0] if result else None
         except Exception as e:
             logger.error(f"Error getting next track for {device_id}: {str(e)}")
@@ -260,7 +254,7 @@ class RoundRobinAppleMusic:
                 # Обрабатываем в зависимости от статуса
                 if device_state.status == DeviceStatus.IDLE:
                     # Устройство свободно - запускаем новый поиск
-                    track = self._get_next_track_for_device(device_state.device_id)
+                    track = await self._get_next_track_for_device(device_state.device_id)
                     if track:
                         await self.start_search_on_device(device_state, track)
                     else:
@@ -0,0 +1,97 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+import logging
+from utils.config import Config
+from utils.logging_config import setup_service_logging, attach_handler, UI_LOG_FORMAT, UI_DATE_FORMAT
+from utils.progress_bus import format_progress
+from .process_supervisor import ShardSupervisor
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedWorker(QThread):
+    """
+    Рабочий поток, распределяющий устройства по config.worker_processes процессам.
+
+    Сигналы совпадают с SpotifyWorker / AppleMusicWorker, поэтому главное окно
+    подключает их к тому же виду устройств.
+    """
+    progress_updated = pyqtSignal(str, str)  # device_id, progress
+    status_updated = pyqtSignal(str)
+    task_completed = pyqtSignal(bool)
+    log_message = pyqtSignal(str, str)
+
+    def __init__(self, config: Config):
+        super().__init__()
+        self.config = config
+        self.supervisor = ShardSupervisor(config, config.worker_processes, on_event=self._handle_event)
+        self.progress_bus = None  # ProgressBus главного окна
+        self.logger = setup_service_logging(config.service_type)
+        self._setup_logging()
+
+    @property
+    def running(self) -> bool:
+        return self.supervisor.running
+
+    def _setup_logging(self):
+        """Настройка перехвата логов (сообщения шардов приходят через логгер супервизора)"""
+        class QtHandler(logging.Handler):
+            def __init__(self, signal):
+                super().__init__()
+                self.signal = signal
+                self.setFormatter(logging.Formatter(UI_LOG_FORMAT, datefmt=UI_DATE_FORMAT))
+
+            def emit(self, record):
+                msg = self.format(record)
+                self.signal.emit(record.levelname, msg)
+
+        attach_handler(QtHandler(self.log_message), 'qt')
+
+    def _emit_progress(self, device: str, played: int, total: int, service: str):
+        if self.progress_bus:
+            self.progress_bus.publish(device, played, total)
+            return
+        self.progress_updated.emit(device, format_progress(played, total))
+
+    def _handle_event(self, kind: str, *args):
+        """События шардов (вызываются из потока супервизора)"""
+        if kind == 'progress':
+            self._emit_progress(*args)
+        elif kind == 'status':
+            self.status_updated.emit(args[0])
+        elif kind == 'completed':
+            self.task_completed.emit(args[0])
+
+    def stop(self):
+        self.log_message.emit("INFO", "Stopping shard processes...")
+        self.supervisor.stop()
+
+    def reset_statistics(self) -> bool:
+        """Статистика живет в процессах-шардах - сбрасывается только из однопроцессного режима"""
+        self.log_message.emit("WARNING", "Reset statistics is not available while shard processes are running")
+        return False
+
+    def run(self):
+        try:
+            self.log_message.emit("INFO", f"Starting {self.supervisor.processes} worker processes...")
+            self.supervisor.run()
+        except Exception as e:
+            self.log_message.emit("ERROR", f"Critical error in sharded worker: {str(e)}")
+            self.task_completed.emit(False)
+
+
+class ShardedMixWorker(ShardedWorker):
+    """Mix-режим в нескольких процессах; сигналы совпадают с MixWorker"""
+    progress_updated = pyqtSignal(str, str, str)  # device_id, progress, service_type
+    service_switched = pyqtSignal(str, str)  # device_id, new_service
+
+    def _emit_progress(self, device: str, played: int, total: int, service: str):
+        if self.progress_bus:
+            self.progress_bus.publish(device, played, total, service)
+            return
+        self.progress_updated.emit(device, format_progress(played, total), service)
+
+    def _handle_event(self, kind: str, *args):
+        if kind == 'service':
+            self.service_switched.emit(*args)
+        else:
+            super()._handle_event(kind, *args)
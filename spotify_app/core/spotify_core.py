@@ -1,118 +1,41 @@
-import random
 import time
 import uiautomator2 as u2
-import telebot
-import pyautogui as pg
 import json
 from datetime import datetime
 import os
-import socket
 import re
-from typing import List, Dict, Optional, Tuple, Set
-from dataclasses import dataclass, field
-from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
 import asyncio
 import logging
 from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
 from spotify_app.utils.config import Config
+from utils.logging_config import set_log_device, run_in_executor
+from utils.metrics import SEARCH_LATENCY, ANR_HITS, DEVICE_RECONNECTS
+from utils.loop_watchdog import watch_event_loop
+from .app_lifecycle import (AppLifecycle, LifecycleScript, launch_app_script,
+                            SPOTIFY_PACKAGE, SURFBOARD_PACKAGE)
+from .automation_base import BaseAutomation, DeviceState
+from .track_catalog import TrackCatalog
 
 logger = logging.getLogger(__name__)
 
-@dataclass
-class DeviceState:
-    """Состояние устройства"""
-    device_id: str = ""  # Добавляем идентификатор устройства
-    played_songs: Set[str] = field(default_factory=set)
-    lock: Lock = field(default_factory=Lock)
-    current_file: int = 1
-    total_songs: int = 0
-    songs_played: int = 0
-    track_plays: Dict[str, int] = field(default_factory=dict)
-    config: Optional[Config] = None
+class SpotifyAutomation(BaseAutomation):
+    """Драйвер Spotify поверх общего ядра автоматизации"""
 
-    def __post_init__(self):
-        self._load_track_plays()
-    
-    def _load_track_plays(self):
-        """Загрузка истории проигрываний для конкретного устройства"""
-        try:
-            # Проверяем наличие конфигурации
-            if not self.config:
-                # Используем значение по умолчанию или создаем временную конфигурацию
-                self.config = Config()  # Или другое значение по умолчанию
-                # Можно также залогировать это событие
-                logger.warning(f"No config for device {self.device_id}, using default")
-                
-            # Определяем сервис
-            service_type = getattr(self.config, 'service_type', 'spotify')  # Значение по умолчанию
-            
-            # Убеждаемся, что директория существует
-            os.makedirs('data', exist_ok=True)
-            
-            # Определяем путь к файлу кэша
-            cache_file = f'data/{service_type}_track_plays.json'
-            
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    all_devices_data = json.load(f)
-                    self.track_plays = all_devices_data.get(self.device_id, {})
-                    logger.debug(f"Loaded track plays for {self.device_id}: {len(self.track_plays)} tracks")
-            else:
-                self.track_plays = {}
-                logger.info(f"No track plays file found for {self.device_id}, starting fresh")
-        except Exception as e:
-            logger.error(f"Error loading track plays for device {self.device_id}: {str(e)}")
-            self.track_plays = {}
-    
-    def _save_track_plays(self):
-        """Сохранение истории проигрываний для конкретного устройства"""
-        try:
-            os.makedirs('data', exist_ok=True)
-            cache_file = 'data/spotify_track_plays.json'  # или apple_track_plays.json
-            
-            # Загружаем текущий файл со всеми устройствами
-            all_devices_data = {}
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r') as f:
-                    all_devices_data = json.load(f)
-            
-            # Обновляем данные для текущего устройства
-            all_devices_data[self.device_id] = self.track_plays
-            
-            # Сохраняем обновленные данные
-            temp_file = f"{cache_file}.tmp"
-            with open(temp_file, 'w') as f:
-                json.dump(all_devices_data, f, indent=4)
-            os.replace(temp_file, cache_file)
-            
-        except Exception as e:
-            logger.error(f"Error saving track plays for device {self.device_id}: {str(e)}")
-
-    def can_play_track(self, track: str) -> bool:
-        """Проверка возможности проигрывания трека для конкретного устройства"""
-        if not self.config:
-            return True
-        current_plays = self.track_plays.get(track, 0)
-        can_play = current_plays < self.config.max_plays_per_track
-        if not can_play:
-            logger.debug(f"Device {self.device_id}: Track '{track}' reached max plays ({current_plays}/{self.config.max_plays_per_track})")
-        return can_play
+    SERVICE_TYPE = Config.SERVICE_SPOTIFY
+    SERVICE_NAME = "Spotify"
+    STATE_KEY = "spotify"
+    ERROR_LOG = "data/logs/errors_spotify.log"
+    NOTIFY_DEVICE_EXHAUSTED = True
 
-class SpotifyAutomation:
-    def __init__(self, config: Config):
-        self.config = config
-        self.bot = telebot.TeleBot(config.token)
-        self.device_states = {}
-        self.state_lock = Lock()
-        self.devicelist = []
-        self.on_device_progress = None
-        self.on_status_update = None
-        self.running = True  # Добавляем флаг для контроля выполнения
+    def __init__(self, config: Config, catalog: Optional[TrackCatalog] = None):
+        super().__init__(config, catalog)
+        self.lifecycle = AppLifecycle()  # Пакетные сценарии запуска/остановки приложений
          # Добавляем инициализацию устройств сразу
         self.initialize_devices()
         self._load_cache()  # Загружаем кэш после инициализации устройств
-        self.tracks_not_found = []  # Новое поле
+        self.state_store.start()
+        self.tracks_not_found = self.state_store.quarantine  # Сохраняется в контрольной точке
 
     # И новый метод для сохранения информации:
     def save_tracks_not_found(self):
@@ -126,8 +49,10 @@ class SpotifyAutomation:
         try:
             logger.info("Stopping Spotify automation...")
             self.running = False
+            self.proxy_monitor.running = False
             
             # Сохраняем текущее состояние
+            self.state_store.stop()
             self._save_cache()
             
             # Отправляем уведомление о ручной остановке
@@ -145,7 +70,7 @@ class SpotifyAutomation:
                 self.bot.send_message(self.config.chat_id, message)
                 
                 # Отправляем текущий файл статистики
-                stats_file = f"data/{self.config.service_type}_track_plays.json"
+                stats_file = self.state_store.plays_file
                 if os.path.exists(stats_file):
                     with open(stats_file, 'rb') as stats:
                         self.bot.send_document(
@@ -174,262 +99,8 @@ class SpotifyAutomation:
             logger.error(f"Error during stop process: {str(e)}")
             logger.exception("Full error details:")
 
-    def get_device_state(self, device: str) -> DeviceState:
-        with self.state_lock:
-            if device not in self.device_states:
-                state = DeviceState(device_id=device)  # Передаем идентификатор устройства
-                state.config = self.config
-                self.device_states[device] = state
-            return self.device_states[device]
-
-    def _load_cache(self):
-        """Загрузка состояния из кэша"""
-        try:
-            cache_file = "data/spotify_cache.json"
-            if os.path.exists(cache_file):
-                with open(cache_file, "r") as f:
-                    cached_data = json.load(f)
-                    for device, songs in cached_data.items():
-                        state = self.get_device_state(device)
-                        state.played_songs.update(songs.get("lines", []))
-                        state.current_file = songs.get("count", 1)
-                        state.songs_played = songs.get("songs_played", 0)
-                        state.total_songs = songs.get("total_songs", 0)
-                        
-                        # Добавляем лог для отладки
-                        logger.info(f"Loaded cache for device {device}: {state.songs_played}/{state.total_songs}")
-                        
-                        # Если установлен callback для прогресса, вызываем его
-                        if self.on_device_progress:
-                            self.on_device_progress(device, state.songs_played, state.total_songs)
-                            
-                logger.info(f"Cache loaded successfully from {cache_file}")
-            else:
-                logger.info("No cache file found, starting fresh")
-        except Exception as e:
-            logger.error(f"Error loading cache: {str(e)}")
-
-
-    def _save_cache(self, is_except: bool = False):
-        """Сохранение кэша"""
-        try:
-            os.makedirs('data', exist_ok=True)
-            filename = "data/spotify_cache_except.json" if is_except else "data/spotify_cache.json"
-            cache_data = {}
-            
-            for device, state in self.device_states.items():
-                cache_data[device] = {
-                    "lines": list(state.played_songs),
-                    "count": state.current_file,
-                    "songs_played": state.songs_played,
-                    "total_songs": state.total_songs
-                }
-            
-            # Сохраняем через временный файл
-            temp_file = f"{filename}.tmp"
-            with open(temp_file, "w") as f:
-                json.dump(cache_data, f, indent=4)
-            os.replace(temp_file, filename)
-            
-            logger.info(f"Cache saved successfully to {filename}")
-        except Exception as e:
-            logger.error(f"Error saving cache: {str(e)}")
-
-    @contextmanager
-    def error_handling(self, device, screenshot: bool = True):
-        """Контекстный менеджер для обработки ошибок"""
-        try:
-            yield
-        except Exception as e:
-            if 'JsonRpcError' in str(type(e)):
-                self._handle_error("JsonRpcError", device, screenshot)
-        except u2.exceptions.XPathElementNotFoundError as xe:
-            self._handle_error("XPathElementNotFoundError", xe, device, screenshot)
-        except u2.exceptions.UiAutomationNotConnectedError as ue:
-            self._handle_error("UiAutomationNotConnectedError", ue, device, screenshot)
-        except Exception as ex:
-            self._handle_error("GeneralException", ex, device, screenshot)
-
-    def _handle_error(self, error_type: str, error: Exception, device, screenshot: bool):
-        """Централизованная обработка ошибок"""
-        logger.error(f"{error_type}: {str(error)}")
-        self._save_error_log(error_type, error)
-        self.process_exception(device, screenshot)
-
-    def process_exception(self, device_addr: str, screenshot: bool = True):
-        """Обработка исключений"""
-        self._save_cache(is_except=True)
-        logger.info('RESTART SPOTIFY')
-        try:
-            d = u2.connect(device_addr)
-            self.restart_spotify(d)
-            if screenshot:
-                screenshot_path = os.path.join('data', 'screenshots', f'error_{datetime.now().strftime("%Y%m%d_%H%M%S")}.png')
-                os.makedirs(os.path.dirname(screenshot_path), exist_ok=True)
-                pg.screenshot(screenshot_path)
-                with open(screenshot_path, 'rb') as img:    
-                    self.bot.send_photo(self.config.chat_id, img, caption='Server Spotify Except')
-        except Exception as e:
-            logger.error(f"Failed to process exception for device {device_addr}: {str(e)}")
-            logger.exception("Full error details:")
-
-    def _save_error_log(self, error_type: str, error: Exception):
-        """Сохранение ошибок в лог"""
-        os.makedirs('data/logs', exist_ok=True)
-        with open("data/logs/errors_spotify.log", "a") as error_file:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            error_file.write(f"[{timestamp}] {error_type}: {str(error)}\n")
-
-    def check_ports(self) -> List[int]:
-        """Проверка открытых портов"""
-        open_ports = []
-        for port in range(self.config.start_port, self.config.end_port, self.config.port_step):
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(1)
-                if s.connect_ex((self.config.bluestacks_ip, port)) == 0:
-                    open_ports.append(port)
-        return open_ports
-
-    def initialize_devices(self):
-        """Инициализация списка устройств"""
-        if self.config.use_adb_device_detection:
-            # Используем ADB для получения серийных номеров устройств
-            from utils.adb_chek import ADBChecker
-            adb_checker = ADBChecker()
-            
-            if not adb_checker.initialize_environment():
-                logger.error("Failed to initialize ADB environment")
-                # Fallback на метод портов
-                self._initialize_devices_by_ports()
-                return
-                
-            device_ids = adb_checker.get_connected_devices()
-            if device_ids:
-                logger.info(f"Found {len(device_ids)} devices via ADB: {device_ids}")
-                self.devicelist = device_ids
-            else:
-                logger.warning("No devices found via ADB, falling back to IP:port method")
-                self._initialize_devices_by_ports()
-        else:
-            # Используем традиционный метод IP:порт
-            self._initialize_devices_by_ports()
-
-    def _initialize_devices_by_ports(self):
-        """Инициализация устройств по портам (исходный метод)"""
-        open_ports = self.check_ports()
-        if open_ports:
-            logger.info(f"Открытые порты на {self.config.bluestacks_ip}: {open_ports}")
-            self.devicelist = [f'{self.config.bluestacks_ip}:{port}' for port in open_ports]
-        else:
-            logger.warning(f"Нет открытых портов на {self.config.bluestacks_ip}")
-
-    def split_database(self, file_path: str):
-        """Разделение базы данных на части"""
-        logger.info(f"Splitting database from {file_path}")
-        os.makedirs('data', exist_ok=True)
-        small_file_number = 1
-        try:
-            with open(file_path, 'r') as big_file:
-                small_file = None
-                for lineno, line in enumerate(big_file):
-                    if lineno % self.config.lines_per_file == 0:
-                        if small_file:
-                            small_file.close()
-                        small_file_name = f"data/database_part_spotify_{small_file_number}.txt"
-                        small_file = open(small_file_name, 'w')
-                        small_file_number += 1
-                        logger.debug(f"Created new database part: {small_file_name}")
-                    small_file.write(line)
-                if small_file:
-                    small_file.close()
-            logger.info(f"Database split completed. Created {small_file_number-1} parts")
-        except Exception as e:
-            logger.error(f"Error splitting database: {str(e)}")
-            raise
-
-    def reset_play_statistics(self):
-        """Сброс статистики прослушиваний"""
-        try:
-            # Очищаем статистику для всех устройств
-            for device, state in self.device_states.items():
-                state.track_plays.clear()
-                state._save_track_plays()
-                
-            # Очищаем файлы статистики
-            stats_files = {
-                'spotify': 'data/spotify_track_plays.json'
-            }
-            
-            service_type = self.config.service_type
-            stats_file = stats_files.get(service_type)
-            
-            if stats_file and os.path.exists(stats_file):
-                # Сохраняем пустой словарь в файл
-                with open(stats_file, 'w') as f:
-                    json.dump({}, f)
-                
-                logger.info(f"Play statistics reset for {service_type}")
-                return True
-        except Exception as e:
-            logger.error(f"Error resetting play statistics: {str(e)}")
-            return False
-
-    def get_name(self, device: str) -> Optional[List[str]]:
-        state = self.get_device_state(device)
-        
-        with state.lock:
-            # Проверяем есть ли еще треки, которые можно проиграть
-            total_available = 0
-            prefix = "spotify"  # Для Spotify не нужна проверка, всегда используем spotify
-            for i in range(1, 1000):
-                file_path = f"data/database_part_{prefix}_{i}.txt"
-                if not os.path.exists(file_path):
-                    break
-                
-                with open(file_path) as f:
-                    for line in f:
-                        track = line.strip()
-                        if track and state.can_play_track(track):
-                            total_available += 1
-            
-            if total_available == 0:
-                logger.info(f"Device {device} has no more tracks available due to play limits")
-                self.bot.send_message(
-                    self.config.chat_id, 
-                    f"Device {device} has completed playing all available tracks (reached max plays limit)"
-                )
-                return None
-                
-            # Стандартный поиск подходящего трека
-            prefix = "spotify"
-            while True:
-                file_path = f"data/database_part_{prefix}_{state.current_file}.txt"
-                if not os.path.exists(file_path):
-                    if state.current_file == 1 and state.songs_played > 0:
-                        logger.info(f"Device {device} has played all songs in this cycle")
-                        return None
-                    state.current_file = 1
-                    state.played_songs.clear()
-                    continue
-                
-                with open(file_path) as f:
-                    available_songs = []
-                    for line in f:
-                        track = line.strip()
-                        if (track and 
-                            track not in state.played_songs and 
-                            state.can_play_track(track)):
-                            available_songs.append(track)
-                
-                if not available_songs:
-                    state.current_file += 1
-                    continue
-                    
-                song = random.choice(available_songs)
-                state.played_songs.add(song)
-                state.track_plays[song] = state.track_plays.get(song, 0) + 1
-                state._save_track_plays()
-                return [song]
+    def restart_app(self, d) -> bool:
+        return self.restart_spotify(d)
 
     def restart_spotify(self, d):
         """Перезапуск Spotify с минимальным вмешательством"""
@@ -438,10 +109,10 @@ class SpotifyAutomation:
             current_app = d.app_current()
             logger.debug(f"Current app: {current_app}")
             
-            if current_app["package"] != "com.spotify.music":
+            if current_app["package"] != SPOTIFY_PACKAGE:
                 logger.info("Spotify not in foreground, starting app")
-                d.app_start("com.spotify.music", ".MainActivity")
-                time.sleep(5)
+                # Запуск и ожидание resumed activity одной shell сессией
+                self.lifecycle.run_sync(d, launch_app_script(SPOTIFY_PACKAGE, ".MainActivity"))
             
             # Переходим на домашний экран приложения
             time.sleep(2)
@@ -461,8 +132,7 @@ class SpotifyAutomation:
             
             if not search.exists:
                 logger.warning("Search tab not found, attempting to restart app")
-                d.app_start("com.spotify.music", ".MainActivity")
-                time.sleep(5)
+                self.lifecycle.run_sync(d, launch_app_script(SPOTIFY_PACKAGE, ".MainActivity"))
                 search = d(resourceId="com.spotify.music:id/search_tab")
             
             search.click()
@@ -484,15 +154,14 @@ class SpotifyAutomation:
         try:
             logger.info(f"Performing full proxy restart for {device_addr}")
             
-            # Останавливаем все связанные приложения
-            apps_to_stop = ['com.getsurfboard', 'com.spotify.music']
-            for app in apps_to_stop:
-                device.app_stop(app)
-                await asyncio.sleep(1)
-            
-            # Запускаем Surfboard
-            device.app_start('com.getsurfboard')
-            await asyncio.sleep(3)
+            # Останавливаем связанные приложения и запускаем Surfboard одной shell сессией
+            script = LifecycleScript(
+                stop_packages=[SURFBOARD_PACKAGE, SPOTIFY_PACKAGE],
+                launch_package=SURFBOARD_PACKAGE
+            )
+            result = await self.lifecycle.run(device, script, device_addr)
+            if not result.success:
+                logger.warning(f"Surfboard did not report ready on {device_addr}, checking VPN anyway")
             
             # Пытаемся активировать VPN
             if not await self.check_proxy(device, device_addr):
@@ -500,8 +169,7 @@ class SpotifyAutomation:
                 return False
                 
             # Запускаем основное приложение
-            device.app_start('com.spotify.music')
-            await asyncio.sleep(3)
+            await self.lifecycle.run(device, launch_app_script(SPOTIFY_PACKAGE), device_addr)
             
             return True
             
@@ -511,63 +179,61 @@ class SpotifyAutomation:
 
     async def process_device(self, device: str):
         """Обработка одного устройства"""
+        set_log_device(device)
         state = self.get_device_state(device)
         logger.info(f"Starting device {device} processing. Total songs: {state.total_songs}")
         
-        last_proxy_check = time.time()
-        proxy_check_interval = 3600  # 1 час
-        
         while state.songs_played < state.total_songs and self.running:
-            # Проверка прокси
-            current_time = time.time()
-            if current_time - last_proxy_check >= proxy_check_interval:
-                try:
-                    d = u2.connect(device)
-                    proxy_status = await self.check_proxy(d, device)
-                    if not proxy_status:
-                        logger.warning(f"Proxy check failed on {device}, attempting full restart")
-                        if not await self.restart_proxy_full(d, device):
-                            logger.error(f"Failed to restore proxy functionality on {device}")
-                    last_proxy_check = current_time
-                except Exception as e:
-                    logger.error(f"Error during proxy check: {str(e)}")
-            
-            # Получение трека
-            retries = self.config.retry_attempts
-            while retries > 0 and self.running:
-                try:
-                    d = u2.connect(device)
-                    result = self.get_name(device)
-                    if not result:
-                        logger.info(f"No more available tracks for device {device}")
-                        return  # Завершаем устройство, если нет треков
-                    
-                    name_artist = result[0]
-                    logger.info(f"Device {device}: Playing song {name_artist}")
-                    await self.search_and_play(d, name_artist)
-                    state.songs_played += 1
-                    
-                    if self.on_device_progress:
-                        self.on_device_progress(device, state.songs_played, state.total_songs)
-                    
-                    if state.songs_played % 10 == 0:
-                        self._periodic_cache_save()
-                    
-                    logger.info(f"Device {device} progress: {state.songs_played}/{state.total_songs}")
-                    break  # Успешно проиграли, выходим из retries
-                
-                except Exception as e:
-                    logger.error(f"Error on device {device}, attempt {self.config.retry_attempts - retries + 1}: {str(e)}")
-                    retries -= 1
-                    if retries == 0:
-                        self._handle_error("MaxRetriesExceeded", e, device, True)
-                    await asyncio.sleep(5)
+            # Устройство с открытым предохранителем ждет успешной проверки
+            if not await self.wait_device_available(device):
+                return
+            # Прокси проверяет фоновый монитор; здесь только ждем, если он перезапускает прокси
+            async with self.proxy_monitor.track_guard(device):
+                if not await self._process_next_track(device, state):
+                    return
             
             if not self.running:
                 return
             
             await asyncio.sleep(2)
 
+    async def _process_next_track(self, device: str, state: DeviceState) -> bool:
+        """Проигрывание следующего трека на устройстве. Возвращает False, если треков больше нет"""
+        # Получение трека
+        retries = self.config.retry_attempts
+        while retries > 0 and self.running:
+            name_artist = None
+            try:
+                d = u2.connect(device)
+                result = await self.next_track(device)
+                if not result:
+                    logger.info(f"No more available tracks for device {device}")
+                    return False  # Завершаем устройство, если нет треков
+                
+                name_artist = result[0]
+                logger.info(f"Device {device}: Playing song {name_artist}")
+                await self.search_and_play(d, name_artist)
+                self.state_store.commit_play(state, name_artist)
+                self.breakers.record_success(device)
+                
+                # Запись на диск - фоновым таймером, UI - сразу
+                self.state_store.report_progress(device, state.songs_played, state.total_songs)
+                
+                logger.info(f"Device {device} progress: {state.songs_played}/{state.total_songs}")
+                break  # Успешно проиграли, выходим из retries
+            
+            except Exception as e:
+                logger.error(f"Error on device {device}, attempt {self.config.retry_attempts - retries + 1}: {str(e)}")
+                if name_artist:
+                    self.state_store.release(device, name_artist)
+                retries -= 1
+                if retries == 0:
+                    self._handle_error("MaxRetriesExceeded", e, device, True)
+                else:
+                    DEVICE_RECONNECTS.labels(device).inc()  # Следующая попытка подключается заново
+                await asyncio.sleep(5)
+        return True
+
     def _handle_app_not_responding(self, d):
         """Обработка диалога о неотвечающем приложении"""
         try:
@@ -587,6 +253,7 @@ class SpotifyAutomation:
                     close_button = d(text="Close app")
                     if close_button.exists:
                         close_button.click()
+                        ANR_HITS.labels(self.STATE_KEY).inc()
                         time.sleep(2)
                         return True
                         
@@ -649,13 +316,15 @@ class SpotifyAutomation:
         d(resourceId="com.spotify.music:id/query").click()
         time.sleep(1)
         d.send_keys(name_artist)
+        search_started = time.time()
         
         # Получаем имя артиста для поиска
         artist_name = name_artist.split()[-1]
         search_text = f"Song • {artist_name}"
         
         # Ожидание загрузки результатов поиска
-        await self.wait_for_search_results(d, timeout=15)
+        if await self.wait_for_search_results(d, timeout=15):
+            SEARCH_LATENCY.labels(self.STATE_KEY).observe(time.time() - search_started)
         
         # Ищем конкретный трек с именем артиста
         song_element = d(textMatches=f"Song • .*{re.escape(artist_name)}.*")
@@ -668,7 +337,7 @@ class SpotifyAutomation:
                 first_song.click()
             else:
                 # Если результаты не найдены вообще
-                self.tracks_not_found.append(name_artist)
+                self.mark_not_found(name_artist)
                 d(resourceId="com.spotify.music:id/clear_query_button").click()
                 return
 
@@ -688,12 +357,13 @@ class SpotifyAutomation:
         # Проверяем, есть ли еще доступные треки для воспроизведения
         total_available_tracks = 0
         tracks_checked = set()  # Отслеживаем треки, которые мы уже проверили
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)  # Не форматируем отладку на каждую пару трек/устройство
         prefix = "spotify"  # Для Spotify не нужна проверка, всегда используем spotify
 
         for i in range(1, 1000):
             # Проверяем файл
             file_path = f"data/database_part_{prefix}_{i}.txt"
-            logger.debug(f"Checking file: {file_path}, exists: {os.path.exists(file_path)}")
+            logger.debug("Checking file: %s", file_path)
             
             if not os.path.exists(file_path):
                 break
@@ -711,8 +381,10 @@ class SpotifyAutomation:
                         state = self.get_device_state(device)
                         # Проверяем и выводим информацию для отладки
                         can_play = state.can_play_track(track)
-                        current_plays = state.track_plays.get(track, 0)
-                        logger.debug(f"Track: {track}, Device: {device}, CanPlay: {can_play}, CurrentPlays: {current_plays}, MaxPlays: {state.config.max_plays_per_track}")
+                        if debug_enabled:
+                            logger.debug("Track: %s, Device: %s, CanPlay: %s, CurrentPlays: %s, MaxPlays: %s",
+                                         track, device, can_play, state.track_plays.get(track, 0),
+                                         state.config.max_plays_per_track)
                         
                         if can_play:
                             total_available_tracks += 1
@@ -727,10 +399,15 @@ class SpotifyAutomation:
         logger.info(f"Found {total_available_tracks} tracks available for playing within limits")
         
         tasks = [self.process_device(device) for device in self.devicelist]
+        self.proxy_monitor.start(self.devicelist)
+        lag_task = asyncio.create_task(watch_event_loop(self.STATE_KEY, self.config))
         try:
             await asyncio.gather(*tasks)
         except asyncio.CancelledError:
             logger.info("Tasks cancelled")
+        finally:
+            lag_task.cancel()
+            await self.proxy_monitor.stop()
         
         # Проверяем результаты только если не было принудительной остановки
         if self.running:
@@ -764,20 +441,6 @@ class SpotifyAutomation:
             else:
                 logger.warning("Not all devices completed their playback")
 
-    def _periodic_cache_save(self):
-        """Периодическое сохранение кэша и статистики проигрываний"""
-        try:
-            self._save_cache()
-            # Сохраняем статистику для каждого устройства
-            for device, state in self.device_states.items():
-                state._save_track_plays()
-                # Обновляем UI через callback если он установлен
-                if self.on_device_progress:
-                    self.on_device_progress(device, state.songs_played, state.total_songs)
-                    logger.debug(f"Updated UI progress for device {device}: {state.songs_played}/{state.total_songs}")
-        except Exception as e:
-            logger.error(f"Error in periodic cache save: {str(e)}")
-
     async def finish_play(self):
         try:
             logger.info('Finishing playback')
@@ -816,14 +479,8 @@ class SpotifyAutomation:
                 state.songs_played = 0      # Сбрасываем счетчик
                 # НЕ очищаем track_plays - там хранится статистика для лимитов!
             
-            # Очищаем кэш
-            os.makedirs('data', exist_ok=True)
-            cache_file = f"data/{self.config.service_type}_cache.json"
-            with open(cache_file, 'w') as f:
-                json.dump({}, f)
-                
-            # Принудительно перезагружаем состояние
-            self._load_cache()
+            # Перезаписываем контрольные точки чистым состоянием цикла
+            self.state_store.reset_cycle()
             
             logger.info('State reset for new cycle')
             return True
@@ -838,7 +495,17 @@ class SpotifyAutomation:
         return current_app["package"] == package_name if current_app else False
     
     async def check_proxy(self, device: u2.Device, device_addr: str) -> bool:
-        """Проверка состояния прокси и его активация при необходимости"""
+        """
+        Проверка состояния прокси и его активация при необходимости.
+
+        Все RPC uiautomator2 (app_start, поиск и нажатие кнопок) блокирующие,
+        поэтому проверка идет в пуле потоков монитора прокси, а не в event loop.
+        """
+        return await run_in_executor(self.proxy_monitor.executor, self.check_proxy_sync, device, device_addr)
+
+    def check_proxy_sync(self, device: u2.Device, device_addr: str) -> bool:
+        """Проверка и активация VPN в Surfboard (блокирующий вызов)"""
+        current_app = None
         try:
             logger.info(f"Checking proxy status for device {device_addr}")
             
@@ -847,7 +514,7 @@ class SpotifyAutomation:
             
             # Запускаем Surfboard
             device.app_start('com.getsurfboard')
-            await asyncio.sleep(3)  # Даем больше времени на загрузку
+            time.sleep(3)  # Даем больше времени на загрузку
             
             retry_attempts = 3
             result = False
@@ -861,7 +528,7 @@ class SpotifyAutomation:
                 elif device(description="Start VPN").exists:
                     logger.info(f"Starting VPN on {device_addr}")
                     device(description="Start VPN").click()
-                    await asyncio.sleep(3)  # Ждем подключения
+                    time.sleep(3)  # Ждем подключения
                     
                     # Проверяем успешность подключения
                     if device(description="Stop VPN").exists:
@@ -876,9 +543,9 @@ class SpotifyAutomation:
                     logger.error(f"VPN buttons not found on {device_addr}")
                     # Пробуем перезапустить приложение
                     device.app_stop('com.getsurfboard')
-                    await asyncio.sleep(1)
+                    time.sleep(1)
                     device.app_start('com.getsurfboard')
-                    await asyncio.sleep(3)
+                    time.sleep(3)
                     retry_attempts -= 1
                     
                 if retry_attempts == 0:
@@ -887,7 +554,7 @@ class SpotifyAutomation:
             # Возвращаемся к предыдущему приложению
             if current_app:
                 device.app_start(current_app["package"])
-                await asyncio.sleep(2)
+                time.sleep(2)
                 
             return result
                 
@@ -901,69 +568,15 @@ class SpotifyAutomation:
                     pass
             return False
 
-    def check_play_limits_reached(self) -> bool:
-        """Проверка достижения лимитов проигрывания для каждого устройства"""
-        try:
-            stats_file = f"data/{self.config.service_type}_track_plays.json"
-            if not os.path.exists(stats_file):
-                return False
-                
-            with open(stats_file, 'r') as f:
-                all_devices_data = json.load(f)
-                
-            if not all_devices_data:
-                return False
-
-            total_tracks = 0
-            max_plays_reached = 0
-            
-            for device_id, device_data in all_devices_data.items():
-                if not isinstance(device_data, dict):
-                    continue
-                    
-                for track, plays in device_data.items():
-                    total_tracks += 1
-                    if plays >= self.config.max_plays_per_track:
-                        max_plays_reached += 1
-                        
-            if total_tracks > 0 and max_plays_reached == total_tracks:
-                logger.info(f"All tracks ({total_tracks}) have reached maximum plays limit ({self.config.max_plays_per_track})")
-                message = (
-                    f"🎵 Достигнут лимит прослушиваний!\n\n"
-                    f"Все треки ({total_tracks}) были проиграны максимальное количество раз "
-                    f"({self.config.max_plays_per_track}).\n"
-                    f"Автоматизация завершена."
-                )
-                self.bot.send_message(self.config.chat_id, message)
-                
-                with open(stats_file, 'rb') as stats:
-                    self.bot.send_document(
-                        self.config.chat_id, 
-                        stats,
-                        caption="📊 Финальная статистика прослушиваний"
-                    )
-                return True
-                
-            return False
-                
-        except Exception as e:
-            logger.error(f"Error checking play limits: {str(e)}")
-            return False
-        
     async def _send_completion_report(self):
         """Отправка отчета о завершении"""
         try:
-            # Создаем скриншот
-            screenshot_path = os.path.join('data', 'screenshots', f'completion_{datetime.now().strftime("%Y%m%d_%H%M%S")}.png')
-            os.makedirs(os.path.dirname(screenshot_path), exist_ok=True)
-            pg.screenshot(screenshot_path)
-            
-            # Отправляем скриншот
-            with open(screenshot_path, 'rb') as img:
-                self.bot.send_photo(self.config.chat_id, img, caption='Server Spotify Good')
+            # Сводный скриншот устройств собирается в фоне
+            self.screenshots.capture_sheet(self.devicelist, 'completion', caption='Server Spotify Good',
+                                           send=self._send_photo)
             
             # Отправляем файл кэша
-            with open('data/spotify_cache.json', 'rb') as file:
+            with open(self.state_store.export_cache(), 'rb') as file:
                 self.bot.send_document(self.config.chat_id, file)
                 
             # Сохраняем и отправляем список ненайденных треков
@@ -1004,6 +617,7 @@ class SpotifyAutomation:
             for device in self.devicelist:
                 state = self.get_device_state(device)
                 state.total_songs = total_songs
+            self.state_store.mark_all_dirty(self.devicelist)
 
             logger.info(f"Starting automation with {len(self.devicelist)} devices and {total_songs} songs")
             
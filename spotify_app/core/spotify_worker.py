@@ -5,7 +5,8 @@ import os
 from typing import Optional
 import time
 from utils.config import Config
-from utils.logging_config import setup_service_logging
+from utils.logging_config import setup_service_logging, attach_handler, UI_LOG_FORMAT, UI_DATE_FORMAT
+from utils.progress_bus import format_progress
 from .spotify_core import SpotifyAutomation
 from utils.config import Config, load_config  # Добавьте load_config
 logger = logging.getLogger(__name__)
@@ -22,6 +23,7 @@ class SpotifyWorker(SignalEmitter):
         self.config = config
         self.running = False
         self.automation = None
+        self.progress_bus = None  # ProgressBus главного окна: прогресс числами, пачками раз в кадр
         self.logger = setup_service_logging('spotify')
         self._setup_logging()
 
@@ -58,8 +60,7 @@ class SpotifyWorker(SignalEmitter):
             def __init__(self, signal):
                 super().__init__()
                 self.signal = signal
-                self.setFormatter(logging.Formatter('%(asctime)s - %(message)s', 
-                                                datefmt='%Y-%m-%d %H:%M'))
+                self.setFormatter(logging.Formatter(UI_LOG_FORMAT, datefmt=UI_DATE_FORMAT))
 
             def emit(self, record):
                 msg = self.format(record)
@@ -67,19 +68,10 @@ class SpotifyWorker(SignalEmitter):
 
         # Создаем и настраиваем handler
         handler = QtHandler(self.log_message)
-        
-        # Получаем корневой логгер
-        root_logger = logging.getLogger()
-        
-        # Удаляем все существующие handlers чтобы избежать дублирования
-        for h in root_logger.handlers[:]:
-            root_logger.removeHandler(h)
-        
-        # Добавляем только один handler к корневому логгеру
-        root_logger.addHandler(handler)
-        
-        # Устанавливаем уровень логирования
-        root_logger.setLevel(logging.INFO)
+
+        # Подключаем к очереди логов: handler работает в потоке QueueListener,
+        # предыдущий handler воркера с тем же именем заменяется
+        attach_handler(handler, 'qt')
         
         # Отключаем передачу логов родительским логгерам для spotify_core
         logging.getLogger('spotify_core').propagate = False
@@ -199,11 +191,11 @@ class SpotifyWorker(SignalEmitter):
 
     def _handle_device_progress(self, device: str, current: int, total: int):
         try:
-            if total <= 0:  # Защита от деления на ноль
-                progress = f"{current}/0 (0.0%)"
-            else:
-                progress = f"{current}/{total} ({(current/total*100):.1f}%)"
-                
+            if self.progress_bus:
+                self.progress_bus.publish(device, current, total)
+                return
+
+            progress = format_progress(current, total)
             self.progress_updated.emit(device, progress)
             self.log_message.emit("INFO", f"Device {device} progress: {progress}")
         except Exception as e:
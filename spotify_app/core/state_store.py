@@ -0,0 +1,491 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.metrics import TRACKS_PLAYED
+from .event_log import record_event, STEP_PLAY
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    Инкрементальное сохранение состояния устройств.
+
+    Вместо перезаписи общего кэша со всей историей каждые несколько треков
+    хранит по одному компактному файлу на устройство в data/state/<service>/
+    и пишет только устройства, помеченные как измененные. Запись выполняется
+    фоновым таймером раз в flush_interval секунд. Общий файл статистики
+    проигрываний (data/<service>_track_plays.json) пишется только если
+    изменились счетчики.
+
+    Прогресс в UI передается только для устройств, у которых изменились цифры.
+
+    Запись устройства - атомарная контрольная точка: счетчики проигрываний,
+    набор треков цикла, курсор по файлам базы и зарезервированные (in-flight)
+    треки сохраняются одним os.replace. Каждое успешное проигрывание сразу
+    дописывается в journal.jsonl с порядковым номером; при восстановлении
+    записи журнала новее контрольной точки применяются повторно, поэтому
+    после сбоя проигрывания не теряются и не считаются дважды.
+
+    При шардировании устройств по процессам (shard) у каждого процесса свои
+    журнал, мета-файл и выгрузка кэша, загружаются только свои устройства
+    (owns), а общий файл статистики обновляется слиянием под файловой блокировкой.
+    """
+
+    RECORD_VERSION = 2
+    META_FILE = '_meta.json'
+    JOURNAL_FILE = 'journal.jsonl'
+    PLAYS_MARKER = '_checkpoint'  # Ключ в общем файле статистики: файл записан StateStore
+
+    def __init__(self, service: str, device_states: Dict[str, Any], plays_file: str,
+                 flush_interval: float = 5.0,
+                 on_progress: Optional[Callable[[str, int, int], None]] = None,
+                 catalog=None, shard: str = '',
+                 owns: Optional[Callable[[str], bool]] = None):
+        self.service = service
+        self.shard = shard
+        self.owns = owns  # Фильтр устройств этого процесса (None - все)
+        suffix = f"_{shard}" if shard else ''
+        self.meta_file = self.META_FILE.replace('.', f'{suffix}.', 1)
+        self.catalog = catalog  # TrackCatalog: снимает отметку "трек играет", засчитывает проигрывание на ферме
+        self.device_states = device_states  # Общий словарь состояний автоматизации
+        self.plays_file = plays_file
+        self.legacy_cache_file = f"data/{service}_cache{suffix}.json"
+        self.directory = os.path.join('data', 'state', service)
+        self.flush_interval = max(1.0, float(flush_interval))
+        self.on_progress = on_progress
+
+        self._dirty: Set[str] = set()
+        self._plays_dirty = False
+        self.plays_version = 0  # Растет при каждом изменении счетчиков проигрываний
+        self._reported: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.quarantine: List[str] = []  # Ненайденные треки, общий список автоматизации
+        self._quarantine_saved = 0
+        self._in_flight: Dict[str, Set[str]] = {}  # Зарезервированные, но не проигранные треки
+        self._reserved_at: Dict[Tuple[str, str], float] = {}  # Начало проигрывания для журнала событий
+        self._journal_lock = threading.Lock()
+        self._seq = 0
+        self._device_seq: Dict[str, int] = {}  # Последняя запись журнала по устройству
+        self._persisted_seq: Dict[str, int] = {}  # Номер, попавший в контрольную точку
+        self.journal_path = os.path.join(self.directory, self.JOURNAL_FILE.replace('.', f'{suffix}.', 1))
+
+    @staticmethod
+    def _file_name(device_id: str) -> str:
+        return re.sub(r'[^\w.-]', '_', device_id) + '.json'
+
+    def _record_path(self, device_id: str) -> str:
+        return os.path.join(self.directory, self._file_name(device_id))
+
+    @staticmethod
+    def _write_atomic(path: str, data: Any, indent: Optional[int] = None):
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            if indent:
+                json.dump(data, f, indent=indent, ensure_ascii=False)
+            else:
+                json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(temp_file, path)
+
+    def mark_dirty(self, device_id: str, plays: bool = False):
+        """Пометить устройство как измененное (plays=True - изменились счетчики проигрываний)"""
+        with self._lock:
+            self._dirty.add(device_id)
+            if plays:
+                self._plays_dirty = True
+                self.plays_version += 1
+
+    def record(self, state) -> Dict[str, Any]:
+        """Компактная запись состояния одного устройства (снимок под блокировкой устройства)"""
+        with state.lock:
+            return {
+                "v": self.RECORD_VERSION,
+                "device": state.device_id,
+                "seq": self._device_seq.get(state.device_id, 0),
+                "lines": list(state.played_songs),
+                "count": state.current_file,
+                "songs_played": state.songs_played,
+                "total_songs": state.total_songs,
+                "plays": dict(state.track_plays),
+                "in_flight": sorted(self._in_flight.get(state.device_id, ()))
+            }
+
+    def reserve(self, device_id: str, track: str):
+        """
+        Резервирование трека перед проигрыванием.
+
+        Вызывается под блокировкой устройства (из get_name). Счетчик не
+        увеличивается до commit_play; после сбоя резерв снимается.
+        """
+        with self._lock:
+            self._in_flight.setdefault(device_id, set()).add(track)
+            self._reserved_at[(device_id, track)] = time.time()
+            self._dirty.add(device_id)
+
+    def release(self, device_id: str, track: str):
+        """Снятие резерва без засчитывания проигрывания (трек остается пропущенным в цикле)"""
+        with self._lock:
+            self._in_flight.get(device_id, set()).discard(track)
+            self._dirty.add(device_id)
+            started = self._reserved_at.pop((device_id, track), None)
+        if self.catalog:
+            self.catalog.release(device_id, self.service, track)
+        record_event(device_id, self.service, STEP_PLAY, 'failed', track=track,
+                     latency=time.time() - started if started else None)
+
+    def commit_play(self, state, track: str) -> int:
+        """
+        Засчитывание успешного проигрывания: счетчики и журнал меняются вместе.
+
+        Returns:
+            int: новое значение songs_played
+        """
+        with state.lock:
+            state.track_plays[track] = state.track_plays.get(track, 0) + 1
+            state.songs_played += 1
+            state.played_songs.add(track)
+            self._append_journal(state.device_id, track)
+            songs_played = state.songs_played
+        if self.catalog:
+            self.catalog.commit(state.device_id, self.service, track)
+        with self._lock:
+            self._in_flight.get(state.device_id, set()).discard(track)
+            self._dirty.add(state.device_id)
+            self._plays_dirty = True
+            self.plays_version += 1
+            started = self._reserved_at.pop((state.device_id, track), None)
+        TRACKS_PLAYED.labels(state.device_id, self.service).inc()
+        record_event(state.device_id, self.service, STEP_PLAY, 'ok', track=track,
+                     latency=time.time() - started if started else None)
+        return songs_played
+
+    def _append_journal(self, device_id: str, track: str):
+        """Дописывает проигрывание в журнал (с fsync - запись переживает падение процесса)"""
+        with self._journal_lock:
+            self._seq += 1
+            entry = {"seq": self._seq, "device": device_id, "track": track}
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, separators=(',', ':'), ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                logger.error(f"Error writing play journal: {str(e)}")
+            self._device_seq[device_id] = self._seq
+
+    def _read_journal(self) -> List[Dict[str, Any]]:
+        entries = []
+        if not os.path.exists(self.journal_path):
+            return entries
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Оборванная последняя строка при падении во время записи
+                    logger.warning("Skipping truncated journal entry")
+        return entries
+
+    def _plays_authoritative(self) -> bool:
+        """
+        Счетчики из контрольной точки действуют, если общий файл статистики
+        записан StateStore. Файл без маркера - сброшен вручную или старый формат.
+        """
+        if not os.path.exists(self.plays_file):
+            return True
+        try:
+            with open(self.plays_file, 'r') as f:
+                return self.PLAYS_MARKER in (json.load(f) or {})
+        except Exception:
+            return False
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Загрузка контрольных точек всех устройств.
+
+        Если записей еще нет, читается старый общий кэш (миграция).
+        """
+        records = {}
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name.startswith('_'):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if self.owns and not self.owns(data["device"]):
+                        continue
+                    records[data["device"]] = data
+                except Exception as e:
+                    logger.error(f"Error loading state record {name}: {str(e)}")
+
+        if not records and os.path.exists(self.legacy_cache_file):
+            try:
+                with open(self.legacy_cache_file, 'r') as f:
+                    records = json.load(f) or {}
+                if self.owns:
+                    records = {device_id: record for device_id, record in records.items() if self.owns(device_id)}
+                logger.info(f"Migrating legacy cache {self.legacy_cache_file} to per-device records")
+                self.mark_all_dirty(records.keys())
+            except Exception as e:
+                logger.error(f"Error loading legacy cache: {str(e)}")
+
+        return records
+
+    def restore(self, get_state: Callable[[str], Any]) -> Dict[str, Any]:
+        """
+        Восстановление состояния: контрольные точки + повтор журнала.
+
+        Зарезервированные на момент сбоя треки возвращаются в цикл,
+        проигрывания из журнала новее контрольной точки применяются повторно.
+
+        Returns:
+            Dict[str, Any]: восстановленные состояния по устройствам
+        """
+        records = self.load()
+        plays_authoritative = self._plays_authoritative()
+        restored = {}
+
+        for device_id, record in records.items():
+            state = get_state(device_id)
+            state.played_songs.update(map(sys.intern, record.get("lines", [])))
+            state.current_file = record.get("count", 1)
+            state.songs_played = record.get("songs_played", 0)
+            state.total_songs = record.get("total_songs", 0)
+            if plays_authoritative and "plays" in record:
+                # Обновляем на месте: словарь может принадлежать общему каталогу
+                state.track_plays.clear()
+                state.track_plays.update((sys.intern(track), plays) for track, plays in record["plays"].items())
+            # Прерванные треки не были засчитаны - проигрываем их заново
+            state.played_songs.difference_update(record.get("in_flight", []))
+            seq = record.get("seq", 0)
+            self._device_seq[device_id] = seq
+            self._persisted_seq[device_id] = seq
+            self._seq = max(self._seq, seq)
+            restored[device_id] = state
+
+        replayed = 0
+        for entry in self._read_journal():
+            seq = entry.get("seq", 0)
+            device_id = entry.get("device")
+            self._seq = max(self._seq, seq)
+            if not device_id or seq <= self._persisted_seq.get(device_id, 0):
+                continue
+            state = restored.get(device_id) or get_state(device_id)
+            track = sys.intern(entry["track"])
+            state.played_songs.add(track)
+            state.songs_played += 1
+            if plays_authoritative:
+                state.track_plays[track] = state.track_plays.get(track, 0) + 1
+            self._device_seq[device_id] = seq
+            restored[device_id] = state
+            replayed += 1
+
+        if replayed:
+            logger.info(f"Replayed {replayed} journal entries after unclean shutdown")
+            self.mark_all_dirty(restored.keys())
+            with self._lock:
+                self._plays_dirty = True
+                self.plays_version += 1
+
+        meta_path = os.path.join(self.directory, self.meta_file)
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    self.quarantine[:] = json.load(f).get("quarantine", [])
+                self._quarantine_saved = len(self.quarantine)
+            except Exception as e:
+                logger.error(f"Error loading state meta: {str(e)}")
+
+        return restored
+
+    def mark_all_dirty(self, device_ids: Optional[Iterable[str]] = None):
+        """Пометить все (или указанные) устройства для записи"""
+        with self._lock:
+            self._dirty.update(device_ids if device_ids is not None else self.device_states.keys())
+
+    def flush(self):
+        """Запись измененных устройств и, при необходимости, статистики проигрываний"""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                plays_dirty, self._plays_dirty = self._plays_dirty, False
+
+            if dirty:
+                os.makedirs(self.directory, exist_ok=True)
+            for device_id in dirty:
+                state = self.device_states.get(device_id)
+                if state is None:
+                    continue
+                try:
+                    record = self.record(state)
+                    self._write_atomic(self._record_path(device_id), record)
+                    self._persisted_seq[device_id] = record["seq"]
+                except Exception as e:
+                    logger.error(f"Error saving state for {device_id}: {str(e)}")
+                    self.mark_dirty(device_id)
+
+            if len(self.quarantine) != self._quarantine_saved:
+                try:
+                    quarantine = list(self.quarantine)
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._write_atomic(os.path.join(self.directory, self.meta_file),
+                                       {"v": self.RECORD_VERSION, "quarantine": quarantine})
+                    self._quarantine_saved = len(quarantine)
+                except Exception as e:
+                    logger.error(f"Error saving state meta: {str(e)}")
+
+            if plays_dirty:
+                try:
+                    self.write_plays()
+                except Exception as e:
+                    logger.error(f"Error saving track plays: {str(e)}")
+                    with self._lock:
+                        self._plays_dirty = True
+
+            if dirty:
+                logger.debug(f"State flushed for {len(dirty)} devices")
+                self._compact_journal()
+
+            for device_id in dirty:
+                state = self.device_states.get(device_id)
+                if state is not None:
+                    self.report_progress(device_id, state.songs_played, state.total_songs)
+
+    def _compact_journal(self):
+        """Очистка журнала, когда все его записи вошли в контрольные точки"""
+        with self._journal_lock:
+            if not os.path.exists(self.journal_path):
+                return
+            if all(self._persisted_seq.get(device_id, 0) >= seq
+                   for device_id, seq in self._device_seq.items()):
+                open(self.journal_path, 'w').close()
+
+    @contextmanager
+    def _plays_file_lock(self, timeout: float = 10.0):
+        """Межпроцессная блокировка общего файла статистики (lock-файл рядом)"""
+        lock_path = f"{self.plays_file}.lock"
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    # Блокировка упавшего процесса
+                    if time.time() - os.path.getmtime(lock_path) > timeout * 3:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError(f"Plays file is locked: {lock_path}")
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def write_plays(self):
+        """Запись общего файла статистики проигрываний"""
+        all_devices_data = {}
+        for device_id, state in list(self.device_states.items()):
+            with state.lock:
+                all_devices_data[device_id] = dict(state.track_plays)
+        all_devices_data[self.PLAYS_MARKER] = self._seq
+        os.makedirs(os.path.dirname(self.plays_file) or '.', exist_ok=True)
+        if not self.shard:
+            self._write_atomic(self.plays_file, all_devices_data)
+            return
+
+        # Шард: устройства других процессов берем из файла
+        with self._plays_file_lock():
+            merged = {}
+            if os.path.exists(self.plays_file):
+                try:
+                    with open(self.plays_file, 'r', encoding='utf-8') as f:
+                        merged = json.load(f) or {}
+                except ValueError:
+                    logger.warning(f"Plays file {self.plays_file} is damaged, rewriting")
+            merged.update(all_devices_data)
+            self._write_atomic(self.plays_file, merged)
+
+    def report_progress(self, device_id: str, songs_played: int, total_songs: int):
+        """Передать прогресс в UI, если цифры устройства изменились"""
+        numbers = (songs_played, total_songs)
+        with self._lock:
+            if self._reported.get(device_id) == numbers:
+                return
+            self._reported[device_id] = numbers
+        if self.on_progress:
+            try:
+                self.on_progress(device_id, songs_played, total_songs)
+            except Exception as e:
+                logger.error(f"Error reporting progress for {device_id}: {str(e)}")
+
+    def export_cache(self, path: Optional[str] = None) -> str:
+        """Выгрузка общего кэша в старом формате (для отчетов в Telegram)"""
+        path = path or self.legacy_cache_file
+        cache_data = {}
+        for device_id, state in list(self.device_states.items()):
+            record = self.record(state)
+            cache_data[device_id] = {key: record[key] for key in ("lines", "count", "songs_played", "total_songs")}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._write_atomic(path, cache_data, indent=4)
+        return path
+
+    def reset_cycle(self):
+        """
+        Сохранение состояния после сброса цикла.
+
+        Записи устройств перезаписываются атомарно (не удаляются), чтобы сбой
+        во время сброса не оставил журнал без контрольной точки.
+        """
+        with self._lock:
+            self._reported.clear()
+            for reserved in self._in_flight.values():
+                reserved.clear()
+            self._reserved_at.clear()
+        if self.catalog:
+            for device_id in list(self.device_states):
+                self.catalog.release(device_id, self.service)
+        if os.path.exists(self.legacy_cache_file):
+            os.remove(self.legacy_cache_file)
+        self.mark_all_dirty()
+        self.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in state flush: {str(e)}")
+
+    def start(self):
+        """Запуск фонового таймера записи"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f'state-store-{self.service}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка таймера с финальной записью"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 1)
+            self._thread = None
+        self.flush()
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TrackCatalog:
+    """
+    Каталог треков в памяти, общий для автоматизаций.
+
+    Треки базы хранятся один раз в виде интернированных строк, разбитыми на
+    части по lines_per_file (как data/database_part_*). Счетчики проигрываний
+    лежат в одной структуре по ключу (устройство, сервис); DeviceState
+    ссылается на свой словарь из нее, поэтому в Mix-режиме Spotify и Apple
+    Music не держат копии базы и истории.
+
+    Каталог также знает, какой трек сейчас играет на каждом (устройстве,
+    сервисе), и не выдает трек, который уже играет на другом сервисе.
+
+    На ферме из нескольких машин (attach_farm) трек дополнительно берется в
+    аренду у координатора, который держит глобальные счетчики; каталог
+    from_farm получает список треков от координатора.
+    """
+
+    FARM_REFRESH_INTERVAL = 30  # Период проверки версии каталога координатора (сек)
+
+    def __init__(self, lines_per_file: int = 200):
+        self.lines_per_file = max(1, lines_per_file)
+        self.parts: List[List[str]] = []
+        self.size = 0
+        self.plays: Dict[Tuple[str, str], Dict[str, int]] = {}  # (устройство, сервис) -> счетчики
+        self._source: Optional[Tuple[str, str]] = None  # ('parts', префикс) или ('file', путь)
+        self._signature: Optional[tuple] = None
+        self._loaded_plays = set()  # Сервисы, чей файл статистики уже разобран
+        self._playing: Dict[Tuple[str, str], str] = {}  # (устройство, сервис) -> трек в процессе
+        self.farm = None  # FarmNode: аренда треков у координатора фермы
+        self._farm_checked = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_parts(cls, prefix: str, lines_per_file: int = 200) -> 'TrackCatalog':
+        """Каталог по частям базы data/database_part_<prefix>_N.txt"""
+        catalog = cls(lines_per_file)
+        catalog._source = ('parts', prefix)
+        return catalog
+
+    @classmethod
+    def from_database(cls, path: str, lines_per_file: int = 200) -> 'TrackCatalog':
+        """Каталог по исходному файлу базы (части формируются в памяти)"""
+        catalog = cls(lines_per_file)
+        catalog._source = ('file', path)
+        return catalog
+
+    @classmethod
+    def from_farm(cls, farm, lines_per_file: int = 200) -> 'TrackCatalog':
+        """Каталог, который ведет координатор фермы (части формируются в памяти)"""
+        catalog = cls(lines_per_file)
+        catalog._source = ('farm', '')
+        catalog.attach_farm(farm)
+        return catalog
+
+    def attach_farm(self, farm):
+        """Выбор треков через аренду у координатора фермы (None - без фермы)"""
+        if farm is not None:
+            self.farm = farm
+
+    def _source_paths(self) -> List[str]:
+        kind, value = self._source
+        if kind == 'file':
+            return [value] if os.path.exists(value) else []
+        paths = []
+        for i in range(1, 1000):
+            file_path = f"data/database_part_{value}_{i}.txt"
+            if not os.path.exists(file_path):
+                break
+            paths.append(file_path)
+        return paths
+
+    def _current_signature(self, paths: List[str]) -> tuple:
+        signature = []
+        for path in paths:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    @staticmethod
+    def _read_tracks(path: str) -> List[str]:
+        with open(path) as f:
+            return [sys.intern(track) for track in (line.strip() for line in f) if track]
+
+    def refresh(self) -> bool:
+        """
+        Перечитывание базы, если ее файлы изменились (например, после split_database).
+
+        Returns:
+            bool: каталог был перечитан
+        """
+        if self._source is None:
+            return False
+        if self._source[0] == 'farm':
+            return self._refresh_from_farm()
+        with self._lock:
+            paths = self._source_paths()
+            signature = self._current_signature(paths)
+            if signature == self._signature:
+                return False
+
+            if self._source[0] == 'file':
+                tracks = self._read_tracks(paths[0]) if paths else []
+                parts = [tracks[i:i + self.lines_per_file]
+                         for i in range(0, len(tracks), self.lines_per_file)]
+            else:
+                parts = [self._read_tracks(path) for path in paths]
+
+            self.parts = parts
+            self.size = sum(len(part) for part in parts)
+            self._signature = signature
+        logger.info(f"Track catalog loaded: {self.size} tracks in {len(self.parts)} parts")
+        return True
+
+    def _refresh_from_farm(self) -> bool:
+        now = time.time()
+        if self.parts and now - self._farm_checked < self.FARM_REFRESH_INTERVAL:
+            return False
+        self._farm_checked = now
+        try:
+            version = self.farm.catalog_version()
+            if version is None or version == self._signature:
+                return False
+            tracks = [sys.intern(track) for track in self.farm.catalog_tracks()]
+        except ConnectionError as e:  # FarmUnavailable
+            if not self.parts:
+                raise
+            logger.warning(f"Farm catalog refresh skipped, keeping current catalog: {str(e)}")
+            return False
+        with self._lock:
+            self.parts = [tracks[i:i + self.lines_per_file]
+                          for i in range(0, len(tracks), self.lines_per_file)]
+            self.size = len(tracks)
+            self._signature = version
+        logger.info(f"Track catalog received from farm coordinator: {self.size} tracks")
+        return True
+
+    def part(self, number: int) -> Optional[List[str]]:
+        """Часть базы по номеру (с 1, как current_file); None - частей больше нет"""
+        if 1 <= number <= len(self.parts):
+            return self.parts[number - 1]
+        return None
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+    def track_plays(self, service: str, device_id: str, plays_file: str) -> Dict[str, int]:
+        """
+        Словарь счетчиков устройства для сервиса.
+
+        Файл статистики сервиса разбирается один раз на все устройства.
+        """
+        with self._lock:
+            if service not in self._loaded_plays:
+                self._loaded_plays.add(service)
+                self._load_plays_file(service, plays_file)
+            return self.plays.setdefault((device_id, service), {})
+
+    def reset_plays(self, service: str):
+        """Обнуление счетчиков сервиса на месте: DeviceState ссылаются на эти же словари"""
+        with self._lock:
+            for (_, plays_service), counters in self.plays.items():
+                if plays_service == service:
+                    counters.clear()
+
+    def _load_plays_file(self, service: str, plays_file: str):
+        if not os.path.exists(plays_file):
+            logger.info(f"No track plays file found for {service}, starting fresh")
+            return
+        try:
+            with open(plays_file, 'r', encoding='utf-8') as f:
+                all_devices_data = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading track plays from {plays_file}: {str(e)}")
+            return
+        for device_id, device_data in all_devices_data.items():
+            if not isinstance(device_data, dict):
+                continue
+            counters = self.plays.setdefault((device_id, service), {})
+            counters.update((sys.intern(track), plays) for track, plays in device_data.items())
+        logger.debug(f"Loaded track plays for {service}: {len(all_devices_data)} devices")
+
+    def _busy_tracks(self, service: str) -> Set[str]:
+        """Треки, играющие на других сервисах; вызывается под self._lock"""
+        return {track for (_, playing_service), track in self._playing.items() if playing_service != service}
+
+    def claim(self, candidates: Iterable[str], device_id: str, service: str) -> Optional[str]:
+        """
+        Выбор случайного трека из кандидатов, который не играет на другом сервисе.
+
+        Предыдущий трек этой пары (устройство, сервис) освобождается - устройство
+        играет один трек за раз. С фермой трек берется в аренду у координатора
+        без удержания блокировки (сетевой вызов, поэтому claim вызывается вне
+        event loop); если за время аренды трек занял другой сервис, аренда
+        возвращается. Без связи с координатором поднимается FarmUnavailable.
+
+        Returns:
+            Optional[str]: выбранный трек или None, если все кандидаты заняты
+            (с фермой - заняты или исчерпаны на всей ферме)
+        """
+        with self._lock:
+            busy = self._busy_tracks(service)
+            free = [track for track in candidates if track not in busy]
+            if not free:
+                return None
+            if not self.farm:
+                track = random.choice(free)
+                self._playing[(device_id, service)] = track
+                return track
+
+        track = self.farm.lease(device_id, service, free)
+        if track is None:
+            return None
+        with self._lock:
+            if track not in self._busy_tracks(service):
+                self._playing[(device_id, service)] = track
+                return track
+        self.farm.release(device_id, service, track)
+        logger.debug(f"Track leased for {device_id} started on another service meanwhile, lease returned")
+        return None
+
+    def release(self, device_id: str, service: str, track: Optional[str] = None):
+        """Трек больше не играет (track=None - освободить в любом случае)"""
+        with self._lock:
+            key = (device_id, service)
+            if track is None or self._playing.get(key) == track:
+                self._playing.pop(key, None)
+        if self.farm:
+            self.farm.release(device_id, service, track)
+
+    def commit(self, device_id: str, service: str, track: str):
+        """Трек проигран: отметка снимается, на ферме проигрывание засчитывается"""
+        with self._lock:
+            key = (device_id, service)
+            if self._playing.get(key) == track:
+                self._playing.pop(key, None)
+        if self.farm:
+            self.farm.commit(device_id, service, track)
@@ -0,0 +1,137 @@
+"""
+Headless запуск автоматизации без GUI (для серверов фермы)
+
+    python daemon.py                          # режим и настройки из settings.json
+    python daemon.py --mode mix --shard 2/4   # второй из четырех шардов устройств
+    python daemon.py --status-port 8766       # статус: http://127.0.0.1:8766/status
+    python daemon.py --processes 4            # устройства делятся между 4 процессами
+    python daemon.py --profile                # сэмплирующий профилировщик с запуска
+
+Профилирование также включается и выключается сигналом SIGUSR1
+(kill -USR1 <pid>); результаты - data/profiles/<сессия>.
+
+Для шардирования на нескольких машинах запускается несколько процессов с
+разными --shard и --status-port; каждое устройство попадает ровно в один шард.
+На одной машине --processes запускает шарды сам и отдает общий статус.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import logging
+
+# Добавляем текущую директорию в путь поиска модулей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from utils.config import Config
+from utils.logging_config import setup_logging
+from utils.profiler import start_profiling, stop_profiling, toggle_profiling
+from core.headless import HeadlessRunner, StatusServer
+from core.process_supervisor import ShardSupervisor
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(value: str):
+    """'2/4' -> (1, 4): номер шарда с 1 в аргументе, с 0 в конфигурации"""
+    try:
+        number, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must look like K/N, e.g. 1/4")
+    if count < 1 or not 1 <= number <= count:
+        raise argparse.ArgumentTypeError("shard number must be between 1 and N")
+    return number - 1, count
+
+
+def build_config(args) -> Config:
+    config = Config.from_settings_json(args.settings)
+    if args.mode:
+        config.service_type = args.mode
+    if args.shard:
+        config.shard_index, config.shard_count = args.shard
+    if args.status_port is not None:
+        config.status_port = args.status_port
+    if args.processes:
+        config.worker_processes = args.processes
+    return config
+
+
+def run_supervisor(config: Config) -> int:
+    """Шарды в процессах этой машины, статус - сводный по всем шардам"""
+    supervisor = ShardSupervisor(config, config.worker_processes)
+    status_server = None
+    if config.status_port:
+        try:
+            status_server = StatusServer(supervisor.board, config.status_host, config.status_port).start()
+        except OSError as e:
+            logger.error(f"Status endpoint not started: {str(e)}")
+
+    def handle_signal(signum, frame):
+        supervisor.stop()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    try:
+        return supervisor.run()
+    finally:
+        if status_server:
+            status_server.stop()
+
+
+def run_runner(config: Config) -> int:
+    """Все устройства (или шард --shard) в этом процессе"""
+    runner = HeadlessRunner(config)
+
+    def handle_signal(signum, frame):
+        # stop() отправляет отчеты в Telegram - не блокируем обработчик сигнала
+        threading.Thread(target=runner.stop, name='headless-stop', daemon=True).start()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    return runner.run()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Music automation without GUI")
+    parser.add_argument('--settings', default='settings.json', help="Файл настроек")
+    parser.add_argument('--mode', choices=[Config.SERVICE_SPOTIFY, Config.SERVICE_APPLE_MUSIC, Config.SERVICE_MIX],
+                        help="Режим (по умолчанию service_type из настроек)")
+    parser.add_argument('--shard', type=parse_shard, help="Шард устройств K/N")
+    parser.add_argument('--status-port', type=int, help="Порт HTTP статуса (0 - отключить)")
+    parser.add_argument('--processes', type=int, help="Процессов автоматизации на этой машине")
+    parser.add_argument('--profile', action='store_true', help="Профилирование с запуска (SIGUSR1 - вкл/выкл)")
+    args = parser.parse_args()
+    if args.shard and args.processes and args.processes > 1:
+        parser.error("--shard and --processes cannot be combined")
+
+    os.makedirs('data/logs', exist_ok=True)
+    setup_logging()
+    config = build_config(args)
+    logger.info(f"Headless start: mode={config.service_type}, "
+                f"shard={config.shard_index + 1}/{config.shard_count}")
+
+    if hasattr(signal, 'SIGUSR1'):
+        def handle_profiling_signal(signum, frame):
+            threading.Thread(target=toggle_profiling, args=(config,), name='profiling-toggle', daemon=True).start()
+
+        signal.signal(signal.SIGUSR1, handle_profiling_signal)
+    if args.profile:
+        start_profiling(config)
+
+    try:
+        if config.worker_processes > 1:
+            return run_supervisor(config)
+        return run_runner(config)
+    finally:
+        stop_profiling()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
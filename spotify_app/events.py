@@ -0,0 +1,112 @@
+"""
+Запросы к журналу событий устройств (data/events)
+
+    python events.py query --device 6745 --since "2026-10-19 02:00" --until "2026-10-19 03:00"
+    python events.py query --step error --since 2h --json      # ошибки за 2 часа в JSONL
+    python events.py stats --by device --step play --since 1d  # проигрывания по устройствам
+    python events.py stats --by hour service --outcome ok      # успешные события по часам и сервисам
+
+Время: 'YYYY-MM-DD HH:MM[:SS]', 'HH:MM' (сегодня) или назад от текущего
+момента: 30m, 2h, 1d.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+# Добавляем текущую директорию в путь поиска модулей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from core.event_log import query_events, aggregate_events
+
+RELATIVE_RE = re.compile(r'^(\d+(?:\.\d+)?)([smhd])$')
+UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_time(value: str) -> float:
+    """Время в аргументах -> timestamp"""
+    value = value.strip()
+    match = RELATIVE_RE.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * UNIT_SECONDS[match.group(2)]
+    try:
+        if re.match(r'^\d{1,2}:\d{2}(:\d{2})?$', value):
+            time_format = '%H:%M:%S' if value.count(':') == 2 else '%H:%M'
+            parsed = datetime.combine(datetime.now().date(), datetime.strptime(value, time_format).time())
+        else:
+            parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value}")
+    return parsed.timestamp()
+
+
+def format_latency(value) -> str:
+    return f"{value:.1f}s" if value is not None else '-'
+
+
+def print_events(events, as_json: bool, limit: int) -> int:
+    shown = 0
+    for event in events:
+        if as_json:
+            print(json.dumps(event, ensure_ascii=False))
+        else:
+            stamp = datetime.fromtimestamp(event['ts']).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{stamp}  {event.get('device', '-'):<20} {event.get('service', '-'):<12} "
+                  f"{event.get('step', '-'):<10} {event.get('outcome', '-'):<24} "
+                  f"{format_latency(event.get('latency')):>8}  {event.get('track') or ''}")
+        shown += 1
+        if limit and shown >= limit:
+            break
+    return shown
+
+
+def print_stats(rows, by) -> None:
+    header = ' / '.join(by)
+    width = max([len(header)] + [len(' / '.join(row['key'])) for row in rows])
+    print(f"{header:<{width}}  {'count':>7} {'ok':>7} {'ok%':>6} {'avg':>8} {'p50':>8} {'p95':>8}")
+    for row in rows:
+        ok_percent = row['ok'] / row['count'] * 100 if row['count'] else 0
+        print(f"{' / '.join(row['key']):<{width}}  {row['count']:>7} {row['ok']:>7} {ok_percent:>5.1f}% "
+              f"{format_latency(row['avg']):>8} {format_latency(row['p50']):>8} {format_latency(row['p95']):>8}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Device event log queries")
+    parser.add_argument('--dir', default='data/events', help="Каталог журнала событий")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('query', "Список событий"), ('stats', "Сводка по группам")):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('--since', type=parse_time, help="Начало интервала")
+        sub.add_argument('--until', type=parse_time, help="Конец интервала (не включая)")
+        sub.add_argument('--device', action='append', help="Устройство или порт (можно несколько)")
+        sub.add_argument('--step', action='append', help="Шаг: play, lifecycle, switch, error")
+        sub.add_argument('--outcome', action='append', help="Результат: ok, failed, имя ошибки")
+        sub.add_argument('--service', default='', help="Сервис: spotify, apple_music")
+        sub.add_argument('--track', default='', help="Подстрока названия трека")
+        if name == 'query':
+            sub.add_argument('--json', action='store_true', help="Вывод строками JSON")
+            sub.add_argument('--limit', type=int, default=0, help="Не больше N событий")
+        else:
+            sub.add_argument('--by', nargs='+', default=['device'],
+                             choices=['device', 'service', 'step', 'outcome', 'track', 'hour'],
+                             help="Поля группировки")
+
+    args = parser.parse_args()
+    events = query_events(args.dir, since=args.since, until=args.until, devices=args.device,
+                          steps=args.step, outcomes=args.outcome, service=args.service, track=args.track)
+
+    if args.command == 'query':
+        print_events(events, args.json, args.limit)
+    else:
+        print_stats(aggregate_events(events, args.by), args.by)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
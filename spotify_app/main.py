@@ -1,6 +1,7 @@
 import sys
 import os
 import logging
+import multiprocessing
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QIcon
 from utils.logging_config import setup_logging
@@ -58,4 +59,5 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Процессы-шарды в собранном exe
     main()
\ No newline at end of file
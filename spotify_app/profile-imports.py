@@ -0,0 +1,94 @@
+"""
+Профиль времени импорта при запуске GUI
+
+Запускает `python -X importtime -c "import main"` в отдельном процессе,
+выводит самые тяжелые модули и проверяет бюджет запуска. Движки
+(uiautomator2, telebot, PIL) не должны загружаться до нажатия Start.
+
+    python profile-imports.py --budget-ms 1500 --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+# Модули, которые должны импортироваться только при запуске автоматизации
+HEAVY_MODULES = ('uiautomator2', 'telebot', 'PIL')
+
+
+def profile_imports(module: str):
+    """
+    Импорт модуля в чистом процессе с -X importtime.
+
+    Returns:
+        tuple: (записи [(self_us, cumulative_us, depth, name)], время процесса в мс)
+    """
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line.split(':', 1)[1].split('|')
+        if len(fields) != 3:
+            continue
+        self_us, cumulative_us, name = fields
+        depth = len(name) - len(name.lstrip())  # Вложенность - отступ имени
+        entries.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return entries, elapsed_ms
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Профиль времени импорта при запуске GUI")
+    parser.add_argument('--module', default='main', help="Импортируемый модуль (по умолчанию main)")
+    parser.add_argument('--budget-ms', type=float, default=1500, help="Бюджет суммарного времени импорта, мс")
+    parser.add_argument('--top', type=int, default=15, help="Сколько самых тяжелых модулей показать")
+    args = parser.parse_args()
+
+    try:
+        entries, elapsed_ms = profile_imports(args.module)
+    except Exception as e:
+        logger.error(f"Profiling failed: {str(e)}")
+        return 2
+
+    # Верхний уровень - модули с минимальным отступом (их время включает вложенные)
+    min_depth = min((entry[2] for entry in entries), default=0)
+    top_level = [entry for entry in entries if entry[2] == min_depth]
+    total_ms = sum(entry[1] for entry in top_level) / 1000
+
+    logger.info(f"{'self ms':>9} {'cum ms':>9}  module")
+    for self_us, cumulative_us, _, name in sorted(entries, key=lambda entry: entry[1], reverse=True)[:args.top]:
+        logger.info(f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name}")
+
+    logger.info(f"Imports: {total_ms:.0f} ms, process: {elapsed_ms:.0f} ms, budget: {args.budget_ms:.0f} ms")
+
+    failed = False
+    loaded = {entry[3] for entry in entries}
+    heavy = [module for module in HEAVY_MODULES if module in loaded]
+    if heavy:
+        logger.error(f"Heavy modules loaded at startup: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        logger.error(f"Import budget exceeded by {total_ms - args.budget_ms:.0f} ms")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
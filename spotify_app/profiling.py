@@ -0,0 +1,82 @@
+"""
+Отчеты по результатам профилирования (data/profiles/<сессия>)
+
+    python profiling.py top data/profiles/20261019_020000/stacks.folded
+    python profiling.py diff data/profiles/.../mem_001_0200.snap data/profiles/.../mem_005_0600.snap
+
+stacks.folded открывается напрямую в speedscope или flamegraph.pl.
+Профилирование запускается кнопкой "Profiling" в боковой панели,
+python daemon.py --profile или сигналом SIGUSR1 процессу daemon.py.
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+from collections import Counter
+
+# Добавляем текущую директорию в путь поиска модулей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from utils.profiler import format_snapshot_diff
+
+
+def read_folded(path: str):
+    """(стек, число сэмплов) из файла collapsed stacks"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                yield stack.split(';'), int(count)
+
+
+def print_top(path: str, limit: int, thread: str):
+    own = Counter()  # Сэмплы, где функция была на вершине стека
+    total = Counter()  # Сэмплы, где функция была в стеке
+    samples = 0
+    for frames, count in read_folded(path):
+        if thread and frames[0] != thread:
+            continue
+        samples += count
+        own[frames[-1]] += count
+        for frame in set(frames[1:]):
+            total[frame] += count
+    if not samples:
+        print("No samples")
+        return
+    for title, counter in (("Own time", own), ("Total time", total)):
+        print(f"{title} ({samples} samples):")
+        for frame, count in counter.most_common(limit):
+            print(f"  {count / samples * 100:6.2f}%  {count:>9}  {frame}")
+        print()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Profiling session reports")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    top = subparsers.add_parser('top', help="Самые частые функции по stacks.folded")
+    top.add_argument('path')
+    top.add_argument('--limit', type=int, default=25)
+    top.add_argument('--thread', default='', help="Только поток или пул (например, lifecycle)")
+
+    diff = subparsers.add_parser('diff', help="Рост памяти между двумя снимками tracemalloc")
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--limit', type=int, default=30)
+    diff.add_argument('--by', choices=['lineno', 'filename', 'traceback'], default='lineno')
+
+    args = parser.parse_args()
+    if args.command == 'top':
+        print_top(args.path, args.limit, args.thread)
+    else:
+        old = tracemalloc.Snapshot.load(args.old)
+        new = tracemalloc.Snapshot.load(args.new)
+        for line in format_snapshot_diff(old, new, args.by, args.limit):
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
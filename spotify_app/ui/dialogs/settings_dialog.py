@@ -352,7 +352,16 @@ class SettingsDialog(QDialog):
         else:
             service_type = "spotify"  # По умолчанию
         
-        settings = {
+        # Сохраняем параметры, которых нет в диалоге (задаются вручную в settings.json)
+        settings = {}
+        if os.path.exists("settings.json"):
+            try:
+                with open("settings.json", "r") as f:
+                    settings = json.load(f)
+            except (OSError, ValueError):
+                settings = {}
+        
+        settings.update({
             "token": self.token_edit.text(),
             "chat_id": self.chat_id_edit.text(),
             "bluestacks_ip": self.ip_edit.text(),
@@ -367,7 +376,7 @@ class SettingsDialog(QDialog):
             # Сохраняем настройки Mix-режима
             "mix_min_time": self.mix_min_time.value(),
             "mix_max_time": self.mix_max_time.value()
-        }
+        })
         
         with open("settings.json", "w") as f:
             json.dump(settings, f, indent=4)
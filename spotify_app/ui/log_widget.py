@@ -1,28 +1,27 @@
-from PyQt6.QtWidgets import QTextEdit
-from PyQt6.QtCore import Qt, pyqtSlot
 import logging
+from utils.logging_config import attach_handler, UI_DATE_FORMAT
+from .views.log_view import LogConsole
 
 class QTextEditLogger(logging.Handler):
     def __init__(self, parent):
         super().__init__()
         self.widget = parent
         # Изменяем формат времени, убирая секунды и миллисекунды
-        self.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', 
-                                          datefmt='%Y-%m-%d %H:%M'))
+        self.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(device)s] %(message)s',
+                                          datefmt=UI_DATE_FORMAT))
 
     def emit(self, record):
         msg = self.format(record)
-        self.widget.append_log(msg)
+        # Запись только в буфер консоли - виджет обновится по своему таймеру в потоке UI
+        self.widget.append_log(msg, record.levelname)
 
-class LogWidget(QTextEdit):
+class LogWidget(LogConsole):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setReadOnly(True)
-        self.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
         
         # Обновленные стили для лога
         self.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #1e1e1e;
                 color: #a9b7c6;
                 font-family: Consolas, Monaco, monospace;
@@ -33,13 +32,6 @@ class LogWidget(QTextEdit):
             }
         """)
         
-        # Создаем и настраиваем логгер
+        # Создаем и подключаем handler к очереди логов
         self.log_handler = QTextEditLogger(self)
-        logger = logging.getLogger()
-        logger.addHandler(self.log_handler)
-
-    @pyqtSlot(str)
-    def append_log(self, message):
-        self.append(message)
-        # Прокручиваем к последней строке
-        self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
\ No newline at end of file
+        attach_handler(self.log_handler, 'log-widget')
@@ -1,10 +1,12 @@
 import sys
 import os
 import json
+import importlib
 import logging
+import threading
 from PyQt6.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QPushButton, QMessageBox, QSizePolicy, QApplication
 from PyQt6.QtGui import QIcon
-from PyQt6.QtCore import Qt, pyqtSlot, QTimer, QThread, QMetaObject
+from PyQt6.QtCore import Qt, pyqtSignal, pyqtSlot, QTimer, QThread, QMetaObject
 import socket
 # Импортируем наши виджеты
 from .views.sidebar_view import SidebarView
@@ -12,21 +14,48 @@ from .views.device_view import DeviceView
 from .views.split_device_view import SplitDeviceView  # Новый вид для Mix-режима
 from .views.log_view import LogView
 from .dialogs.settings_dialog import SettingsDialog
-from core.proxy_worker import ProxyWorker
-from core.proxy_manager import ProxyManager
 from utils.config import Config
 import asyncio
 import logging
 import ctypes
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from core.spotify_worker import SpotifyWorker
-from core.apple_music_worker import AppleMusicWorker
-from core.mix_worker import MixWorker  # Новый рабочий поток для Mix-режима
 logger = logging.getLogger(__name__)
 from ui.styles import apply_theme
-from utils.scrcpy_manager import ScrcpyManager
+from utils.scrcpy_manager import ScrcpyManager, RUNNING as SCRCPY_RUNNING, STOPPED as SCRCPY_STOPPED, FAILED as SCRCPY_FAILED
+from utils.progress_bus import ProgressBus
+from utils.logging_config import detach_handler
+from utils.profiler import start_profiling, stop_profiling, is_profiling
+from utils.device_preview import DevicePreviewFeed
+
+# Рабочие потоки загружаются только при нажатии Start/Proxy: вместе с ними
+# импортируются uiautomator2, telebot и PIL, которые замедляют появление окна.
+# Модули перечислены в build-script.py как hidden-import для PyInstaller
+WORKER_CLASSES = {
+    Config.SERVICE_SPOTIFY: ('core.spotify_worker', 'SpotifyWorker'),
+    Config.SERVICE_APPLE_MUSIC: ('core.apple_music_worker', 'AppleMusicWorker'),
+    Config.SERVICE_MIX: ('core.mix_worker', 'MixWorker'),  # Рабочий поток для Mix-режима
+    'proxy': ('core.proxy_worker', 'ProxyWorker'),
+    # worker_processes > 1: устройства распределяются по процессам
+    'sharded': ('core.sharded_worker', 'ShardedWorker'),
+    'sharded_mix': ('core.sharded_worker', 'ShardedMixWorker'),
+}
+
+
+def load_worker_class(kind: str):
+    """Импорт класса рабочего потока по требованию"""
+    module_name, class_name = WORKER_CLASSES[kind]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def worker_kind(config: Config) -> str:
+    """Тип рабочего потока для режима: однопроцессный или шардированный"""
+    if config.worker_processes > 1:
+        return 'sharded_mix' if config.service_type == Config.SERVICE_MIX else 'sharded'
+    return config.service_type
 
 class MainWindow(QMainWindow):
+    profiling_stopped = pyqtSignal(str)  # Каталог с результатами профилирования
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Music Automation")
@@ -58,14 +87,15 @@ class MainWindow(QMainWindow):
         self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         
         self.worker = None
-        self.scrcpy_manager = ScrcpyManager()
+        # Прогресс устройств от рабочих потоков: пачками раз в кадр
+        self.progress_bus = ProgressBus(self)
+        # Окна scrcpy: UI обновляется по сигналам смены состояния, без опроса
+        self.scrcpy_manager = ScrcpyManager(parent=self)
+        self.scrcpy_manager.state_changed.connect(self.on_scrcpy_state_changed)
+        # Превью экранов создается при первом включении (параметры из настроек)
+        self.preview_feed = None
         self.setup_ui()
         
-        # Настраиваем таймер для проверки состояния scrcpy
-        self.scrcpy_check_timer = QTimer(self)
-        self.scrcpy_check_timer.timeout.connect(self.check_scrcpy_statuses)
-        self.scrcpy_check_timer.start(2000)  # Проверка каждые 2 секунды
-        
         # Инициализируем виды устройств (стандартный и разделенный)
         self.device_view = None
         self.split_device_view = None
@@ -96,6 +126,10 @@ class MainWindow(QMainWindow):
         self.sidebar.settings_clicked.connect(self.show_settings)
         self.sidebar.reset_stats_clicked.connect(self.reset_play_statistics)
         self.sidebar.stop_screens_clicked.connect(self.stop_all_scrcpy)  # Подключаем новый сигнал
+        self.sidebar.preview_clicked.connect(self.toggle_preview)
+        self.sidebar.profiling_clicked.connect(self.toggle_profiling)
+        self.profiling_stopped.connect(self.on_profiling_stopped)
+        self._profiling_stopping = False
         self.main_layout.addWidget(self.sidebar)
         
         # Создаем правую часть с возможностью растяжения
@@ -168,6 +202,8 @@ class MainWindow(QMainWindow):
         self.device_view = DeviceView()
         self.device_view.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.device_view.monitoring_toggled.connect(self.toggle_device_monitoring)
+        self.progress_bus.progress_batch.connect(self.device_view.apply_progress_batch)
+        self.device_view.set_preview_mode(self.is_preview_running())
         
         # Добавляем в layout как первый элемент (перед log_view)
         self.right_layout.insertWidget(0, self.device_view)
@@ -186,43 +222,125 @@ class MainWindow(QMainWindow):
         self.split_device_view = SplitDeviceView()
         self.split_device_view.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.split_device_view.monitoring_toggled.connect(self.toggle_device_monitoring)
+        self.progress_bus.progress_batch.connect(self.split_device_view.apply_progress_batch)
+        self.split_device_view.set_preview_mode(self.is_preview_running())
         
         # Добавляем в layout как первый элемент (перед log_view)
         self.right_layout.insertWidget(0, self.split_device_view)
         
         logger.info("Инициализирован разделенный вид устройств для Mix-режима")
 
+    def current_device_view(self):
+        """Активный вид устройств (обычный или Mix)"""
+        return self.device_view or self.split_device_view
+
     def toggle_device_monitoring(self, device_id: str, start_monitoring: bool):
         """Включение/выключение мониторинга устройства"""
         try:
             if start_monitoring:
-                # Запускаем мониторинг
+                # Запуск не блокирует UI: результат придет сигналом state_changed
                 success = self.scrcpy_manager.start_scrcpy(
                     device_id,
                     window_title=f"Monitoring {device_id}"
                 )
                 
-                if success:
-                    self.log_view.append_log(f"Мониторинг устройства {device_id} запущен")
-                else:
+                if not success:
                     self.log_view.append_log(f"Не удалось запустить мониторинг устройства {device_id}")
             else:
                 # Останавливаем мониторинг
                 success = self.scrcpy_manager.stop_scrcpy(device_id)
-                if success:
-                    self.log_view.append_log(f"Мониторинг устройства {device_id} остановлен")
-                else:
+                if not success:
                     self.log_view.append_log(f"Не удалось остановить мониторинг устройства {device_id}")
             
-            # Обновляем статус мониторинга в UI
-            if self.device_view:
-                self.device_view.monitored_devices = set(self.scrcpy_manager.get_running_devices())
-            elif self.split_device_view:
-                self.split_device_view.monitored_devices = set(self.scrcpy_manager.get_running_devices())
+            if not success:
+                self.sync_monitored_devices()
                 
         except Exception as e:
             self.log_view.append_log(f"Ошибка при управлении мониторингом: {str(e)}")
             
+    def is_preview_running(self) -> bool:
+        return self.preview_feed is not None and self.preview_feed.running
+
+    def preview_devices(self):
+        """Устройства для превью: видимые карточки активного вида"""
+        view = self.current_device_view()
+        return view.visible_devices() if view else []
+
+    def apply_preview_frames(self, frames: dict):
+        view = self.current_device_view()
+        if view:
+            view.apply_preview_batch(frames)
+
+    def toggle_preview(self):
+        """Превью экранов в сетке: редкие уменьшенные кадры вместо окна scrcpy на каждое устройство"""
+        try:
+            view = self.current_device_view()
+            if self.is_preview_running():
+                self.preview_feed.stop()
+                self.log_view.append_log("Превью экранов выключено")
+            else:
+                if self.preview_feed is None:
+                    config = Config.from_dict(self.load_config() or {})
+                    self.preview_feed = DevicePreviewFeed(
+                        self.preview_devices, self,
+                        fps=config.preview_fps,
+                        max_side=config.preview_max_side,
+                        max_workers=config.preview_workers
+                    )
+                    self.preview_feed.frames_batch.connect(self.apply_preview_frames)
+                self.preview_feed.start()
+                self.log_view.append_log("Превью экранов включено (клик по карточке открывает scrcpy)")
+            if view:
+                view.set_preview_mode(self.is_preview_running())
+            self.sidebar.set_preview(self.is_preview_running())
+        except Exception as e:
+            self.log_view.append_log(f"Ошибка превью экранов: {str(e)}", 'ERROR')
+
+    def toggle_profiling(self):
+        """Запуск/остановка сэмплирующего профилировщика (все потоки процесса и tracemalloc)"""
+        if self._profiling_stopping:
+            return  # Предыдущая сессия еще записывается
+        try:
+            if is_profiling():
+                self._stop_profiling_async()
+                self.log_view.append_log("Профилирование останавливается, запись результатов...")
+            else:
+                settings = self.load_config() or {}
+                start_profiling(Config.from_dict(settings))
+                self.log_view.append_log("Профилирование запущено")
+            self.sidebar.set_profiling(is_profiling())
+        except Exception as e:
+            self.log_view.append_log(f"Ошибка профилирования: {str(e)}", 'ERROR')
+
+    def _stop_profiling_async(self, report: bool = True):
+        """
+        Остановка профилирования в отдельном потоке: запись стеков и снимок
+        памяти не блокируют UI. Поток не демонический - при закрытии окна
+        процесс дождется записи результатов.
+        """
+        self._profiling_stopping = True
+
+        def stop():
+            try:
+                output = stop_profiling() or ''
+            except Exception as e:
+                logger.error(f"Error stopping profiler: {str(e)}")
+                output = ''
+            if report:
+                self.profiling_stopped.emit(output)
+
+        threading.Thread(target=stop, name='profiling-stop').start()
+
+    @pyqtSlot(str)
+    def on_profiling_stopped(self, output: str):
+        """Результаты профилирования записаны (сигнал из потока остановки)"""
+        self._profiling_stopping = False
+        self.sidebar.set_profiling(is_profiling())
+        if output:
+            self.log_view.append_log(f"Профилирование остановлено, результаты: {output}")
+        else:
+            self.log_view.append_log("Не удалось записать результаты профилирования", 'ERROR')
+            
     def stop_all_scrcpy(self):
         """Остановка всех запущенных экранов устройств"""
         if hasattr(self, 'scrcpy_manager'):
@@ -231,60 +349,30 @@ class MainWindow(QMainWindow):
                 self.log_view.append_log("Все экраны устройств закрыты")
                 
                 # Обновляем статусы мониторинга во всех существующих видах
-                if self.device_view:
-                    self.device_view.monitored_devices.clear()
-                    # Обновляем карточки
-                    for device_id, card in self.device_view.cards.items():
-                        progress_text = card.progress_label.text()
-                        try:
-                            percentage = float(progress_text.strip('%'))
-                            card.update_progress(percentage, False)
-                        except ValueError:
-                            pass
-                            
-                if self.split_device_view:
-                    self.split_device_view.monitored_devices.clear()
-                    # Обновляем карточки
-                    for device_id, card in self.split_device_view.cards.items():
-                        spotify_progress = self.split_device_view.device_progress.get(device_id, {}).get('spotify', 0)
-                        apple_progress = self.split_device_view.device_progress.get(device_id, {}).get('apple_music', 0)
-                        active_service = self.split_device_view.active_services.get(device_id)
-                        card.update_progress(spotify_progress, apple_progress, active_service, False)
+                for view in (self.device_view, self.split_device_view):
+                    if view:
+                        view.set_monitored_devices(())
             else:
                 self.log_view.append_log("Не удалось закрыть все экраны устройств")
                 
-    def check_scrcpy_statuses(self):
-        """Проверка статусов окон scrcpy и обновление UI"""
-        if hasattr(self, 'scrcpy_manager'):
-            # Получаем текущие запущенные устройства
+    @pyqtSlot(str, str)
+    def on_scrcpy_state_changed(self, device_id: str, state: str):
+        """Смена состояния окна scrcpy (запущено, закрыто, упало)"""
+        if state == SCRCPY_RUNNING:
+            self.log_view.append_log(f"Мониторинг устройства {device_id} запущен")
+        elif state == SCRCPY_STOPPED:
+            self.log_view.append_log(f"Мониторинг устройства {device_id} остановлен")
+        elif state == SCRCPY_FAILED:
+            self.log_view.append_log(f"Не удалось запустить мониторинг устройства {device_id}")
+        self.sync_monitored_devices()
+
+    def sync_monitored_devices(self):
+        """Отметки мониторинга на карточках по запущенным окнам (перерисуются только измененные)"""
+        view = self.current_device_view()
+        if view:
             running_devices = set(self.scrcpy_manager.get_running_devices())
-            
-            # Обновляем UI для устройств в зависимости от того, какой вид активен
-            if self.device_view:
-                for device_id in self.device_view.monitored_devices.copy():
-                    if device_id not in running_devices:
-                        self.device_view.monitored_devices.remove(device_id)
-                        # Обновляем визуально карточку
-                        if device_id in self.device_view.cards:
-                            progress_text = self.device_view.cards[device_id].progress_label.text()
-                            try:
-                                percentage = float(progress_text.strip('%'))
-                                self.device_view.cards[device_id].update_progress(percentage, False)
-                            except ValueError:
-                                pass
-            
-            elif self.split_device_view:
-                for device_id in self.split_device_view.monitored_devices.copy():
-                    if device_id not in running_devices:
-                        self.split_device_view.monitored_devices.remove(device_id)
-                        # Обновляем визуально карточку
-                        if device_id in self.split_device_view.cards:
-                            spotify_progress = self.split_device_view.device_progress.get(device_id, {}).get('spotify', 0)
-                            apple_progress = self.split_device_view.device_progress.get(device_id, {}).get('apple_music', 0)
-                            active_service = self.split_device_view.active_services.get(device_id)
-                            self.split_device_view.cards[device_id].update_progress(
-                                spotify_progress, apple_progress, active_service, False
-                            )
+            if view.monitored_devices != running_devices:
+                view.set_monitored_devices(running_devices)
 
     def reset_play_statistics(self):
         """Обработчик сброса статистики прослушиваний"""
@@ -447,10 +535,10 @@ class MainWindow(QMainWindow):
                 self.init_split_device_view()
                 
                 # Создаем MixWorker
-                self.worker = MixWorker(worker_config)
+                self.worker = load_worker_class(worker_kind(worker_config))(worker_config)
                 
-                # Подключаем сигналы
-                self.worker.progress_updated.connect(self.split_device_view.update_device_progress)
+                # Подключаем сигналы (прогресс идет через progress_bus)
+                self.worker.progress_bus = self.progress_bus
                 self.worker.service_switched.connect(self.split_device_view.update_device_service)
                 self.worker.log_message.connect(self.handle_log_message)
                 self.worker.task_completed.connect(self.on_task_completed)
@@ -460,10 +548,10 @@ class MainWindow(QMainWindow):
                 self.init_device_view()
                 
                 # Создаем SpotifyWorker
-                self.worker = SpotifyWorker(worker_config)
+                self.worker = load_worker_class(worker_kind(worker_config))(worker_config)
                 
-                # Подключаем сигналы
-                self.worker.progress_updated.connect(self.device_view.update_device_progress)
+                # Подключаем сигналы (прогресс идет через progress_bus)
+                self.worker.progress_bus = self.progress_bus
                 self.worker.log_message.connect(self.handle_log_message)
                 self.worker.task_completed.connect(self.on_task_completed)
                 
@@ -472,10 +560,10 @@ class MainWindow(QMainWindow):
                 self.init_device_view()
                 
                 # Создаем AppleMusicWorker
-                self.worker = AppleMusicWorker(worker_config)
+                self.worker = load_worker_class(worker_kind(worker_config))(worker_config)
                 
-                # Подключаем сигналы
-                self.worker.progress_updated.connect(self.device_view.update_device_progress)
+                # Подключаем сигналы (прогресс идет через progress_bus)
+                self.worker.progress_bus = self.progress_bus
                 self.worker.log_message.connect(self.handle_log_message)
                 self.worker.task_completed.connect(self.on_task_completed)
             
@@ -580,7 +668,7 @@ class MainWindow(QMainWindow):
             return
             
         # Логируем остальные сообщения
-        self.log_view.append_log(message)
+        self.log_view.append_log(message, level)
 
     def restart_proxy(self):
         """Обработчик кнопки Restart Proxy"""
@@ -644,11 +732,12 @@ class MainWindow(QMainWindow):
                 )
                 
                 # Создаем и настраиваем worker
-                self.proxy_worker = ProxyWorker(config)
+                self.proxy_worker = load_worker_class('proxy')(config)
                 
                 # Подключаем сигналы
                 self.proxy_worker.log_message.connect(self.handle_log_message)
                 self.proxy_worker.task_completed.connect(self.on_proxy_task_completed)
+                self.proxy_worker.result_matrix.connect(self.on_proxy_results)
                 
                 # Запускаем worker
                 self.proxy_worker.start()
@@ -661,6 +750,19 @@ class MainWindow(QMainWindow):
         except Exception as e:
             logger.error(f"Failed to start proxy restart: {str(e)}")
 
+    def on_proxy_results(self, results: dict):
+        """Вывод матрицы результатов перезапуска прокси"""
+        ok_count = sum(1 for result in results.values() if result.get('ok'))
+        self.log_view.append_log(f"Прокси перезапущен: {ok_count}/{len(results)} устройств")
+        for device_id, result in sorted(results.items()):
+            if not result.get('ok'):
+                self.log_view.append_log(
+                    f"  {device_id}: restart={'+' if result.get('restarted') else '-'} "
+                    f"vpn={'+' if result.get('vpn_active') else '-'} "
+                    f"net={'+' if result.get('connectivity') else '-'} "
+                    f"попыток={result.get('attempts')}"
+                )
+
     def on_proxy_task_completed(self, success: bool):
         """Обработчик завершения задачи proxy worker"""
         try:
@@ -683,24 +785,15 @@ class MainWindow(QMainWindow):
                     # Отключаем все сигналы
                     self.proxy_worker.log_message.disconnect()
                     self.proxy_worker.task_completed.disconnect()
+                    self.proxy_worker.result_matrix.disconnect()
                     
-                    # Очищаем логгеры worker'а
-                    root_logger = logging.getLogger()
-                    for handler in root_logger.handlers[:]:
-                        if isinstance(handler, logging.Handler):
-                            handler.close()
-                            root_logger.removeHandler(handler)
+                    # Отключаем handler worker'а от очереди логов
+                    detach_handler('qt')
                     
                     # Удаляем worker
                     self.proxy_worker.deleteLater()
                     self.proxy_worker = None
                     
-                    # Восстанавливаем базовый handler для логов
-                    handler = logging.StreamHandler()
-                    handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s', 
-                                                        datefmt='%Y-%m-%d %H:%M'))
-                    root_logger.addHandler(handler)
-                    
                 except Exception as e:
                     logger.error(f"Error cleaning up proxy worker: {str(e)}")
                     
@@ -734,7 +827,11 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         # Останавливаем все запущенные окна scrcpy перед закрытием приложения
-        self.scrcpy_manager.stop_all()
+        self.scrcpy_manager.stop_all(wait=True)
+        if self.is_preview_running():
+            self.preview_feed.stop()
+        if is_profiling():
+            self._stop_profiling_async(report=False)  # Стеки и снимок памяти пишутся в фоне
         
         # Проверяем, есть ли запущенные рабочие потоки
         running_workers = []
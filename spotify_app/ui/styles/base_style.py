@@ -23,7 +23,7 @@ class BaseStyle:
     """
 
     LOG_VIEW = """
-        QTextEdit {
+        QTextEdit, QPlainTextEdit {
             border: 1px solid #3a3a3a;
             border-radius: 10px;
             margin: 5px;
@@ -0,0 +1,393 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QListView, QStyledItemDelegate, QAbstractItemView
+from PyQt6.QtCore import Qt, pyqtSignal, QAbstractListModel, QModelIndex, QSize, QRectF, QPointF
+from PyQt6.QtGui import QPainter, QColor, QBrush, QPen, QFont, QPainterPath, QPolygonF, QImage
+import logging
+
+logger = logging.getLogger(__name__)
+
+CELL_SIZE = 80
+PREVIEW_CELL_SIZE = 150  # Карточка в режиме превью: кадр экрана и подписи поверх
+SERVICE_SPOTIFY = 'spotify'
+SERVICE_APPLE_MUSIC = 'apple_music'
+
+
+def progress_color(progress: float) -> QColor:
+    """Цвет карточки по прогрессу"""
+    if progress < 30:
+        return QColor("#4CAF50")  # Зеленый
+    elif progress < 70:
+        return QColor("#FFC107")  # Желтый
+    return QColor("#2196F3")  # Синий
+
+
+def device_label(device_id: str) -> str:
+    """Подпись карточки: порт для IP:порт, начало ID для ADB"""
+    if ':' in device_id:
+        return f"Port {device_id.split(':')[1]}"
+    return f"ID:{device_id[:5]}"
+
+
+@dataclass
+class DeviceCell:
+    """Состояние карточки устройства"""
+    device_id: str
+    label: str
+    progress: Dict[str, float] = field(default_factory=dict)  # сервис ('' вне Mix) -> процент
+    active_service: Optional[str] = None
+    monitored: bool = False
+    preview: Optional[QImage] = None  # Последний кадр экрана (режим превью)
+
+
+class DeviceGridModel(QAbstractListModel):
+    """
+    Модель сетки устройств: одна строка на устройство.
+
+    Изменения приходят пачками (apply_progress_batch); dataChanged
+    отправляется только для строк, у которых поменялось отображаемое значение.
+    """
+
+    CellRole = Qt.ItemDataRole.UserRole.value + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._cells: List[DeviceCell] = []
+        self._rows: Dict[str, int] = {}
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._cells)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._cells):
+            return None
+        cell = self._cells[index.row()]
+        if role == self.CellRole:
+            return cell
+        if role == Qt.ItemDataRole.DisplayRole:
+            return cell.label
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return cell.device_id
+        return None
+
+    def device_at(self, index: QModelIndex) -> Optional[str]:
+        if not index.isValid():
+            return None
+        return self._cells[index.row()].device_id
+
+    def cell(self, device_id: str) -> Optional[DeviceCell]:
+        row = self._rows.get(device_id)
+        return self._cells[row] if row is not None else None
+
+    def devices(self) -> List[str]:
+        return [cell.device_id for cell in self._cells]
+
+    def _ensure_rows(self, device_ids: Iterable[str]):
+        new_ids = [device_id for device_id in dict.fromkeys(device_ids) if device_id not in self._rows]
+        if not new_ids:
+            return
+        first = len(self._cells)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_ids) - 1)
+        for device_id in new_ids:
+            self._rows[device_id] = len(self._cells)
+            self._cells.append(DeviceCell(device_id, device_label(device_id)))
+        self.endInsertRows()
+
+    def _emit_changed(self, rows: Iterable[int]):
+        """dataChanged по непрерывным диапазонам измененных строк"""
+        rows = sorted(set(rows))
+        start = previous = None
+        for row in rows + [None]:
+            if start is not None and (row is None or row != previous + 1):
+                self.dataChanged.emit(self.index(start), self.index(previous))
+                start = None
+            if row is not None and start is None:
+                start = row
+            previous = row
+
+    def apply_progress_batch(self, updates: list):
+        """Пачка ProgressUpdate (device_id, played, total, service)"""
+        self._ensure_rows(update.device_id for update in updates)
+        changed = []
+        for update in updates:
+            row = self._rows[update.device_id]
+            cell = self._cells[row]
+            percent = round(update.percent, 1)
+            if cell.progress.get(update.service) != percent:
+                cell.progress[update.service] = percent
+                changed.append(row)
+        self._emit_changed(changed)
+
+    def set_service(self, device_id: str, service: str):
+        self._ensure_rows([device_id])
+        row = self._rows[device_id]
+        if self._cells[row].active_service != service:
+            self._cells[row].active_service = service
+            self._emit_changed([row])
+
+    def set_previews(self, frames: Dict[str, QImage]):
+        """Новые кадры превью (устройства без карточки пропускаются)"""
+        changed = []
+        for device_id, image in frames.items():
+            row = self._rows.get(device_id)
+            if row is not None:
+                self._cells[row].preview = image
+                changed.append(row)
+        self._emit_changed(changed)
+
+    def clear_previews(self):
+        changed = [row for row, cell in enumerate(self._cells) if cell.preview is not None]
+        for row in changed:
+            self._cells[row].preview = None
+        self._emit_changed(changed)
+
+    def set_monitored(self, device_ids: Iterable[str]):
+        monitored = set(device_ids)
+        changed = []
+        for row, cell in enumerate(self._cells):
+            is_monitored = cell.device_id in monitored
+            if cell.monitored != is_monitored:
+                cell.monitored = is_monitored
+                changed.append(row)
+        self._emit_changed(changed)
+
+
+class DeviceCardDelegate(QStyledItemDelegate):
+    """
+    Отрисовка карточки устройства; вид рисует только видимые ячейки.
+
+    split=False - заливка цветом прогресса, split=True - две половинки
+    (Spotify слева сверху, Apple Music справа снизу), активный сервис ярче.
+    """
+
+    def __init__(self, split: bool = False, parent=None):
+        super().__init__(parent)
+        self.split = split
+        self.cell_size = CELL_SIZE
+        self.label_font = QFont()
+        self.label_font.setPixelSize(13)
+        self.value_font = QFont()
+        self.value_font.setPixelSize(15)
+        self.value_font.setBold(True)
+        self.service_font = QFont()
+        self.service_font.setPixelSize(12)
+
+    def sizeHint(self, option, index) -> QSize:
+        return QSize(self.cell_size, self.cell_size)
+
+    def paint(self, painter: QPainter, option, index: QModelIndex):
+        cell: DeviceCell = index.data(DeviceGridModel.CellRole)
+        if cell is None:
+            return
+        rect = QRectF(option.rect).adjusted(1, 1, -1, -1)
+        path = QPainterPath()
+        path.addRoundedRect(rect, 15, 15)
+
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        if self.split:
+            self._paint_split(painter, rect, path, cell)
+        else:
+            painter.fillPath(path, QBrush(progress_color(cell.progress.get('', 0.0))))
+        if cell.preview is not None:
+            self._paint_preview(painter, rect, path, cell.preview)
+
+        border = QPen(QColor("#FF5722"), 2) if cell.monitored else QPen(QColor("#3a3a3a"), 1)
+        painter.setPen(border)
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        painter.drawPath(path)
+
+        painter.setPen(QColor("white"))
+        if self.split:
+            lines = [
+                (cell.label, self.label_font, False),
+                (f"S: {cell.progress.get(SERVICE_SPOTIFY, 0.0):.1f}%", self.service_font,
+                 cell.active_service == SERVICE_SPOTIFY),
+                (f"A: {cell.progress.get(SERVICE_APPLE_MUSIC, 0.0):.1f}%", self.service_font,
+                 cell.active_service == SERVICE_APPLE_MUSIC),
+            ]
+        else:
+            lines = [
+                (cell.label, self.label_font, False),
+                (f"{cell.progress.get('', 0.0):.1f}%", self.value_font, False),
+            ]
+        line_height = rect.height() / len(lines)
+        for number, (text, font, bold) in enumerate(lines):
+            if bold:
+                font = QFont(font)
+                font.setBold(True)
+            painter.setFont(font)
+            line_rect = QRectF(rect.left(), rect.top() + number * line_height, rect.width(), line_height)
+            painter.drawText(line_rect, Qt.AlignmentFlag.AlignCenter, text)
+        painter.restore()
+
+    @staticmethod
+    def _paint_preview(painter: QPainter, rect: QRectF, path: QPainterPath, image: QImage):
+        """Кадр экрана по центру карточки, цвет прогресса остается по краям; подписи поверх затемнения"""
+        scale = min(rect.width() / image.width(), rect.height() / image.height())
+        width, height = image.width() * scale, image.height() * scale
+        target = QRectF(rect.center().x() - width / 2, rect.center().y() - height / 2, width, height)
+        painter.setClipPath(path)
+        painter.drawImage(target, image)
+        painter.fillRect(target, QColor(0, 0, 0, 90))
+        painter.setClipping(False)
+
+    @staticmethod
+    def _paint_split(painter: QPainter, rect: QRectF, path: QPainterPath, cell: DeviceCell):
+        spotify_color = progress_color(cell.progress.get(SERVICE_SPOTIFY, 0.0))
+        apple_color = progress_color(cell.progress.get(SERVICE_APPLE_MUSIC, 0.0))
+        # Делаем цвета активного сервиса чуть ярче
+        if cell.active_service == SERVICE_SPOTIFY:
+            spotify_color = spotify_color.lighter(120)
+        elif cell.active_service == SERVICE_APPLE_MUSIC:
+            apple_color = apple_color.lighter(120)
+
+        top_left, top_right = rect.topLeft(), rect.topRight()
+        bottom_left, bottom_right = rect.bottomLeft(), rect.bottomRight()
+        painter.setClipPath(path)
+        painter.setBrush(QBrush(spotify_color))
+        painter.drawPolygon(QPolygonF([top_left, top_right, bottom_left]))
+        painter.setBrush(QBrush(apple_color))
+        painter.drawPolygon(QPolygonF([top_right, bottom_right, bottom_left]))
+        painter.setPen(QPen(QColor("#3a3a3a"), 1))
+        painter.drawLine(QPointF(bottom_left), QPointF(top_right))
+        painter.setClipping(False)
+
+
+class DeviceGridView(QWidget):
+    """
+    Сетка карточек устройств на QListView: ячейки рисует делегат, при сотнях
+    устройств перерисовываются только видимые и измененные.
+
+    Клик по карточке включает/выключает мониторинг устройства (scrcpy);
+    в режиме превью карточки показывают кадры экрана от DevicePreviewFeed.
+    """
+    monitoring_toggled = pyqtSignal(str, bool)  # (device_id, start_monitoring)
+
+    def __init__(self, split: bool = False, parent=None):
+        super().__init__(parent)
+        self.monitored_devices = set()  # Отслеживаем, какие устройства мониторятся
+        self.model = DeviceGridModel(self)
+        self.setup_ui(split)
+
+    def setup_ui(self, split: bool):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(1, 1, 1, 1)  # уменьшаем отступы
+        layout.setSpacing(0)
+
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        self.list_view.setItemDelegate(DeviceCardDelegate(split, self.list_view))
+        self.list_view.setViewMode(QListView.ViewMode.IconMode)
+        self.list_view.setFlow(QListView.Flow.LeftToRight)
+        self.list_view.setWrapping(True)
+        self.list_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.list_view.setMovement(QListView.Movement.Static)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setGridSize(QSize(CELL_SIZE + 1, CELL_SIZE + 1))  # минимальные отступы между плитками
+        self.list_view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.list_view.setBatchSize(100)
+        self.list_view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.list_view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        self.list_view.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        self.list_view.clicked.connect(self._handle_click)
+        layout.addWidget(self.list_view)
+
+        self.list_view.setStyleSheet("""
+            QListView {
+                border: none;
+                background-color: transparent;
+            }
+            QScrollBar:vertical {
+                border: none;
+                background: #2b2b2b;
+                width: 8px;
+                margin: 0px;
+            }
+            QScrollBar::handle:vertical {
+                background: #3a3a3a;
+                min-height: 20px;
+                border-radius: 4px;
+            }
+            QScrollBar::add-line:vertical,
+            QScrollBar::sub-line:vertical {
+                height: 0px;
+            }
+            QScrollBar:horizontal {
+                border: none;
+                background: #2b2b2b;
+                height: 8px;
+                margin: 0px;
+            }
+            QScrollBar::handle:horizontal {
+                background: #3a3a3a;
+                min-width: 20px;
+                border-radius: 4px;
+            }
+            QScrollBar::add-line:horizontal,
+            QScrollBar::sub-line:horizontal {
+                width: 0px;
+            }
+        """)
+
+    def apply_progress_batch(self, updates: list):
+        """Пачка ProgressUpdate от ProgressBus"""
+        try:
+            self.model.apply_progress_batch(updates)
+        except Exception as e:
+            logger.error(f"Error updating device progress: {str(e)}")
+
+    def set_preview_mode(self, enabled: bool):
+        """Режим превью: крупные карточки с кадром экрана; клик по-прежнему открывает scrcpy"""
+        delegate = self.list_view.itemDelegate()
+        size = PREVIEW_CELL_SIZE if enabled else CELL_SIZE
+        if delegate.cell_size == size:
+            return
+        delegate.cell_size = size
+        self.list_view.setGridSize(QSize(size + 1, size + 1))
+        if not enabled:
+            self.model.clear_previews()
+
+    def apply_preview_batch(self, frames: dict):
+        """Пачка кадров от DevicePreviewFeed"""
+        try:
+            self.model.set_previews(frames)
+        except Exception as e:
+            logger.error(f"Error updating device previews: {str(e)}")
+
+    def visible_devices(self) -> List[str]:
+        """Устройства, карточки которых сейчас видны (превью снимаются только для них)"""
+        viewport = self.list_view.viewport().rect()
+        devices = []
+        for row in range(self.model.rowCount()):
+            index = self.model.index(row)
+            if self.list_view.visualRect(index).intersects(viewport):
+                devices.append(self.model.device_at(index))
+        return devices
+
+    def set_monitored_devices(self, device_ids: Iterable[str]):
+        """Актуальный набор устройств с открытым экраном"""
+        self.monitored_devices = set(device_ids)
+        self.model.set_monitored(self.monitored_devices)
+
+    def _handle_click(self, index: QModelIndex):
+        device_id = self.model.device_at(index)
+        if device_id:
+            self.handle_card_click(device_id)
+
+    def handle_card_click(self, device_id: str):
+        """Обработка клика по карточке устройства"""
+        is_monitored = device_id in self.monitored_devices
+
+        if is_monitored:
+            # Если уже мониторится, останавливаем
+            self.monitored_devices.remove(device_id)
+        else:
+            # Иначе запускаем мониторинг
+            self.monitored_devices.add(device_id)
+        self.model.set_monitored(self.monitored_devices)
+
+        # Генерируем сигнал для MainWindow
+        self.monitoring_toggled.emit(device_id, not is_monitored)
@@ -1,29 +1,155 @@
-from PyQt6.QtWidgets import QTextEdit
-from PyQt6.QtCore import Qt
+import threading
+from collections import deque
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPlainTextEdit, QComboBox, QLineEdit
+from PyQt6.QtCore import QTimer
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL,
+}
+
+
+class LogConsole(QPlainTextEdit):
+    """
+    Консоль лога с ограниченной памятью.
+
+    Последние max_lines записей хранятся в кольцевом буфере, на экране -
+    не больше visible_lines строк (maximumBlockCount). Новые записи копятся и
+    вставляются одной операцией раз в flush_interval мс; прокрутка вниз - только
+    если пользователь и так смотрел в конец. Фильтр по уровню и устройству
+    перестраивает экран с конца буфера, останавливаясь на visible_lines
+    совпадениях.
+
+    append_log вызывается и из потока QueueListener (QTextEditLogger), поэтому
+    буфер и очередь вставки меняются только под self._lock; виджет трогают
+    лишь flush и set_filter в потоке UI.
+    """
+
+    def __init__(self, parent=None, max_lines: int = 20000, visible_lines: int = 2000,
+                 flush_interval: int = 200):
+        super().__init__(parent)
+        self._buffer = deque(maxlen=max_lines)  # (уровень, текст)
+        self._pending = []
+        self._lock = threading.Lock()
+        self.min_level = 0
+        self.device_filter = ''
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setMaximumBlockCount(visible_lines)
+        self.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+
+        self._flush_timer = QTimer(self)
+        self._flush_timer.timeout.connect(self.flush)
+        self._flush_timer.start(flush_interval)
+
+    def _matches(self, entry) -> bool:
+        level, text = entry
+        return level >= self.min_level and (not self.device_filter or self.device_filter in text)
+
+    def append_log(self, message: str, level: str = 'INFO'):
+        entry = (LEVELS.get(level, logging.INFO), message)
+        with self._lock:
+            self._buffer.append(entry)
+            self._pending.append(entry)
+
+    def flush(self):
+        """Вставка накопленных записей одной операцией"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        lines = [text for level, text in pending if self._matches((level, text))]
+        if not lines:
+            return
+        scroll_bar = self.verticalScrollBar()
+        at_bottom = scroll_bar.value() >= scroll_bar.maximum() - 2
+        self.appendPlainText('\n'.join(lines[-self.maximumBlockCount():]))
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
+
+    def set_filter(self, min_level: int = 0, device: str = ''):
+        """Фильтр по минимальному уровню и подстроке устройства"""
+        self.min_level = min_level
+        self.device_filter = device.strip()
+        with self._lock:
+            self._pending = []  # Записи уже в буфере, попадут в перестроение
+            entries = list(self._buffer)
+        lines = []
+        for entry in reversed(entries):
+            if self._matches(entry):
+                lines.append(entry[1])
+                if len(lines) >= self.maximumBlockCount():
+                    break
+        lines.reverse()
+        self.setPlainText('\n'.join(lines))
+        self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
+
+
+class LogView(QWidget):
+    """Лог главного окна: фильтр по уровню и устройству над консолью"""
+
+    LEVEL_FILTERS = [("Все", 0), ("INFO+", logging.INFO), ("WARNING+", logging.WARNING), ("ERROR", logging.ERROR)]
 
-class LogView(QTextEdit):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setObjectName("logView")
         self.setup_ui()
 
     def setup_ui(self):
-        self.setReadOnly(True)
-        self.setMaximumHeight(200)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(5, 5, 5, 5)
+        layout.setSpacing(2)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.setSpacing(5)
+        self.level_combo = QComboBox()
+        for title, level in self.LEVEL_FILTERS:
+            self.level_combo.addItem(title, level)
+        self.level_combo.currentIndexChanged.connect(self.apply_filter)
+        filter_layout.addWidget(self.level_combo)
+
+        self.device_edit = QLineEdit()
+        self.device_edit.setPlaceholderText("Устройство (например, 6695)")
+        self.device_edit.setClearButtonEnabled(True)
+        self.device_edit.editingFinished.connect(self.apply_filter)
+        self.device_edit.textChanged.connect(self._device_text_changed)
+        filter_layout.addWidget(self.device_edit, 1)
+        layout.addLayout(filter_layout)
+
+        self.console = LogConsole()
+        layout.addWidget(self.console)
+
         self.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #1e1e1e;
                 color: #ffffff;
                 border: 1px solid #3a3a3a;
                 border-radius: 10px;
                 padding: 5px;
-                margin: 5px;
                 font-family: Consolas, Monaco, monospace;
                 font-size: 12px;
             }
+            QComboBox, QLineEdit {
+                background-color: #2b2b2b;
+                color: #ffffff;
+                border: 1px solid #3a3a3a;
+                border-radius: 5px;
+                padding: 1px 5px;
+                font-size: 12px;
+            }
         """)
 
-    def append_log(self, message: str):
-        self.append(message)
-        # Прокручиваем к последней строке
-        self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
\ No newline at end of file
+    def _device_text_changed(self, text: str):
+        # Очистка поля сразу снимает фильтр; ввод применяется по Enter
+        if not text:
+            self.apply_filter()
+
+    def apply_filter(self):
+        self.console.set_filter(self.level_combo.currentData() or 0, self.device_edit.text())
+
+    def append_log(self, message: str, level: str = 'INFO'):
+        self.console.append_log(message, level)
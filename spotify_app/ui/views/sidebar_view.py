@@ -8,6 +8,8 @@ class SidebarView(QWidget):
     settings_clicked = pyqtSignal()
     reset_stats_clicked = pyqtSignal()  # Сигнал для сброса статистики
     stop_screens_clicked = pyqtSignal()  # Новый сигнал для остановки всех экранов
+    preview_clicked = pyqtSignal()  # Включение/выключение превью экранов в сетке
+    profiling_clicked = pyqtSignal()  # Запуск/остановка профилирования
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -27,7 +29,9 @@ class SidebarView(QWidget):
             ("Restart Proxy", self.proxy_clicked),
             ("Настройки", self.settings_clicked),
             ("Reset Plays", self.reset_stats_clicked),
-            ("Stop All Screens", self.stop_screens_clicked)  # Новая кнопка
+            ("Stop All Screens", self.stop_screens_clicked),  # Новая кнопка
+            ("Preview Wall", self.preview_clicked),
+            ("Profiling", self.profiling_clicked)
         ]
         
         for text, signal in button_configs:
@@ -79,4 +83,12 @@ class SidebarView(QWidget):
         # Устанавливаем активное состояние для нажатой кнопки
         clicked_button.setProperty("active", True)
         clicked_button.style().unpolish(clicked_button)
-        clicked_button.style().polish(clicked_button)
\ No newline at end of file
+        clicked_button.style().polish(clicked_button)
+
+    def set_preview(self, active: bool):
+        """Подпись кнопки превью по состоянию"""
+        self.buttons[-2].setText("Stop Preview" if active else "Preview Wall")
+
+    def set_profiling(self, active: bool):
+        """Подпись кнопки профилирования по состоянию"""
+        self.buttons[-1].setText("Stop Profiling" if active else "Profiling")
@@ -27,6 +27,70 @@ class Config:
     # Параметры для Mix-режима
     mix_min_time: int = 300  # Минимальное время в секундах (5 минут)
     mix_max_time: int = 1800  # Максимальное время в секундах (30 минут)
+    mix_max_concurrent: int = 8  # Сколько устройств работают одновременно
+    mix_prewarm_lead: int = 30  # За сколько секунд до переключения прогревать следующий сервис
+    mix_prewarm_min_memory_mb: int = 1024  # Прогрев только если на устройстве свободно не меньше (МБ)
+
+    # Параметры перезапуска прокси
+    proxy_restart_concurrency: int = 8  # Сколько устройств перезапускать одновременно
+    proxy_check_url: str = ''  # URL проверки связности (пусто - локальный endpoint)
+    proxy_probe_host: str = '10.0.2.2'  # Адрес хоста, видимый из эмулятора
+    proxy_monitor_interval: int = 300  # Период фоновой проверки VPN на устройстве (сек)
+    proxy_monitor_failures: int = 2  # Неудачных проверок подряд до перезапуска прокси
+
+    # Предохранители устройств (core/device_breaker.py)
+    breaker_failure_threshold: int = 3  # Ошибок устройства подряд до парковки (предохранитель открыт)
+    breaker_cooldown: int = 60  # Пауза до первой проверки припаркованного устройства (сек), дальше удваивается
+    breaker_max_cooldown: int = 900  # Предельная пауза между проверками (сек)
+    breaker_report_window: int = 600  # Одинаковая ошибка устройства отчитывается не чаще (сек), повторы считаются
+
+    # Сохранение состояния устройств
+    state_flush_interval: int = 5  # Период фоновой записи измененных устройств (сек)
+
+    # Журнал событий устройств (core/event_log.py, запросы - events.py)
+    event_log_enabled: bool = True
+    event_log_dir: str = 'data/events'
+
+    # Headless-режим (daemon.py)
+    shard_index: int = 0  # Номер шарда устройств этого процесса
+    shard_count: int = 1  # Всего шардов (1 - все устройства в одном процессе)
+    status_host: str = '127.0.0.1'  # Адрес HTTP endpoint статуса
+    status_port: int = 8765  # Порт HTTP endpoint статуса (0 - отключен)
+    worker_processes: int = 1  # Процессов автоматизации (больше 1 - устройства делятся между ними)
+
+    # Метрики Prometheus (utils/metrics.py)
+    metrics_host: str = '127.0.0.1'
+    metrics_port: int = 9108  # Порт GET /metrics (0 - отключен); процессы-шарды берут следующие порты
+
+    # Детектор блокирующих вызовов в event loop (utils/loop_watchdog.py)
+    loop_watchdog_enabled: bool = False
+    loop_watchdog_threshold: float = 0.5  # Блокировка дольше (сек) - стек в лог и метрики
+    loop_watchdog_interval: float = 0.1  # Период сердцебиения цикла (сек)
+
+    # Профилирование по запросу (utils/profiler.py, отчеты - profiling.py)
+    profiler_dir: str = 'data/profiles'
+    profiler_interval: float = 0.02  # Период сэмплирования стеков всех потоков (сек)
+    profiler_snapshot_interval: int = 3600  # Период снимков tracemalloc (сек)
+    profiler_tracemalloc_frames: int = 10  # Глубина стека выделений памяти
+
+    # Скриншоты устройств для ошибок и отчетов (core/device_screenshots.py)
+    screenshot_max_side: int = 720  # Большая сторона после уменьшения (px)
+    screenshot_quality: int = 70  # Качество JPEG
+    screenshot_dedupe_window: int = 600  # Похожий снимок в течение окна (сек) не сохраняется и не отправляется
+    screenshot_hash_distance: int = 6  # Порог отличия dHash (бит из 64) для "похожего" снимка
+
+    # Превью экранов в сетке устройств (utils/device_preview.py)
+    preview_fps: float = 1.0  # Кадров в секунду на устройство
+    preview_max_side: int = 240  # Большая сторона кадра после уменьшения (px)
+    preview_workers: int = 4  # Потоков снятия и декодирования кадров
+
+    # Ферма из нескольких машин (core/farm_coordinator.py)
+    farm_role: str = ''  # '' - выключено, 'coordinator' - владеет каталогом и счетчиками, 'client' - берет треки в аренду
+    farm_host: str = '0.0.0.0'  # Координатор: адрес прослушивания; клиент: адрес координатора
+    farm_port: int = 8790
+    farm_node: str = ''  # Имя машины в аренде (пусто - hostname)
+    farm_max_plays_per_track: int = 0  # Лимит проигрываний трека на всю ферму (0 - max_plays_per_track)
+    farm_lease_ttl: int = 900  # Через сколько секунд истекает аренда упавшей машины
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Config':
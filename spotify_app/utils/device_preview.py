@@ -0,0 +1,133 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QObject, QSize, QTimer, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader
+
+from utils.metrics import REGISTRY, watch_executor
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FRAMES = REGISTRY.counter('music_preview_frames_total', 'Кадры превью устройств', ('outcome',))
+
+
+def decode_preview(data: bytes, max_side: int) -> Optional[QImage]:
+    """
+    JPEG/PNG -> уменьшенный QImage (вызывается в фоновом потоке).
+
+    Для JPEG QImageReader с setScaledSize декодирует сразу в уменьшенном
+    масштабе, полный кадр в памяти не разворачивается.
+    """
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+    reader = QImageReader(buffer)
+    size = reader.size()
+    if size.isValid() and max(size.width(), size.height()) > max_side:
+        scale = max_side / max(size.width(), size.height())
+        reader.setScaledSize(QSize(max(1, int(size.width() * scale)), max(1, int(size.height() * scale))))
+    image = reader.read()
+    return None if image.isNull() else image
+
+
+class DevicePreviewFeed(QObject):
+    """
+    Живые превью экранов устройств для сетки карточек.
+
+    Раз в 1/fps секунд для каждого устройства из devices_provider (видимые
+    карточки) в небольшом пуле потоков снимается скриншот через кэш
+    подключений uiautomator2 и декодируется в уменьшенный QImage. Устройство,
+    кадр которого еще не готов, пропускает такт - медленные устройства не
+    копят очередь. Готовые кадры схлопываются до последнего и раз в такт
+    уходят в поток UI одним сигналом frames_batch.
+    """
+
+    frames_batch = pyqtSignal(dict)  # device_id -> QImage
+
+    def __init__(self, devices_provider: Callable[[], Iterable[str]], parent=None,
+                 fps: float = 1.0, max_side: int = 240, max_workers: int = 4):
+        super().__init__(parent)
+        self.devices_provider = devices_provider
+        self.max_side = max(32, int(max_side))
+        self.max_workers = max(1, int(max_workers))
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._connections: Dict[str, object] = {}  # device_id -> u2.Device
+        self._in_flight: Set[str] = set()
+        self._pending: Dict[str, QImage] = {}
+        self._lock = threading.Lock()
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(100, int(1000 / max(0.1, float(fps)))))
+        self._timer.timeout.connect(self._tick)
+
+    @property
+    def running(self) -> bool:
+        return self._timer.isActive()
+
+    def start(self):
+        if self.running:
+            return
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='preview')
+        watch_executor('preview', self.executor)
+        self._timer.start()
+        self._tick()
+        logger.info(f"Device preview started ({1000 / self._timer.interval():.1f} fps)")
+
+    def stop(self):
+        if not self.running:
+            return
+        self._timer.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        with self._lock:
+            self._pending.clear()
+            self._in_flight.clear()
+            self._connections.clear()
+        logger.info("Device preview stopped")
+
+    def _tick(self):
+        """Такт в потоке UI: отправка готовых кадров и запуск новых снимков"""
+        with self._lock:
+            frames, self._pending = self._pending, {}
+            busy = set(self._in_flight)
+        if frames:
+            self.frames_batch.emit(frames)
+        for device_id in self.devices_provider():
+            if device_id in busy:
+                continue
+            with self._lock:
+                self._in_flight.add(device_id)
+            self.executor.submit(self._capture, device_id)
+
+    def _connection(self, device_id: str):
+        """Подключение из кэша; u2.connect - вне блокировки (сетевой вызов)"""
+        with self._lock:
+            d = self._connections.get(device_id)
+        if d is None:
+            import uiautomator2 as u2  # Загружается только при включении превью
+            d = u2.connect(device_id)
+            with self._lock:
+                d = self._connections.setdefault(device_id, d)
+        return d
+
+    def _capture(self, device_id: str):
+        """Снимок и декодирование кадра одного устройства (фоновый поток)"""
+        try:
+            data = self._connection(device_id).screenshot(format='raw')
+            image = decode_preview(data, self.max_side) if data else None
+            if image is None:
+                PREVIEW_FRAMES.labels('failed').inc()
+                return
+            PREVIEW_FRAMES.labels('ok').inc()
+            with self._lock:
+                if device_id in self._in_flight:  # Превью не остановлено за время снимка
+                    self._pending[device_id] = image
+        except Exception as e:
+            PREVIEW_FRAMES.labels('failed').inc()
+            with self._lock:
+                self._connections.pop(device_id, None)  # Следующий такт подключится заново
+            logger.debug(f"Preview capture failed on {device_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(device_id)
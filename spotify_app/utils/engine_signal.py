@@ -0,0 +1,37 @@
+import logging
+import threading
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class EngineSignal:
+    """
+    Сигнал движка без Qt: тот же интерфейс connect/emit, что у pyqtSignal.
+
+    Движки автоматизации используют его вместо pyqtSignal, поэтому работают
+    и в QThread-воркерах (сигнал подключается к pyqtSignal.emit), и в
+    headless-режиме без PyQt6.
+    """
+
+    def __init__(self):
+        self._slots: List[Callable] = []
+        self._lock = threading.Lock()
+
+    def connect(self, slot: Callable):
+        with self._lock:
+            self._slots.append(slot)
+
+    def disconnect(self, slot: Callable):
+        with self._lock:
+            if slot in self._slots:
+                self._slots.remove(slot)
+
+    def emit(self, *args):
+        with self._lock:
+            slots = list(self._slots)
+        for slot in slots:
+            try:
+                slot(*args)
+            except Exception as e:
+                logger.debug(f"Signal slot failed: {str(e)}")
@@ -1,57 +1,213 @@
+import asyncio
+import atexit
+import contextvars
 import logging
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(device)s] %(message)s'
+# Компактный формат консолей UI: без логгера, но с устройством (по нему работает фильтр лога)
+UI_LOG_FORMAT = '%(asctime)s - [%(device)s] %(message)s'
+UI_DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+# Устройство, которое обрабатывает текущая задача asyncio (попадает в record.device)
+_log_device = contextvars.ContextVar('log_device', default='-')
+
+_listener = None  # QueueListener корневого логгера
+_service_listeners = {}
+_listener_lock = threading.Lock()
+
+
+def set_log_device(device_id: str):
+    """
+    Привязка записей лога текущей задачи к устройству.
+
+    Вызывается в начале корутины устройства: у каждой задачи asyncio своя
+    копия контекста, поэтому значение не смешивается между устройствами.
+    """
+    _log_device.set(device_id or '-')
+
+
+def run_in_executor(executor, func, *args) -> asyncio.Future:
+    """
+    loop.run_in_executor с копией контекста вызывающей задачи.
+
+    Обычный run_in_executor контекст не копирует, и записи лога из пула
+    потоков теряют устройство из set_log_device.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, contextvars.copy_context().run, func, *args)
+
+
+class DeviceContextFilter(logging.Filter):
+    """Добавляет в запись поле device (из set_log_device или extra={'device': ...})"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'device'):
+            record.device = _log_device.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Ограничение повторов: одно и то же сообщение (логгер, уровень, устройство,
+    текст) проходит не больше burst раз за interval секунд. Число подавленных
+    повторов дописывается к первому сообщению следующего окна.
+    """
+
+    def __init__(self, interval: float = 60.0, burst: int = 5, max_keys: int = 10000):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_keys = max_keys
+        self._windows = {}  # ключ -> [начало окна, пропущено, подавлено]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, getattr(record, 'device', '-'), str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                if len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (подавлено повторов: {suppressed})"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def _queue_handler(log_queue) -> QueueHandler:
+    """Обработчик в потоке вызывающего: только фильтры и постановка в очередь"""
+    handler = QueueHandler(log_queue)
+    handler.addFilter(DeviceContextFilter())
+    handler.addFilter(RateLimitFilter())
+    return handler
+
 
 def setup_service_logging(service_name: str) -> logging.Logger:
     """Настройка логирования для сервиса с ротацией"""
     log_dir = os.path.join('data', 'logs')
     os.makedirs(log_dir, exist_ok=True)
-    
+
     logger = logging.getLogger(service_name)
     logger.setLevel(logging.INFO)
-    
-    if not logger.handlers:
-        # Файловый handler с ротацией
-        log_file = os.path.join(log_dir, f'{service_name}_{datetime.now().strftime("%Y%m%d")}.log')
-        file_handler = RotatingFileHandler(
-            log_file,
-            maxBytes=10*1024*1024,  # 10 MB
-            backupCount=5,
-            encoding='utf-8'
-        )
-        file_handler.setFormatter(
-            logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        )
-        logger.addHandler(file_handler)
-        
+
+    with _listener_lock:
+        if service_name not in _service_listeners:
+            # Файловый handler с ротацией пишет в фоновом потоке
+            log_file = os.path.join(log_dir, f'{service_name}_{datetime.now().strftime("%Y%m%d")}.log')
+            file_handler = RotatingFileHandler(
+                log_file,
+                maxBytes=10*1024*1024,  # 10 MB
+                backupCount=5,
+                encoding='utf-8'
+            )
+            file_handler.setFormatter(
+                logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+            )
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+            listener.start()
+            _service_listeners[service_name] = listener
+            logger.addHandler(_queue_handler(log_queue))
+
     return logger
 
 def setup_logging():
-    """Общая настройка логирования"""
+    """
+    Общая настройка логирования.
+
+    Корневой логгер получает только QueueHandler: в потоке устройства запись
+    проходит фильтры (поле device, ограничение повторов) и ставится в очередь.
+    Файл, консоль и обработчики UI (attach_handler) работают в потоке
+    QueueListener, поэтому рабочие потоки не ждут ввода-вывода лога.
+    """
+    global _listener
     # Создаем директории для логов
     log_dir = os.path.join('data', 'logs')
     os.makedirs(log_dir, exist_ok=True)
-    
+
     # Настраиваем корневой логгер
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
-    
-    # Добавляем форматтер для всех хендлеров
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    
-    # Файловый handler для общих логов
-    file_handler = logging.FileHandler(
-        os.path.join(log_dir, f'app_{datetime.now().strftime("%Y%m%d")}.log'),
-        encoding='utf-8'
-    )
-    file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
-    
-    # Консольный handler
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
-    
-    return root_logger
\ No newline at end of file
+
+    with _listener_lock:
+        if _listener is not None:
+            return root_logger
+
+        # Добавляем форматтер для всех хендлеров
+        formatter = logging.Formatter(LOG_FORMAT)
+
+        # Файловый handler для общих логов
+        file_handler = logging.FileHandler(
+            os.path.join(log_dir, f'app_{datetime.now().strftime("%Y%m%d")}.log'),
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+
+        # Консольный handler
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        _listener.start()
+        root_logger.addHandler(_queue_handler(log_queue))
+        atexit.register(shutdown_logging)
+
+    return root_logger
+
+
+def attach_handler(handler: logging.Handler, name: str):
+    """
+    Подключение обработчика к общему конвейеру (например, сигнала Qt).
+
+    Обработчик с тем же именем заменяется - каждый новый воркер подключает свой.
+    Без setup_logging обработчик добавляется к корневому логгеру напрямую.
+    """
+    handler.set_name(name)
+    with _listener_lock:
+        if _listener is not None:
+            _listener.handlers = tuple(h for h in _listener.handlers if h.get_name() != name) + (handler,)
+            return
+    detach_handler(name)
+    handler.addFilter(DeviceContextFilter())
+    logging.getLogger().addHandler(handler)
+
+
+def detach_handler(name: str):
+    """Отключение обработчика, подключенного через attach_handler"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.handlers = tuple(h for h in _listener.handlers if h.get_name() != name)
+            return
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        if handler.get_name() == name:
+            root_logger.removeHandler(handler)
+
+
+def shutdown_logging():
+    """Запись оставшихся сообщений очереди и остановка фоновых потоков лога"""
+    global _listener
+    with _listener_lock:
+        listeners = list(_service_listeners.values())
+        _service_listeners.clear()
+        if _listener is not None:
+            listeners.append(_listener)
+            _listener = None
+    for listener in listeners:
+        listener.stop()
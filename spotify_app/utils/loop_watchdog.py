@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, Tuple
+
+from utils.metrics import REGISTRY, LOOP_LAG, track_loop_lag
+
+logger = logging.getLogger(__name__)
+
+LOOP_BLOCKED = REGISTRY.counter('music_loop_blocked_total',
+                                'Блокировки event loop дольше порога (функция и устройство по стеку)',
+                                ('loop', 'function', 'device'))
+LOOP_BLOCK_SECONDS = REGISTRY.histogram('music_loop_block_seconds', 'Длительность блокировок event loop',
+                                        ('loop',), buckets=(0.25, 0.5, 1, 2, 5, 10, 30, 60))
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEVICE_LOCALS = ('device', 'device_id', 'device_addr')
+
+
+def _is_app_frame(filename: str) -> bool:
+    return os.path.abspath(filename).startswith(APP_ROOT) and not filename.endswith('loop_watchdog.py')
+
+
+def _device_from_frame(frame) -> str:
+    """Устройство из локальных переменных кадров стека (от внутреннего к внешнему)"""
+    while frame is not None:
+        local_vars = frame.f_locals
+        for name in DEVICE_LOCALS:
+            value = local_vars.get(name)
+            if isinstance(value, str) and value:
+                return value
+        serial = getattr(local_vars.get('d'), 'serial', None)
+        if isinstance(serial, str) and serial:
+            return serial
+        frame = frame.f_back
+    return '-'
+
+
+def blocking_site(frame) -> Tuple[str, str, str]:
+    """
+    (функция, устройство, стек) заблокированного потока.
+
+    Функция - самый глубокий кадр кода приложения: для time.sleep или
+    синхронного RPC uiautomator2 это вызвавший их метод движка.
+    """
+    stack = traceback.extract_stack(frame)
+    function = '-'
+    for entry in reversed(stack):
+        if _is_app_frame(entry.filename):
+            function = f"{os.path.basename(entry.filename)}:{entry.name}"
+            break
+    app_frame = frame
+    while app_frame is not None and not _is_app_frame(app_frame.f_code.co_filename):
+        app_frame = app_frame.f_back
+    device = _device_from_frame(app_frame)
+    return function, device, ''.join(traceback.format_list(stack[-15:]))
+
+
+class LoopWatchdog:
+    """
+    Детектор блокирующих вызовов в event loop.
+
+    Корутина run() работает в наблюдаемом цикле и раз в interval секунд
+    отмечает "сердцебиение" (и задержку цикла в метриках). Фоновый поток
+    проверяет сердцебиение: если цикл не отвечает дольше threshold, снимается
+    стек потока цикла - функция и устройство блокировки пишутся в лог и в
+    метрики. Длительность блокировки фиксируется, когда цикл оживает.
+    """
+
+    def __init__(self, name: str, threshold: float = 0.5, interval: float = 0.1):
+        self.name = name
+        self.threshold = max(0.05, float(threshold))
+        self.interval = max(0.01, float(interval))
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._blocked: Optional[Tuple[float, str, str]] = None  # начало, функция, устройство
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        watcher = threading.Thread(target=self._watch, name=f'loop-watchdog-{self.name}', daemon=True)
+        watcher.start()
+        lag = LOOP_LAG.labels(self.name)
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag.set(max(0.0, loop.time() - expected))
+                self._beat = time.monotonic()
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled > self.threshold:
+                if self._blocked is None:
+                    self._report_block(stalled)
+            elif self._blocked is not None:
+                self._report_recovered()
+
+    def _report_block(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        function, device, stack = blocking_site(frame)
+        self._blocked = (time.monotonic() - stalled, function, device)
+        LOOP_BLOCKED.labels(self.name, function, device).inc()
+        logger.warning(f"Event loop '{self.name}' blocked > {self.threshold:.2f}s in {function} "
+                       f"(device {device}):\n{stack.rstrip()}", extra={'device': device})
+
+    def _report_recovered(self):
+        started, function, device = self._blocked
+        self._blocked = None
+        duration = self._beat - started
+        LOOP_BLOCK_SECONDS.labels(self.name).observe(duration)
+        logger.warning(f"Event loop '{self.name}' was blocked {duration:.2f}s in {function} (device {device})",
+                       extra={'device': device})
+
+
+def watch_event_loop(name: str, config):
+    """
+    Корутина наблюдения за текущим event loop: с config.loop_watchdog_enabled -
+    детектор блокировок, иначе только задержка цикла в метриках.
+    """
+    if getattr(config, 'loop_watchdog_enabled', False):
+        return LoopWatchdog(name, config.loop_watchdog_threshold, config.loop_watchdog_interval).run()
+    return track_loop_lag(name)
@@ -0,0 +1,330 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    """Метрика с метками: значения по наборам меток создаются при первом обращении"""
+
+    TYPE = ''
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _new_child(self):
+        """Новое значение для набора меток"""
+
+    def labels(self, *values: str):
+        """Значение для набора меток (ссылку можно сохранить и обновлять без поиска)"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name}: expected labels {self.label_names}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(суффикс имени, метки, значение) для текстового формата"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        self.labels(*label_values).inc(amount)
+
+    def samples(self):
+        return [('_total' if not self.name.endswith('_total') else '',
+                 _format_labels(self.label_names, key), child.value)
+                for key, child in sorted(self._children.items())]
+
+
+class Gauge(_Metric):
+    """Текущее значение; set_function - значение вычисляется при чтении метрик"""
+
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, *label_values: str, value: float):
+        self.labels(*label_values).set(value)
+
+    def set_function(self, *label_values: str, function: Callable[[], float]):
+        with self._lock:
+            self._functions[tuple(str(value) for value in label_values)] = function
+
+    def samples(self):
+        values = {key: child.value for key, child in self._children.items()}
+        for key, function in list(self._functions.items()):
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name}{key} failed: {str(e)}")
+        return [('', _format_labels(self.label_names, key), value) for key, value in sorted(values.items())]
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, *label_values: str, value: float):
+        self.labels(*label_values).observe(value)
+
+    def samples(self):
+        samples = []
+        for key, child in sorted(self._children.items()):
+            with child._lock:
+                counts, total_sum = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', _format_labels(self.label_names, key, f'le="{_format_value(bound)}"'),
+                                cumulative))
+            samples.append(('_sum', _format_labels(self.label_names, key), total_sum))
+            samples.append(('_count', _format_labels(self.label_names, key), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса, отдается в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Метрики движков автоматизации
+TRACKS_PLAYED = REGISTRY.counter('music_tracks_played_total', 'Засчитанные проигрывания',
+                                 ('device', 'service'))
+SEARCH_LATENCY = REGISTRY.histogram('music_search_latency_seconds',
+                                    'Время от ввода запроса до загрузки результатов', ('service',))
+TRACKS_NOT_FOUND = REGISTRY.counter('music_tracks_not_found_total',
+                                    'Треки, не найденные или не включенные после поиска', ('service',))
+DEVICE_RECONNECTS = REGISTRY.counter('music_device_reconnects_total',
+                                     'Повторные подключения к устройству после ошибки', ('device',))
+PROXY_RESTARTS = REGISTRY.counter('music_proxy_restarts_total', 'Перезапуски прокси',
+                                  ('trigger', 'outcome'))
+ANR_HITS = REGISTRY.counter('music_anr_dialogs_total', 'Закрытые диалоги "приложение не отвечает"',
+                            ('service',))
+EXECUTOR_QUEUE_DEPTH = REGISTRY.gauge('music_executor_queue_depth', 'Задачи в очереди пула потоков',
+                                      ('executor',))
+LOOP_LAG = REGISTRY.gauge('music_event_loop_lag_seconds', 'Последняя задержка event loop', ('loop',))
+UPTIME = REGISTRY.gauge('music_process_uptime_seconds', 'Время работы процесса')
+
+_started = time.time()
+UPTIME.set_function(function=lambda: time.time() - _started)
+
+_executors: Dict[str, 'weakref.WeakSet'] = {}
+_executors_lock = threading.Lock()
+
+
+def watch_executor(name: str, executor) -> None:
+    """Глубина очереди пула потоков в метриках (пулы с одним именем суммируются)"""
+    with _executors_lock:
+        executors = _executors.get(name)
+        if executors is None:
+            executors = _executors[name] = weakref.WeakSet()
+            EXECUTOR_QUEUE_DEPTH.set_function(
+                name, function=lambda: sum(item._work_queue.qsize() for item in list(executors))
+            )
+        executors.add(executor)
+
+
+async def track_loop_lag(name: str, interval: float = 1.0):
+    """
+    Замер задержки event loop: насколько позже запланированного просыпается sleep.
+    Запускается задачей в цикле движка и работает до отмены.
+    """
+    gauge = LOOP_LAG.labels(name)
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        gauge.set(max(0.0, loop.time() - expected))
+
+
+class MetricsServer:
+    """Локальный HTTP endpoint метрик: GET /metrics в текстовом формате Prometheus"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9108, registry: MetricsRegistry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _make_handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics {self.client_address[0]}: {format % args}")
+
+        return Handler
+
+    def start(self) -> 'MetricsServer':
+        """Запуск сервера в фоновом потоке"""
+        if self._server is not None:
+            return self
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='metrics-server', daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics endpoint: http://{self.host}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
+
+
+_server: Optional[MetricsServer] = None
+
+
+def start_metrics_server(config) -> Optional[MetricsServer]:
+    """Endpoint метрик процесса по config.metrics_port (0 - отключен); один на процесс"""
+    global _server
+    if _server is not None or not getattr(config, 'metrics_port', 0):
+        return _server
+    try:
+        _server = MetricsServer(config.metrics_host, config.metrics_port).start()
+    except OSError as e:
+        logger.error(f"Metrics endpoint not started: {str(e)}")
+    return _server
@@ -0,0 +1,80 @@
+import logging
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeEndpoint:
+    """
+    Локальный HTTP endpoint для проверки связности устройств.
+
+    Отвечает 204 на /generate_204 (как connectivitycheck) и считает
+    обращения по адресам клиентов. Используется вместо внешнего сервиса,
+    когда в настройках не задан proxy_check_url.
+    """
+
+    PATH = '/generate_204'
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 0):
+        self.host = host
+        self.port = port
+        self.hits = Counter()  # client ip -> количество успешных обращений
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _make_handler(self):
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != endpoint.PATH:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                with endpoint._lock:
+                    endpoint.hits[self.client_address[0]] += 1
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # Не засоряем общий лог обращениями устройств
+                logger.debug(f"Probe {self.client_address[0]}: {format % args}")
+
+        return Handler
+
+    def start(self) -> 'ProbeEndpoint':
+        """Запуск сервера в фоновом потоке"""
+        if self._server is not None:
+            return self
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='probe-endpoint', daemon=True)
+        self._thread.start()
+        logger.info(f"Probe endpoint listening on {self.host}:{self.port}")
+        return self
+
+    def url_for(self, reachable_host: str) -> str:
+        """URL, по которому устройство может достучаться до endpoint"""
+        return f"http://{reachable_host}:{self.port}{self.PATH}"
+
+    def stop(self):
+        """Остановка сервера"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
+        logger.info("Probe endpoint stopped")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
@@ -0,0 +1,202 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+POOL_SUFFIX_RE = re.compile(r'_\d+$')
+OTHER_STACK = '[other]'
+
+
+def _thread_group(name: str) -> str:
+    """Потоки пула сводятся к имени пула: lifecycle_3 -> lifecycle"""
+    return POOL_SUFFIX_RE.sub('', name)
+
+
+def collapse_stack(frame, thread_name: str) -> str:
+    """Стек потока в формате collapsed stacks: поток;внешний;...;внутренний"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    frames.append(_thread_group(thread_name))
+    frames.reverse()
+    return ';'.join(frames)
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик для многодневных запусков.
+
+    Фоновый поток раз в interval секунд снимает стеки всех потоков процесса
+    (включая пулы search_and_play_sync и потоки опроса прокси) и
+    считает одинаковые стеки. Результат - stacks.folded в формате collapsed
+    stacks (flamegraph.pl, speedscope). Параллельно раз в snapshot_interval
+    секунд сохраняется снимок tracemalloc и отчет о росте памяти относительно
+    предыдущего снимка.
+
+    Файлы сессии: data/profiles/<начало сессии>/.
+    """
+
+    MAX_STACKS = 200000  # Дальше новые уникальные стеки считаются в [other]
+
+    def __init__(self, directory: str = 'data/profiles', interval: float = 0.02,
+                 snapshot_interval: float = 3600, tracemalloc_frames: int = 10):
+        self.interval = max(0.001, float(interval))
+        self.snapshot_interval = max(60.0, float(snapshot_interval))
+        self.tracemalloc_frames = max(1, int(tracemalloc_frames))
+        self.directory = os.path.join(directory, datetime.now().strftime('%Y%m%d_%H%M%S'))
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started: Optional[float] = None
+        self._own_tracemalloc = False
+        self._snapshots = 0
+        self._previous_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> 'SamplingProfiler':
+        if self._thread is not None:
+            return self
+        os.makedirs(self.directory, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self._own_tracemalloc = True
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"Profiling started: every {self.interval * 1000:.0f} ms, output {self.directory}")
+        return self
+
+    def _sample(self):
+        own = threading.get_ident()
+        names: Dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = collapse_stack(frame, names.get(ident, f"thread-{ident}"))
+            if stack not in self.stacks and len(self.stacks) >= self.MAX_STACKS:
+                stack = OTHER_STACK
+            self.stacks[stack] += 1
+        self.samples += 1
+
+    def _run(self):
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+                if time.monotonic() >= next_snapshot:
+                    next_snapshot += self.snapshot_interval
+                    self.write_stacks()
+                    self.take_snapshot()
+            except Exception as e:
+                logger.error(f"Profiler sample failed: {str(e)}")
+
+    def write_stacks(self) -> str:
+        """Запись накопленных стеков (перезаписывается - файл всегда содержит всю сессию)"""
+        path = os.path.join(self.directory, 'stacks.folded')
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(temp_path, path)
+        return path
+
+    def take_snapshot(self) -> Optional[str]:
+        """Снимок tracemalloc и отчет о росте памяти с предыдущего снимка"""
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        self._snapshots += 1
+        name = f"mem_{self._snapshots:03d}_{datetime.now().strftime('%H%M')}"
+        path = os.path.join(self.directory, f"{name}.snap")
+        snapshot.dump(path)
+        if self._previous_snapshot is not None:
+            with open(os.path.join(self.directory, f"{name}.diff.txt"), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(format_snapshot_diff(self._previous_snapshot, snapshot)) + '\n')
+        self._previous_snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info(f"Memory snapshot {name}: traced {current / 1048576:.1f} MB (peak {peak / 1048576:.1f} MB)")
+        return path
+
+    def stop(self) -> str:
+        """Остановка: запись стеков и финальный снимок памяти. Возвращает каталог сессии"""
+        if self._thread is None:
+            return self.directory
+        self._stop.set()
+        self._thread.join(5)
+        self._thread = None
+        self.write_stacks()
+        self.take_snapshot()
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+        logger.info(f"Profiling stopped: {self.samples} samples in {time.time() - self.started:.0f}s, "
+                    f"output {self.directory}")
+        return self.directory
+
+
+def format_snapshot_diff(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot,
+                         key_type: str = 'lineno', limit: int = 30) -> List[str]:
+    """Строки, по которым память выросла сильнее всего"""
+    lines = []
+    for stat in new.compare_to(old, key_type)[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  "
+                     f"{frame.filename}:{frame.lineno}")
+    return lines
+
+
+# --- Профилирование процесса по запросу ---
+
+_profiler: Optional[SamplingProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def start_profiling(config=None) -> SamplingProfiler:
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            options = {}
+            if config is not None:
+                options = dict(directory=config.profiler_dir, interval=config.profiler_interval,
+                               snapshot_interval=config.profiler_snapshot_interval,
+                               tracemalloc_frames=config.profiler_tracemalloc_frames)
+            _profiler = SamplingProfiler(**options).start()
+        return _profiler
+
+
+def stop_profiling() -> Optional[str]:
+    """Остановка профилирования; каталог с результатами или None, если не запущено"""
+    global _profiler
+    with _profiler_lock:
+        profiler, _profiler = _profiler, None
+    return profiler.stop() if profiler else None
+
+
+def is_profiling() -> bool:
+    return _profiler is not None
+
+
+def toggle_profiling(config=None) -> Optional[str]:
+    """Запуск или остановка; при остановке возвращает каталог с результатами"""
+    if is_profiling():
+        return stop_profiling()
+    start_profiling(config)
+    return None
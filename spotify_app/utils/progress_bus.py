@@ -0,0 +1,67 @@
+import logging
+import threading
+from typing import Dict, List, NamedTuple, Tuple
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressUpdate(NamedTuple):
+    """Прогресс устройства в числах (service пустой вне Mix-режима)"""
+    device_id: str
+    played: int
+    total: int
+    service: str = ''
+
+    @property
+    def percent(self) -> float:
+        return self.played / self.total * 100 if self.total > 0 else 0.0
+
+
+def format_progress(played: int, total: int) -> str:
+    """Строка прогресса 'N/M (X%)' для сигналов progress_updated и логов"""
+    if total <= 0:
+        return f"{played}/0 (0.0%)"
+    return f"{played}/{total} ({(played / total * 100):.1f}%)"
+
+
+class ProgressBus(QObject):
+    """
+    Шина прогресса устройств для UI.
+
+    Рабочие потоки вызывают publish() (потокобезопасно, без сигналов Qt);
+    обновления одного устройства и сервиса схлопываются до последнего, и раз
+    в кадр (fps) поток UI получает их одним сигналом progress_batch. При сотнях
+    устройств UI обрабатывает не больше одного обновления на карточку за кадр.
+    """
+
+    progress_batch = pyqtSignal(list)  # [ProgressUpdate]
+
+    def __init__(self, parent=None, fps: int = 10):
+        super().__init__(parent)
+        self._pending: Dict[Tuple[str, str], ProgressUpdate] = {}
+        self._lock = threading.Lock()
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, 1000 // max(1, fps)))
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def publish(self, device_id: str, played: int, total: int, service: str = ''):
+        """Новый прогресс устройства (вызывается из любого потока)"""
+        update = ProgressUpdate(device_id, played, total, service)
+        with self._lock:
+            self._pending[(device_id, service)] = update
+
+    def flush(self):
+        """Отправка накопленных обновлений (таймер в потоке UI)"""
+        with self._lock:
+            if not self._pending:
+                return
+            updates: List[ProgressUpdate] = list(self._pending.values())
+            self._pending = {}
+        self.progress_batch.emit(updates)
+
+    def stop(self):
+        self._timer.stop()
+        self.flush()
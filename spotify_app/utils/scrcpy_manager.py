@@ -1,30 +1,54 @@
-import subprocess
 import os
 import logging
-import signal
-import time
 import sys
+import time
+from collections import deque
 from pathlib import Path
-import tempfile
-import threading
+
+from PyQt6.QtCore import QObject, QProcess, QTimer, pyqtSignal
 
 logger = logging.getLogger(__name__)
 
-class ScrcpyManager:
-    def __init__(self, resources_path='resources'):
+# Состояния окна scrcpy устройства (сигнал state_changed)
+STARTING = 'starting'
+RUNNING = 'running'
+STOPPED = 'stopped'
+FAILED = 'failed'
+
+CREATE_NO_WINDOW = 0x08000000  # Флаг CreateProcess: без окна консоли (Windows)
+STARTUP_GRACE = 1.0  # Завершение раньше - ошибка запуска (сек)
+STOP_TIMEOUT_MS = 1000  # После terminate процесс принудительно завершается
+IGNORED_OUTPUT = ("WARN: --rotation is deprecated",)
+
+
+class ScrcpyManager(QObject):
+    """
+    Супервизор процессов scrcpy на QProcess.
+
+    Запуск и остановка не блокируют поток UI: завершение процесса и ошибки
+    приходят сигналами QProcess в цикл событий Qt, вывод читается по
+    readyReadStandardOutput. Нет ни опроса процессов, ни потоков чтения.
+    Изменения состояния устройства (starting / running / stopped / failed)
+    передаются сигналом state_changed - UI обновляется только по ним.
+    """
+
+    state_changed = pyqtSignal(str, str)  # (device_id, состояние)
+
+    def __init__(self, resources_path='resources', parent=None):
         """
         Инициализация менеджера scrcpy
         
         :param resources_path: Путь к директории с ресурсами (по умолчанию 'resources')
         """
+        super().__init__(parent)
         self.resources_path = resources_path
-        self.active_processes = {}  # device_id -> process
+        self.active_processes = {}  # device_id -> QProcess
+        self._started_at = {}  # device_id -> время запуска
+        self._output = {}  # device_id -> последние строки вывода
+        self._stopping = set()  # Остановлены пользователем: выход не считается ошибкой
         # Определяем реальный путь к scrcpy при инициализации
         self.scrcpy_path = self._find_scrcpy_path()
         logger.info(f"Инициализирован ScrcpyManager, путь к scrcpy: {self.scrcpy_path}")
-        
-        # Запускаем отдельный поток для мониторинга процессов
-        self._start_monitor_thread()
     
     def _find_scrcpy_path(self):
         """
@@ -73,83 +97,30 @@ class ScrcpyManager:
         """Возвращает путь к scrcpy.exe"""
         return self.scrcpy_path
     
-    def _start_monitor_thread(self):
-        """Запускает поток для мониторинга процессов"""
-        self.monitor_thread = threading.Thread(target=self._monitor_processes, daemon=True)
-        self.monitor_thread.start()
-    
-    def _monitor_processes(self):
-        """Мониторит все запущенные процессы и удаляет завершенные"""
-        while True:
-            try:
-                # Копируем список ключей для безопасной итерации
-                device_ids = list(self.active_processes.keys())
-                
-                for device_id in device_ids:
-                    process = self.active_processes.get(device_id)
-                    if process and process.poll() is not None:
-                        # Процесс завершился
-                        logger.info(f"Процесс scrcpy для устройства {device_id} завершился с кодом {process.returncode}")
-                        # Проверяем, не было ли ошибок
-                        if process.returncode != 0:
-                            stderr = process.stderr.read().decode('utf-8', errors='ignore') if process.stderr else ""
-                            if stderr and not stderr.startswith("WARN: --rotation is deprecated"):
-                                logger.warning(f"Ошибка процесса scrcpy для {device_id}: {stderr}")
-                        # Удаляем из активных
-                        del self.active_processes[device_id]
-            except Exception as e:
-                logger.error(f"Ошибка в мониторинге процессов: {str(e)}")
-            
-            # Спим перед следующей проверкой
-            time.sleep(2)
-    
-    def start_scrcpy(self, device_id, window_title=None, enable_control=True, show_touches=True):
-        """
-        Запускает scrcpy для указанного устройства
-        
-        :param device_id: ID устройства (IP:порт для TCP/IP)
-        :param window_title: Название окна (опционально)
-        :param enable_control: Разрешить управление устройством (мышь, клавиатура)
-        :param show_touches: Показывать касания на экране
-        :return: True если запуск успешен, иначе False
-        """
-        if device_id in self.active_processes:
-            # Проверяем, запущен ли процесс
-            if self.active_processes[device_id].poll() is None:
-                logger.info(f"scrcpy уже запущен для устройства {device_id}")
-                return False
-        
-        scrcpy_path = self.get_scrcpy_path()
-        if not os.path.exists(scrcpy_path):
-            logger.error(f"scrcpy не найден по пути: {scrcpy_path}")
-            return False
-        
-        # Формируем команду
-        command = []
-        
-        # Добавляем путь к исполняемому файлу
-        command.append(scrcpy_path)
+    def _build_arguments(self, device_id, window_title, enable_control, show_touches):
+        """Аргументы командной строки scrcpy"""
+        arguments = []
         
         # Определяем, используется ли TCP/IP или USB
         if ':' in device_id:  # TCP/IP (IP:порт)
-            command.extend(['--tcpip', device_id])
+            arguments.extend(['--tcpip', device_id])
         else:  # USB
-            command.extend(['-s', device_id])
+            arguments.extend(['-s', device_id])
         
         # Дополнительные параметры
         if window_title:
-            command.extend(['--window-title', window_title])
+            arguments.extend(['--window-title', window_title])
         
         # Управление
         if not enable_control:
-            command.append('--no-control')
+            arguments.append('--no-control')
         
         # Показ касаний
         if show_touches:
-            command.append('--show-touches')
+            arguments.append('--show-touches')
         
         # Полезные опции (используем display-orientation вместо устаревшего rotation)
-        command.extend([
+        arguments.extend([
             '--no-audio',                     # Без звука
             '--stay-awake',                   # Держать устройство активным
             # '--window-borderless',            # Без рамки окна
@@ -163,122 +134,156 @@ class ScrcpyManager:
             '--push-target', '/sdcard/Download', # Директория для передачи файлов
 
         ])
-
-        try:
-            # Логируем команду только в debug режиме, а не в обычном info режиме
-            logger.debug(f"Запуск scrcpy с командой: {' '.join(command)}")
-            
-            # Скрываем вывод консоли при запуске процесса
-            startupinfo = None
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = 0  # SW_HIDE
-            
-            # Запускаем процесс
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.PIPE,
-                creationflags=subprocess.CREATE_NO_WINDOW | (subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0)
-            )
-            
-            # Проверяем, что процесс запустился
-            time.sleep(1)
-            if process.poll() is not None:
-                stderr = process.stderr.read().decode('utf-8', errors='ignore')
-                logger.error(f"Не удалось запустить scrcpy: {stderr}")
-                return False
-            
-            self.active_processes[device_id] = process
-            logger.info(f"Мониторинг устройства {device_id} запущен")  # Более короткое сообщение
-            
-            # Запускаем отдельный поток для чтения вывода процесса
-            threading.Thread(
-                target=self._read_process_output,
-                args=(device_id, process),
-                daemon=True
-            ).start()
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"Ошибка запуска scrcpy: {str(e)}")
+        return arguments
+    
+    def start_scrcpy(self, device_id, window_title=None, enable_control=True, show_touches=True):
+        """
+        Запускает scrcpy для указанного устройства (не блокирует поток UI)
+        
+        :param device_id: ID устройства (IP:порт для TCP/IP)
+        :param window_title: Название окна (опционально)
+        :param enable_control: Разрешить управление устройством (мышь, клавиатура)
+        :param show_touches: Показывать касания на экране
+        :return: True если запуск начат; результат придет сигналом state_changed
+        """
+        if self.is_running(device_id):
+            logger.info(f"scrcpy уже запущен для устройства {device_id}")
             return False
+        
+        scrcpy_path = self.get_scrcpy_path()
+        if not os.path.exists(scrcpy_path):
+            logger.error(f"scrcpy не найден по пути: {scrcpy_path}")
+            return False
+        
+        arguments = self._build_arguments(device_id, window_title, enable_control, show_touches)
+        logger.debug(f"Запуск scrcpy с командой: {scrcpy_path} {' '.join(arguments)}")
+        
+        process = QProcess(self)
+        process.setProgram(scrcpy_path)
+        process.setArguments(arguments)
+        process.setProcessChannelMode(QProcess.ProcessChannelMode.MergedChannels)
+        process.setStandardInputFile(QProcess.nullDevice())
+        # Скрываем окно консоли (модификатор есть только в сборках Qt для Windows)
+        if os.name == 'nt' and hasattr(process, 'setCreateProcessArgumentsModifier'):
+            process.setCreateProcessArgumentsModifier(
+                lambda args: setattr(args, 'flags', args.flags | CREATE_NO_WINDOW)
+            )
+        
+        process.readyReadStandardOutput.connect(lambda: self._read_output(device_id, process))
+        process.started.connect(lambda: self._on_started(device_id, process))
+        process.errorOccurred.connect(lambda error: self._on_error(device_id, process, error))
+        process.finished.connect(lambda code, status: self._on_finished(device_id, process, code, status))
+        
+        self.active_processes[device_id] = process
+        self._started_at[device_id] = time.monotonic()
+        self._output[device_id] = deque(maxlen=20)
+        self._stopping.discard(device_id)
+        self.state_changed.emit(device_id, STARTING)
+        process.start()
+        return True
+    
+    def _is_current(self, device_id, process):
+        """Сигнал от актуального процесса устройства (не от уже замененного)"""
+        return self.active_processes.get(device_id) is process
+    
+    def _read_output(self, device_id, process):
+        """Вывод процесса по сигналу readyReadStandardOutput"""
+        data = bytes(process.readAllStandardOutput()).decode('utf-8', errors='ignore')
+        output = self._output.get(device_id)
+        for line in data.splitlines():
+            line = line.strip()
+            if not line or line.startswith(IGNORED_OUTPUT):
+                continue
+            logger.debug(f"scrcpy [{device_id}]: {line}")
+            if output is not None and self._is_current(device_id, process):
+                output.append(line)
+    
+    def _on_started(self, device_id, process):
+        if self._is_current(device_id, process):
+            logger.info(f"Мониторинг устройства {device_id} запущен")
+            self.state_changed.emit(device_id, RUNNING)
     
-    def _read_process_output(self, device_id, process):
-        """Читает вывод процесса в отдельном потоке"""
-        try:
-            for line in iter(process.stdout.readline, b''):
-                line_str = line.decode('utf-8', errors='ignore').strip()
-                if line_str:
-                    logger.debug(f"scrcpy [{device_id}]: {line_str}")
-                    
-            # Читаем stderr, если процесс завершился с ошибкой
-            if process.poll() is not None and process.returncode != 0:
-                stderr = process.stderr.read().decode('utf-8', errors='ignore')
-                if stderr and not stderr.startswith("WARN: --rotation is deprecated"):
-                    logger.warning(f"scrcpy [{device_id}] error: {stderr}")
-                    
-        except Exception as e:
-            logger.error(f"Ошибка чтения вывода процесса scrcpy для {device_id}: {str(e)}")
+    def _on_error(self, device_id, process, error):
+        """Ошибка QProcess; FailedToStart приходит без finished"""
+        if error != QProcess.ProcessError.FailedToStart:
+            return  # Падение и прочее обработает finished
+        if self._is_current(device_id, process):
+            logger.error(f"Не удалось запустить scrcpy для {device_id}: {process.errorString()}")
+            self._forget(device_id)
+            self.state_changed.emit(device_id, FAILED)
+        process.deleteLater()
     
-    def stop_scrcpy(self, device_id):
+    def _on_finished(self, device_id, process, exit_code, exit_status):
+        """Завершение процесса: окно закрыто пользователем, остановлено или упало"""
+        self._read_output(device_id, process)
+        if self._is_current(device_id, process):
+            stopped = device_id in self._stopping
+            lifetime = time.monotonic() - self._started_at.get(device_id, 0.0)
+            output = '\n'.join(self._output.get(device_id, ()))
+            self._forget(device_id)
+            crashed = exit_status == QProcess.ExitStatus.CrashExit or exit_code != 0
+            if stopped:
+                logger.info(f"scrcpy остановлен для устройства {device_id}")
+                self.state_changed.emit(device_id, STOPPED)
+            elif crashed and lifetime < STARTUP_GRACE:
+                logger.error(f"Не удалось запустить scrcpy: {output}")
+                self.state_changed.emit(device_id, FAILED)
+            else:
+                logger.info(f"Процесс scrcpy для устройства {device_id} завершился с кодом {exit_code}")
+                if crashed and output:
+                    logger.warning(f"Ошибка процесса scrcpy для {device_id}: {output}")
+                self.state_changed.emit(device_id, STOPPED)
+        process.deleteLater()
+    
+    def _forget(self, device_id):
+        self.active_processes.pop(device_id, None)
+        self._started_at.pop(device_id, None)
+        self._output.pop(device_id, None)
+        self._stopping.discard(device_id)
+    
+    def stop_scrcpy(self, device_id, wait=False):
         """
         Останавливает scrcpy для указанного устройства
         
         :param device_id: ID устройства
-        :return: True если остановка успешна, иначе False
+        :param wait: Дождаться завершения (только при закрытии приложения)
+        :return: True если остановка начата; завершение придет сигналом state_changed
         """
-        if device_id not in self.active_processes:
+        process = self.active_processes.get(device_id)
+        if process is None:
             logger.warning(f"Устройство {device_id} не найдено в активных процессах")
             return False
-            
-        process = self.active_processes[device_id]
-        if process.poll() is None:  # Проверяем, что процесс еще запущен
-            try:
-                # Отправляем сигнал завершения
-                if os.name == 'nt':  # Windows
-                    process.terminate()
-                else:  # Linux/Mac
-                    process.send_signal(signal.SIGTERM)
-                
-                # Ждем немного для корректного завершения
-                for _ in range(10):  # Ожидаем до 1 секунды
-                    if process.poll() is not None:
-                        break  # Процесс завершился
-                    time.sleep(0.1)
-                
-                # Если процесс все еще запущен, принудительно завершаем
-                if process.poll() is None:
-                    process.kill()
-                    process.wait(timeout=1)  # Ожидаем завершения процесса
-                    
-                del self.active_processes[device_id]
-                logger.info(f"scrcpy остановлен для устройства {device_id}")
-                return True
-                
-            except Exception as e:
-                logger.error(f"Ошибка остановки scrcpy: {str(e)}")
-                return False
-        else:
-            # Процесс уже завершен
-            del self.active_processes[device_id]
-            logger.info(f"Процесс для устройства {device_id} уже был завершен")
+        
+        self._stopping.add(device_id)
+        if process.state() == QProcess.ProcessState.NotRunning:
+            self._forget(device_id)
+            self.state_changed.emit(device_id, STOPPED)
             return True
+        
+        process.terminate()
+        if wait:
+            if not process.waitForFinished(STOP_TIMEOUT_MS):
+                process.kill()
+                process.waitForFinished(STOP_TIMEOUT_MS)
+        else:
+            # Если процесс не закрылся сам, принудительно завершаем
+            QTimer.singleShot(STOP_TIMEOUT_MS, lambda: self._kill_if_running(device_id, process))
+        return True
+    
+    def _kill_if_running(self, device_id, process):
+        if self._is_current(device_id, process) and process.state() != QProcess.ProcessState.NotRunning:
+            logger.warning(f"scrcpy для {device_id} не завершился, принудительная остановка")
+            process.kill()
             
-    def stop_all(self):
+    def stop_all(self, wait=False):
         """Останавливает все запущенные процессы scrcpy"""
         logger.info("Останавливаем все процессы scrcpy")
-        device_ids = list(self.active_processes.keys())
         success = True
         
-        for device_id in device_ids:
-            if not self.stop_scrcpy(device_id):
+        for device_id in list(self.active_processes):
+            if not self.stop_scrcpy(device_id, wait=wait):
                 success = False
         
-        self.active_processes = {}
         return success
     
     def is_running(self, device_id):
@@ -286,13 +291,10 @@ class ScrcpyManager:
         Проверяет, запущен ли scrcpy для указанного устройства
         
         :param device_id: ID устройства
-        :return: True если запущен, иначе False
+        :return: True если запущен (или запускается), иначе False
         """
-        if device_id not in self.active_processes:
-            return False
-            
-        process = self.active_processes[device_id]
-        return process.poll() is None  # None означает, что процесс еще запущен
+        process = self.active_processes.get(device_id)
+        return process is not None and process.state() != QProcess.ProcessState.NotRunning
     
     def get_running_devices(self):
         """
@@ -300,11 +302,7 @@ class ScrcpyManager:
         
         :return: Список ID устройств
         """
-        # Копируем ключи для безопасности
-        devices = list(self.active_processes.keys())
-        # Фильтруем только активные процессы
-        return [device_id for device_id in devices 
-                if self.active_processes[device_id].poll() is None]
+        return [device_id for device_id in list(self.active_processes) if self.is_running(device_id)]
     
     def get_device_process_info(self, device_id):
         """
@@ -313,14 +311,14 @@ class ScrcpyManager:
         :param device_id: ID устройства
         :return: Словарь с информацией о процессе или None, если устройство не найдено
         """
-        if device_id not in self.active_processes:
+        process = self.active_processes.get(device_id)
+        if process is None:
             return None
-            
-        process = self.active_processes[device_id]
         
+        running = process.state() != QProcess.ProcessState.NotRunning
         return {
-            'pid': process.pid,
-            'running': process.poll() is None,
-            'return_code': process.poll(),
-            'command': ' '.join(process.args) if hasattr(process, 'args') else None
-        }
\ No newline at end of file
+            'pid': process.processId(),
+            'running': running,
+            'return_code': None if running else process.exitCode(),
+            'command': ' '.join([process.program()] + process.arguments())
+        }